@@ -0,0 +1,617 @@
+import sys
+import os
+import re
+import json
+import time
+import random
+import tempfile
+import threading
+import subprocess
+import contextlib
+import unicodedata
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# ====================== 【离线基准测试：本地模拟直播源站 + 咪咕接口，不访问任何外网】 ======================
+# 用法：python bench.py [probe|migu|classify|breaker|all] [条目数 ...]（breaker 的条目数为检查轮数）
+#   probe   ：main.py 源列表获取+测速筛选全流程（list → 解析 → 测速 → 排序）
+#   migu    ：mains.py 分类列表+播放地址接口+302解析全流程
+#   classify：classify.py 分类引擎与重构前的分类/排序函数对照（两个脚本的规则各跑一遍，核对分类与分类内顺序）
+#   breaker ：源站熔断半开复测回归检查（镜像选满后跳过的/被竞速取消的复测必须交还复测资格，否则整轮测速卡死）
+# 备注：每个场景在独立子进程中运行，峰值内存互不影响；结果追加写入 BENCH_RESULTS_FILE，并与同场景上一次结果对比
+
+# ---------------------- 【基准场景配置】 ----------------------
+# 备注：默认测试的条目数，100000 条目的测速场景按默认并发需要运行约1小时，需要时在命令行指定
+BENCH_SIZES = [100, 1000]
+# 备注：分类场景默认的频道名数量（纯计算，不访问模拟服务器）
+BENCH_CLASSIFY_SIZES = [100000]
+# 备注：熔断回归场景默认的重复轮数，及子进程的最长运行时间（秒），超时即判定复测资格未交还导致测速卡死
+BENCH_BREAKER_SIZES = [20]
+BENCH_BREAKER_TIMEOUT = 120
+# 备注：分类场景中不重复的频道名比例（真实合并源列表中同名频道大量重复，缓存命中率与之相关）
+BENCH_CLASSIFY_UNIQUE_RATE = 0.2
+# 备注：历史结果文件（每行一条JSON，含提交号），用于追踪每次改动前后的性能变化
+BENCH_RESULTS_FILE = "bench_results.jsonl"
+# 备注：随机种子固定，同一条目数每次生成完全相同的源列表与源站行为，结果可横向对比
+BENCH_SEED = 20260101
+# 备注：模拟的源站数量，分别监听 127.0.0.1 ~ 127.0.0.N（同一端口），按host区分的并发限制/熔断与真实场景一致
+BENCH_ORIGIN_HOSTS = 8
+
+# ---------------------- 【模拟源站行为配置】 ----------------------
+# 备注：各类源的占比（合计为1），hang 类全部放在最后一个源站，模拟整站失联
+BENCH_ORIGIN_MIX = {
+    "fast": 0.47,      # 达标直播流（TS）
+    "html": 0.03,      # 返回200的网页（CDN错误页/认证页），带宽达标但不是音视频
+    "slow": 0.15,      # 带宽不达标的直播流
+    "hls": 0.12,       # 达标HLS（主列表→媒体列表→分片）
+    "hls_slow": 0.05,  # 分片下载跟不上播放速度的HLS
+    "redirect": 0.08,  # 302跳转后的达标直播流
+    "error": 0.06,     # 直接返回4xx/5xx
+    "hang": 0.04,      # 接受连接但不返回响应头
+}
+# 备注：达标/不达标源的带宽（KB/s），与 main.MIN_PLAY_SPEED(500) 拉开足够距离，保证判定结果有唯一正确答案
+BENCH_FAST_KBPS = 3000
+BENCH_SLOW_KBPS = 100
+# 备注：每个源返回响应头前的随机延迟范围（毫秒）
+BENCH_LATENCY_MS = (10, 200)
+# 备注：hang 类源保持连接不响应的时长（秒），应大于 main.READ_TIMEOUT
+BENCH_HANG_SECONDS = 30
+# 备注：HLS分片时长（秒）与分片大小（字节）
+BENCH_HLS_SEGMENT_SECONDS = 4.0
+BENCH_HLS_SEGMENT_BYTES = 1024 * 512
+
+# ---------------------- 【模拟咪咕接口配置】 ----------------------
+# 备注：播放地址接口返回非200错误码的比例（按pID固定，不随重试变化）
+BENCH_MIGU_ERROR_RATE = 0.05
+# 备注：在其他分类中重复出现的频道比例，用于验证跨分类pID去重
+BENCH_MIGU_DUP_RATE = 0.10
+# 备注：签名播放地址的有效期（秒），写入跳转后地址的 expires 参数
+BENCH_MIGU_URL_TTL = 3600
+
+# 备注：直播流每次写出的时间片（秒），按带宽限速写出
+STREAM_TICK = 0.05
+TS_PACKET = b'\x47' + b'\x00' * 187
+
+
+# ---------------------- 【场景数据生成（父子进程用同一种子生成，结果一致）】 ----------------------
+def build_origin_plan(size):
+    """生成测速场景的源列表计划：[(频道名, 源类型, 源站序号, 延迟毫秒)]，hang 类固定落在最后一个源站"""
+    rng = random.Random(BENCH_SEED + size)
+    kinds = list(BENCH_ORIGIN_MIX)
+    weights = [BENCH_ORIGIN_MIX[kind] for kind in kinds]
+    plan = []
+    for index in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        host_index = BENCH_ORIGIN_HOSTS - 1 if kind == "hang" else rng.randrange(max(BENCH_ORIGIN_HOSTS - 1, 1))
+        plan.append((f"基准频道{index}", kind, host_index, rng.randint(*BENCH_LATENCY_MS)))
+    return plan
+
+
+def is_expected_valid(kind):
+    """源类型对应的正确判定结果"""
+    return kind in ("fast", "hls", "redirect")
+
+
+def build_migu_plan(size, category_ids):
+    """生成咪咕场景的分类频道计划：{分类ID: [(pID, 频道名)]}，部分频道在其他分类重复出现"""
+    rng = random.Random(BENCH_SEED + size)
+    words = ['卫视', '电影', '新闻', '少儿', '综艺', '纪实']
+    plan = {category_id: [] for category_id in category_ids}
+    all_channels = []
+    for index in range(size):
+        channel = (f"bench{index:06d}", f"基准{words[index % len(words)]}{index}")
+        plan[category_ids[index % len(category_ids)]].append(channel)
+        all_channels.append(channel)
+    for channel in rng.sample(all_channels, int(size * BENCH_MIGU_DUP_RATE)):
+        plan[rng.choice(category_ids)].append(channel)
+    return plan
+
+
+def is_migu_error(pid):
+    """按pID固定决定播放地址接口是否返回错误码"""
+    return random.Random(f"{BENCH_SEED}-{pid}").random() < BENCH_MIGU_ERROR_RATE
+
+
+# ---------------------- 【模拟服务器】 ----------------------
+class BenchHandler(BaseHTTPRequestHandler):
+    """模拟源站+咪咕接口：路径决定行为，查询参数 bw(KB/s)/lat(毫秒) 决定带宽与首字节延迟"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200, extra_headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_throttled(self, total_bytes, kbps, content_type):
+        """按带宽限速写出数据，客户端提前断开即结束"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(total_bytes))
+        self.end_headers()
+        chunk = TS_PACKET * max(1, int(kbps * 1024 * STREAM_TICK) // len(TS_PACKET))
+        sent = 0
+        try:
+            while sent < total_bytes:
+                data = chunk[:total_bytes - sent]
+                self.wfile.write(data)
+                sent += len(data)
+                time.sleep(STREAM_TICK)
+        except OSError:
+            self.close_connection = True
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        parts = parsed.path.strip("/").split("/")
+        state = self.server.state
+        time.sleep(int(params.get("lat", 0)) / 1000)
+        kbps = int(params.get("bw", BENCH_FAST_KBPS))
+
+        if parsed.path == "/playlist.m3u":
+            self.send_body(state["playlist"], "audio/x-mpegurl")
+        elif parts[0] == "stream":
+            # 备注：直播流按64MB上限持续输出，测速端读够即断开
+            self.send_throttled(64 * 1024 * 1024, kbps, "video/mp2t")
+        elif parts[0] == "html":
+            body = b"<!DOCTYPE html><html><body>" + b"x" * (1024 * 1024) + b"</body></html>"
+            self.send_body(body, "text/html; charset=utf-8")
+        elif parts[0] == "redirect":
+            self.send_body(b"", "text/plain", 302, {"Location": f"/stream/{parts[1]}?bw={kbps}"})
+        elif parts[0] == "error":
+            self.send_body(b"error", "text/plain", 503 if int(parts[1]) % 2 else 404)
+        elif parts[0] == "hang":
+            time.sleep(BENCH_HANG_SECONDS)
+            self.close_connection = True
+        elif parts[0] == "hls" and parts[-1] == "master.m3u8":
+            body = (f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=800000\nlow.m3u8?bw={kbps}\n"
+                    f"#EXT-X-STREAM-INF:BANDWIDTH=4000000\nhigh.m3u8?bw={kbps}\n")
+            self.send_body(body.encode(), "application/vnd.apple.mpegurl")
+        elif parts[0] == "hls" and parts[-1].endswith(".m3u8"):
+            body = f"#EXTM3U\n#EXT-X-TARGETDURATION:{int(BENCH_HLS_SEGMENT_SECONDS)}\n#EXT-X-MEDIA-SEQUENCE:100\n"
+            body += "".join(f"#EXTINF:{BENCH_HLS_SEGMENT_SECONDS},\nseg{n}.ts?bw={kbps}\n" for n in range(100, 106))
+            self.send_body(body.encode(), "application/vnd.apple.mpegurl")
+        elif parts[0] == "hls":
+            self.send_throttled(BENCH_HLS_SEGMENT_BYTES, kbps, "video/mp2t")
+        elif parsed.path.startswith("/live/v2/tv-data/"):
+            data_list = [{"pID": pid, "name": name} for pid, name in state["migu"].get(parts[-1], [])]
+            self.send_body(json.dumps({"body": {"dataList": data_list}}).encode(), "application/json")
+        elif parsed.path == "/gateway/playurl/v3/play/playurl":
+            pid = params.get("contId", "")
+            if is_migu_error(pid):
+                body = {"code": "410", "message": "bench error"}
+            else:
+                body = {"code": "200", "body": {"urlInfo": {"url": f"{state['base_url']}/migu/{pid}"}}}
+            self.send_body(json.dumps(body).encode(), "application/json")
+        elif parts[0] == "migu":
+            expires = int(time.time()) + BENCH_MIGU_URL_TTL
+            self.send_body(b"x" * 4096, "text/plain", 302,
+                           {"Location": f"{state['base_url']}/stream/{parts[1]}.m3u8?expires={expires}"})
+        else:
+            self.send_body(b"not found", "text/plain", 404)
+
+
+class BenchServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # 备注：测速端读够数据/对冲落选后主动断开属于正常行为，不输出异常堆栈
+        pass
+
+
+def start_servers(state):
+    """在 127.0.0.1 ~ 127.0.0.N 的同一端口上各启动一个模拟源站；无法绑定多个回环地址时（如macOS）只用 127.0.0.1"""
+    servers = [BenchServer(("127.0.0.1", 0), BenchHandler)]
+    port = servers[0].server_address[1]
+    for index in range(2, BENCH_ORIGIN_HOSTS + 1):
+        try:
+            servers.append(BenchServer((f"127.0.0.{index}", port), BenchHandler))
+        except OSError:
+            break
+    for server in servers:
+        server.state = state
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    hosts = [f"127.0.0.{index + 1}" for index in range(len(servers))]
+    state["base_url"] = f"http://127.0.0.1:{port}"
+    return servers, hosts, port
+
+
+def origin_url(kind, index, host, port, latency_ms):
+    """源类型对应的模拟源地址"""
+    base = f"http://{host}:{port}"
+    if kind in ("fast", "slow"):
+        bw = BENCH_FAST_KBPS if kind == "fast" else BENCH_SLOW_KBPS
+        return f"{base}/stream/{index}.ts?bw={bw}&lat={latency_ms}"
+    if kind in ("hls", "hls_slow"):
+        bw = BENCH_FAST_KBPS if kind == "hls" else BENCH_SLOW_KBPS
+        return f"{base}/hls/{index}/master.m3u8?bw={bw}&lat={latency_ms}"
+    if kind == "redirect":
+        return f"{base}/redirect/{index}?bw={BENCH_FAST_KBPS}&lat={latency_ms}"
+    return f"{base}/{kind}/{index}?lat={latency_ms}"
+
+
+def build_playlist(plan, hosts, port):
+    """按计划生成M3U源列表文本，返回 (文本, {链接: 正确判定})"""
+    lines = ["#EXTM3U"]
+    expected = {}
+    for index, (name, kind, host_index, latency_ms) in enumerate(plan):
+        url = origin_url(kind, index, hosts[host_index % len(hosts)], port, latency_ms)
+        lines.append(f'#EXTINF:-1 group-title="基准",{name}')
+        lines.append(url)
+        expected[url] = is_expected_valid(kind)
+    return "\n".join(lines).encode(), expected
+
+
+# ---------------------- 【分类场景：重构前的分类/排序函数原样保留作对照】 ----------------------
+def legacy_extract_cctv_number(channel_name, ignore_case=True, cgtn_map=None):
+    match = re.search(r'CCTV[-\s]?(\d+)', channel_name, re.IGNORECASE if ignore_case else 0)
+    if match:
+        return int(match.group(1))
+    if 'CCTV' in channel_name or (cgtn_map is None and 'CGTN' in channel_name):
+        for k, v in (cgtn_map or {'法语': 1001, '西班牙语': 1002, '俄语': 1003, '阿拉伯语': 1004, '纪录': 1005}).items():
+            if k in channel_name:
+                return v
+        return 1000
+    return 9999
+
+
+def legacy_main_classify(channel_name, speed):
+    """main.py 原 smart_classify + get_sort_key"""
+    name_clean = channel_name.strip().upper()
+    if 'CCTV' in name_clean or 'CGTN' in name_clean or '中国教育' in name_clean:
+        category = "央视"
+    elif '卫视' in name_clean:
+        category = "卫视"
+    elif any(keyword in channel_name for keyword in ['电影', '影院', '影视', '大片', '院线', '影城']):
+        category = "电影"
+    elif any(keyword in channel_name for keyword in ['轮播', '循环', '24小时', '全天', '不间断', '全天候']):
+        category = "轮播"
+    else:
+        category = "其他"
+    base_weight = {"央视": 0, "卫视": 1, "电影": 2, "轮播": 3, "其他": 4}[category]
+    if category == "央视":
+        return category, (base_weight, legacy_extract_cctv_number(channel_name), channel_name)
+    if category == "卫视":
+        return category, (base_weight, unicodedata.normalize('NFKC', channel_name[0]).lower(), channel_name)
+    return category, (base_weight, -speed, channel_name)
+
+
+def legacy_extract_panda_number(channel_name):
+    zero_match = re.search(r'熊猫0(\d+)', channel_name)
+    if zero_match:
+        return (0, int(zero_match.group(1)))
+    normal_match = re.search(r'熊猫(\d+)', channel_name)
+    if normal_match:
+        return (1, int(normal_match.group(1)))
+    return (9999, 9999)
+
+
+def legacy_mains_classify(channel_name, speed):
+    """mains.py 原 smart_classify_5_categories + get_sort_key"""
+    if '熊猫' in channel_name:
+        category = '🐼熊猫频道'
+    elif 'CCTV' in channel_name or 'CGTN' in channel_name:
+        category = '📺央视频道'
+    elif '卫视' in channel_name:
+        category = '📡卫视频道'
+    elif any(keyword in channel_name for keyword in ['电影', '影视', '少儿', '卡通', '动漫', '综艺', '音乐', '戏曲']):
+        category = '🎬影音娱乐'
+    else:
+        category = '📰生活资讯'
+    if 'CCTV' in channel_name:
+        cgtn_map = {'法语': 1001, '西班牙语': 1002, '俄语': 1003, '阿拉伯语': 1004, '外语纪录': 1005}
+        return category, (0, legacy_extract_cctv_number(channel_name, False, cgtn_map), channel_name)
+    if '熊猫' in channel_name:
+        return category, (1, legacy_extract_panda_number(channel_name), channel_name)
+    if '卫视' in channel_name:
+        return category, (2, unicodedata.normalize('NFKC', channel_name[0]), channel_name)
+    return category, (3, channel_name)
+
+
+def build_classify_names(size):
+    """生成分类场景的 [(频道名, 速度)]：按真实源列表的命名习惯混合各类频道，同名频道按 BENCH_CLASSIFY_UNIQUE_RATE 重复出现"""
+    rng = random.Random(BENCH_SEED + size)
+    provinces = ['湖南', '浙江', '江苏', '东方', '北京', '广东', '深圳', '山东', '安徽', '天津', '重庆', '四川']
+    templates = [
+        lambda n: f"CCTV-{n % 17 + 1}{rng.choice(['', ' HD', '高清', '综合'])}",
+        lambda n: f"CCTV{n % 17 + 1}{rng.choice(['', '+', ' 4K'])}",
+        lambda n: f"CGTN{rng.choice(['', '法语', '西班牙语', '俄语', '阿拉伯语'])}",
+        lambda n: f"{rng.choice(provinces)}卫视{rng.choice(['', '高清', ' HD'])}",
+        lambda n: f"熊猫{rng.choice(['0', ''])}{n % 12 + 1}{rng.choice(['', '高清'])}",
+        lambda n: f"{rng.choice(['经典', '动作', '喜剧', '家庭'])}{rng.choice(['电影', '影院', '影视'])}{n}",
+        lambda n: f"{rng.choice(['少儿', '卡通', '综艺', '音乐', '戏曲'])}频道{n}",
+        lambda n: f"{rng.choice(['24小时', '全天候'])}{rng.choice(['轮播', '循环'])}{n}",
+        lambda n: f"{rng.choice(provinces)}{rng.choice(['新闻', '公共', '都市', '生活'])}{n}",
+    ]
+    unique_names = [rng.choice(templates)(index) for index in range(max(1, int(size * BENCH_CLASSIFY_UNIQUE_RATE)))]
+    return [(rng.choice(unique_names), rng.randint(100, 5000)) for _ in range(size)]
+
+
+def run_classify_scenario(size):
+    """分类引擎与原实现对照：返回 (引擎耗时, 原实现耗时, 分类不一致数, 分类内位置不一致数)，引擎耗时含规则编译"""
+    import classify
+    entries = build_classify_names(size)
+    profiles = [
+        ("main", ["央视", "卫视", "电影", "轮播", "其他"], legacy_main_classify),
+        ("mains", ['📺央视频道', '📡卫视频道', '🐼熊猫频道', '🎬影音娱乐', '📰生活资讯'], legacy_mains_classify),
+    ]
+    engine_time = legacy_time = 0.0
+    category_mismatch = order_mismatch = 0
+    for profile, category_order, legacy_classify in profiles:
+        start = time.perf_counter()
+        legacy = [legacy_classify(name, speed) for name, speed in entries]
+        legacy_time += time.perf_counter() - start
+        start = time.perf_counter()
+        classifier = classify.load_classifier(profile, category_order)
+        engine = [classifier.classify(name, speed) for name, speed in entries]
+        engine_time += time.perf_counter() - start
+        category_mismatch += sum(1 for old, new in zip(legacy, engine) if old[0] != new[0])
+        # 备注：两种排序键的分类序号含义不同，逐个分类比较分类内的排列顺序
+        legacy_groups, engine_groups = defaultdict(list), defaultdict(list)
+        for position, ((category, old_key), (_, new_key)) in enumerate(zip(legacy, engine)):
+            legacy_groups[category].append((old_key, position))
+            engine_groups[category].append((new_key, position))
+        for category, items in legacy_groups.items():
+            old_order = [position for _, position in sorted(items)]
+            new_order = [position for _, position in sorted(engine_groups[category])]
+            order_mismatch += sum(1 for old, new in zip(old_order, new_order) if old != new)
+    return engine_time, legacy_time, category_mismatch, order_mismatch
+
+
+def run_breaker_scenario(base_url, rounds):
+    """
+    熔断半开复测回归检查：返回 (耗时, 结束时仍停在复测中的源站次数)
+    备注：熔断阈值1次、冷却0秒、每个频道只选1个镜像，死源站（localhost上无人监听的端口）的首个链接失败即熔断：
+         （1）同步/异步全流程：同频道镜像已选满后，死源站上的该频道镜像不应占用复测资格；
+         （2）异步测速中的半开复测在等待全局并发名额时被取消，复测资格应交还
+         资格未交还时其余链接无限等待，由父进程按 BENCH_BREAKER_TIMEOUT 超时判定
+    """
+    import asyncio
+    import socket
+    import main
+    main.HOST_BREAKER_THRESHOLD = 1
+    main.HOST_BREAKER_COOLDOWN = 0
+    main.MIRROR_GROUPING = True
+    main.MIRROR_TOP_N = 1
+    main.MAX_CONCURRENCY = 1
+    main.PER_HOST_CONCURRENCY = 1
+    main.HEDGE_ENABLED = False
+    main.LINK_BUDGET_KBPS = None
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_base = f"http://localhost:{sock.getsockname()[1]}"
+    channels = [
+        main.ChannelRecord("CCTV2", f"{dead_base}/a", None),
+        main.ChannelRecord("CCTV1", f"{base_url}/stream/1.ts?bw={BENCH_FAST_KBPS}", None),
+        main.ChannelRecord("CCTV1", f"{dead_base}/b", None),
+        main.ChannelRecord("CCTV3", f"{dead_base}/c", None),
+    ]
+
+    async def cancel_waiting_trial(probe_run):
+        async with main.create_probe_session() as session:
+            engine = main.AsyncProbeEngine(session, probe_run, 1, 1)
+            await engine.global_semaphore.acquire()
+            task = asyncio.create_task(engine.probe(channels[3]))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            engine.global_semaphore.release()
+
+    stuck = 0
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for run in (lambda probe_run: main.probe_channels_sync(channels, probe_run),
+                        lambda probe_run: asyncio.run(main.probe_channels_async(channels, probe_run))):
+                probe_run = main.ProbeRun()
+                run(probe_run)
+                stuck += probe_run.health.states.get("localhost") == "half_open"
+            probe_run = main.ProbeRun()
+            probe_run.health.states["localhost"] = "open"
+            probe_run.health.opened_at["localhost"] = 0
+            asyncio.run(cancel_waiting_trial(probe_run))
+            stuck += probe_run.health.states.get("localhost") == "half_open"
+        wall_time = time.perf_counter() - start
+    return wall_time, stuck
+
+
+# ---------------------- 【子进程：执行单个场景并输出结果】 ----------------------
+def peak_memory_mb():
+    """当前进程峰值内存（MB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_probe_scenario(base_url):
+    """执行 main.py 获取+测速筛选全流程，返回 {有效链接集合, 耗时}；关闭缓存、中断恢复日志与增量，保证每次都完整测速"""
+    import main
+    main.PROBE_CACHE_FILE = None
+    main.PROBE_JOURNAL_FILE = None
+    main.INCREMENTAL_FETCH = False
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        channels = main.load_all_sources([f"{base_url}/playlist.m3u"])
+        valid_channels = main.filter_and_sort_channels(channels) if channels is not None else []
+        wall_time = time.perf_counter() - start
+    valid_urls = set()
+    for channel in valid_channels:
+        valid_urls.add(channel["url"])
+        valid_urls.update(channel.get("backup_urls", []))
+    return valid_urls, wall_time
+
+
+def run_migu_scenario(base_url):
+    """执行 mains.py 全流程，返回 {输出频道名集合, 耗时}；限速器按 RATE_MAX 起步，测的是抓取流程本身的开销"""
+    import mains
+    output_dir = tempfile.mkdtemp(prefix="bench_migu_")
+    mains.MIGU_LIST_API = f"{base_url}/live/v2/tv-data/{{category_id}}"
+    mains.MIGU_PLAY_API = f"{base_url}/gateway/playurl/v3/play/playurl?contId={{pid}}"
+    mains.m3u_path = os.path.join(output_dir, "migu.m3u")
+    mains.txt_path = os.path.join(output_dir, "migu.txt")
+    mains.PLAY_URL_CACHE_FILE = os.path.join(output_dir, "playurl_cache.json")
+    # 备注：不生成节目单（离线测试不访问外部节目单源，也不覆盖仓库中的epg.xml）
+    mains.EPG_SOURCES = []
+    mains.epg_path = os.path.join(output_dir, "epg.xml")
+    mains.rate_limiter = mains.AdaptiveRateLimiter(mains.RATE_MAX)
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        mains.main()
+        wall_time = time.perf_counter() - start
+    with open(mains.txt_path, "r", encoding="utf-8") as f:
+        names = {line.split(",", 1)[0] for line in f if line.strip() and not line.rstrip().endswith("#genre#")}
+    return names, wall_time
+
+
+def run_child(scenario, size, port):
+    """子进程入口：重新生成与父进程一致的场景数据，执行场景并以一行JSON输出结果"""
+    base_url = f"http://127.0.0.1:{port}"
+    if scenario == "breaker":
+        wall_time, stuck = run_breaker_scenario(base_url, size)
+        checks = {"stuck_trials": stuck}
+    elif scenario == "classify":
+        # 备注：分类场景与原实现对照，不一致数不是测速误判，单独记录且不计算判定准确率
+        wall_time, legacy_time, category_mismatch, order_mismatch = run_classify_scenario(size)
+        # 备注：提速倍数用未取整的耗时计算，小规模时总耗时取整后可能为0
+        checks = {"legacy_s": round(legacy_time, 2),
+                  "speedup": round(legacy_time / wall_time, 1) if wall_time else None,
+                  "category_mismatch": category_mismatch,
+                  "order_mismatch": order_mismatch}
+    else:
+        if scenario == "probe":
+            hosts = [f"127.0.0.{index + 1}" for index in range(int(os.environ["BENCH_HOST_COUNT"]))]
+            _, expected = build_playlist(build_origin_plan(size), hosts, port)
+            valid_urls, wall_time = run_probe_scenario(base_url)
+            false_accept = sum(1 for url in valid_urls if not expected.get(url))
+            false_reject = sum(1 for url, valid in expected.items() if valid and url not in valid_urls)
+        else:
+            import mains
+            plan = build_migu_plan(size, list(mains.LIVE.values()))
+            expected = {name for channels in plan.values() for pid, name in channels if not is_migu_error(pid)}
+            names, wall_time = run_migu_scenario(base_url)
+            false_accept = len(names - expected)
+            false_reject = len(expected - names)
+        checks = {"accuracy": round(1 - (false_accept + false_reject) / size, 4),
+                  "false_accept": false_accept, "false_reject": false_reject}
+    print(json.dumps({
+        "wall_s": round(wall_time, 2),
+        "per_s": round(size / wall_time, 1) if wall_time else None,
+        "peak_mb": peak_memory_mb(),
+        **checks,
+    }))
+
+
+# ---------------------- 【父进程：启动模拟服务器、逐个场景运行、记录并对比结果】 ----------------------
+def current_commit():
+    """当前git提交号，非git环境返回None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous_results():
+    """读取历史结果，返回 {(场景, 条目数): 最近一次结果}"""
+    previous = {}
+    try:
+        with open(BENCH_RESULTS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                previous[(record["scenario"], record["size"])] = record
+    except OSError:
+        pass
+    return previous
+
+
+def format_delta(current, previous, key):
+    """与上次结果的变化百分比"""
+    if not previous or not previous.get(key) or current.get(key) is None:
+        return ""
+    return f" ({(current[key] - previous[key]) / previous[key] * 100:+.1f}%)"
+
+
+def run_scenario(scenario, size, state, hosts, port):
+    """在子进程中运行单个场景，返回结果字典；子进程失败返回None"""
+    if scenario == "probe":
+        state["playlist"], _ = build_playlist(build_origin_plan(size), hosts, port)
+    elif scenario == "migu":
+        import mains
+        state["migu"] = build_migu_plan(size, list(mains.LIVE.values()))
+    env = dict(os.environ, BENCH_HOST_COUNT=str(len(hosts)))
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scenario, str(size), str(port)],
+                              capture_output=True, text=True, env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              timeout=BENCH_BREAKER_TIMEOUT if scenario == "breaker" else None)
+    except subprocess.TimeoutExpired:
+        print(f"❌ 场景 {scenario}/{size} 超过 {BENCH_BREAKER_TIMEOUT}s 未结束（半开复测资格未交还，测速卡死）")
+        return None
+    if proc.returncode != 0:
+        print(f"❌ 场景 {scenario}/{size} 运行失败：{proc.stderr.strip()[-500:]}")
+        return None
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    scenarios = ["probe", "migu", "classify", "breaker"]
+    if args and args[0] in ("probe", "migu", "classify", "breaker", "all"):
+        scenarios = scenarios if args[0] == "all" else [args[0]]
+        args = args[1:]
+    sizes = [int(arg) for arg in args]
+
+    state = {"playlist": b"", "migu": {}}
+    servers, hosts, port = start_servers(state)
+    print(f"🧪 模拟服务器已启动：{len(hosts)} 个源站（{hosts[0]} ~ {hosts[-1]}），端口 {port}")
+    previous_results = load_previous_results()
+    commit = current_commit()
+
+    for scenario in scenarios:
+        default_sizes = {"classify": BENCH_CLASSIFY_SIZES, "breaker": BENCH_BREAKER_SIZES}.get(scenario, BENCH_SIZES)
+        for size in sizes or default_sizes:
+            print(f"▶️  场景 {scenario}，条目数 {size} ...")
+            result = run_scenario(scenario, size, state, hosts, port)
+            if result is None:
+                continue
+            previous = previous_results.get((scenario, size))
+            print(f"    ⏱️  总耗时 {result['wall_s']}s{format_delta(result, previous, 'wall_s')}，"
+                  f"{result['per_s']} 条/秒{format_delta(result, previous, 'per_s')}，"
+                  f"峰值内存 {result['peak_mb']} MB{format_delta(result, previous, 'peak_mb')}")
+            if scenario == "breaker":
+                print(f"    🧯 熔断半开复测：{size} 轮检查结束后仍停在复测中的源站 {result['stuck_trials']} 次")
+            elif scenario == "classify":
+                print(f"    🔁 原实现耗时 {result['legacy_s']}s，分类引擎提速 {result['speedup']} 倍；"
+                      f"与原实现分类不一致 {result['category_mismatch']} 个，分类内位置不一致 {result['order_mismatch']} 个")
+            else:
+                print(f"    🎯 判定准确率 {result['accuracy'] * 100:.2f}%"
+                      f"（误判有效 {result['false_accept']} 个，误判无效 {result['false_reject']} 个）")
+            record = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit,
+                      "scenario": scenario, "size": size, "hosts": len(hosts), **result}
+            with open(BENCH_RESULTS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    for server in servers:
+        server.shutdown()
+    print(f"📁 结果已追加到 {BENCH_RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        run_child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import unicodedata
+
+# ====================== 【频道分类引擎：main.py / mains.py 共用】 ======================
+# 备注：同时提供多镜像分组与节目单匹配共用的频道名归一化（两个脚本对同一频道生成相同的tvg-id）；
+#      分类规则从 CLASSIFY_RULES_FILE 读取（每个脚本一套规则），全部分类关键词编译成一个多分支正则，频道名只扫描一遍；
+#      结果按归一化频道名缓存（多个源/多个镜像中重复出现的同名频道只计算一次），一次返回分类与排序键
+
+# ---------------------- 【规则文件配置】 ----------------------
+# 备注：分类规则文件（与本文件同目录），按脚本名分组，格式见文件内的备注
+CLASSIFY_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "classify_rules.json")
+
+CCTV_NUMBER_PATTERN = re.compile(r'CCTV[-\s]?(\d+)', re.IGNORECASE)
+PANDA_NUMBER_PATTERN = re.compile(r'熊猫(0?)(\d+)')
+# 备注：多镜像分组/节目单匹配时去掉的清晰度标记与分隔符
+CHANNEL_KEY_NOISE_PATTERN = re.compile(r'高清|超清|标清|蓝光|频道|备用|FHD|UHD|HD|[\s\-_·|()\[\]（）【】]')
+# 备注：CCTV-5+、CCTV-4K 等与同号频道不是同一频道，归并时保留后缀
+CCTV_SUFFIX_PATTERN = re.compile(r'CCTV[-\s]?\d+\s*(\+|K)')
+# 备注：CCTV-4 欧洲 / CCTV-4 美洲 等分区频道播出内容不同，归并时保留地区
+CCTV_REGION_PATTERN = re.compile(r'欧洲|美洲|北美|亚洲|中东|非洲')
+# 备注：CGTN等外语频道排在全部CCTV数字频道之后，按语种排序，未列出的排1000
+CGTN_ORDER = {'法语': 1001, '西班牙语': 1002, '俄语': 1003, '阿拉伯语': 1004, '纪录': 1005}
+
+
+def normalize_name(channel_name):
+    """分类用的归一化频道名：全角转半角+去首尾空白+大写（ＣＣＴＶ-1 / cctv-1 与 CCTV-1 分类一致）"""
+    return unicodedata.normalize('NFKC', channel_name).strip().upper()
+
+
+def extract_cctv_number(channel_name):
+    """提取CCTV频道序号，用于央视内部排序与多镜像/节目单的频道归并；CGTN等外语频道返回1000+，非央视返回9999"""
+    match = CCTV_NUMBER_PATTERN.search(channel_name)
+    if match:
+        return int(match.group(1))
+    if 'CCTV' in channel_name or 'CGTN' in channel_name:
+        for keyword, order in CGTN_ORDER.items():
+            if keyword in channel_name:
+                return order
+        return 1000
+    return 9999
+
+
+def normalize_channel_key(channel_name):
+    """
+    多镜像分组/节目单匹配用的归一化频道名：全角转半角+大写，央视按频道号归并，其余去掉清晰度标记与分隔符
+    例：CCTV-1 / CCTV1 HD / cctv-1高清 → CCTV1，CCTV-4 欧洲 → CCTV4欧洲
+    """
+    name = unicodedata.normalize('NFKC', channel_name).upper()
+    cctv_number = extract_cctv_number(name)
+    if cctv_number < 1000:
+        suffix_match = CCTV_SUFFIX_PATTERN.search(name)
+        region_match = CCTV_REGION_PATTERN.search(name)
+        return (f"CCTV{cctv_number}{suffix_match.group(1) if suffix_match else ''}"
+                f"{region_match.group(0) if region_match else ''}")
+    return CHANNEL_KEY_NOISE_PATTERN.sub("", name) or name
+
+
+def epg_channel_id(channel_name):
+    """节目单频道ID（即M3U的tvg-id）：归一化频道名去掉双引号，main.py / mains.py 对同一频道生成相同的ID"""
+    return normalize_channel_key(channel_name).replace('"', "")
+
+
+def extract_panda_number(channel_name):
+    """提取熊猫频道序号：熊猫01~09 排在 熊猫1~N 之前，非熊猫频道排最后"""
+    match = PANDA_NUMBER_PATTERN.search(channel_name)
+    if match:
+        return (0 if match.group(1) else 1, int(match.group(2)))
+    return (9999, 9999)
+
+
+def extract_first_char(channel_name):
+    """提取频道名首字，用于卫视按首字排序"""
+    return channel_name[:1].lower() or 'z'
+
+
+# 备注：分类内排序方式 → 排序值提取函数（输入为归一化频道名）；"speed" 按速度降序，由调用方传入速度
+SORT_VALUE_FUNCS = {
+    "cctv": extract_cctv_number,
+    "panda": extract_panda_number,
+    "first_char": extract_first_char,
+    "name": lambda channel_name: 0,
+}
+
+
+class ChannelClassifier:
+    """
+    规则编译后的频道分类器
+    备注：各分类的关键词按优先级依次排成一个零宽前瞻多分支正则，频道名每个位置上优先匹配高优先级分类，
+         一次扫描即可找出命中的最高优先级分类（关键词互相重叠时与逐个关键词判断的结果一致）
+    """
+
+    def __init__(self, rules, category_order):
+        self.default = rules["default"]
+        self.categories = [rule["name"] for rule in rules["categories"]]
+        self.sort_modes = {rule["name"]: rule.get("sort", "name") for rule in rules["categories"]}
+        self.sort_modes[self.default] = rules.get("default_sort", "name")
+        unknown_modes = set(self.sort_modes.values()) - set(SORT_VALUE_FUNCS) - {"speed"}
+        if unknown_modes:
+            raise ValueError(f"未知的分类内排序方式: {', '.join(sorted(unknown_modes))}")
+        # 备注：分类序号按脚本的输出顺序（与分类匹配优先级可以不同），不在输出顺序中的分类排最后
+        self.ranks = {category: position for position, category in enumerate(category_order)}
+        branches = []
+        for position, rule in enumerate(rules["categories"]):
+            keywords = sorted({normalize_name(keyword) for keyword in rule["keywords"]}, key=len, reverse=True)
+            branches.append(f"(?P<c{position}>{'|'.join(map(re.escape, keywords))})")
+        self.pattern = re.compile(f"(?=(?:{'|'.join(branches)}))")
+        # 备注：原始频道名 → 结果 与 归一化频道名 → 结果 两级缓存，原样重复的频道名连归一化也省掉
+        self.by_name = {}
+        self.by_normalized = {}
+
+    def evaluate(self, normalized):
+        """对归一化频道名做一次完整分类，返回 (分类, 分类序号, 分类内排序值)；按速度排序的分类排序值为None"""
+        best = None
+        for match in self.pattern.finditer(normalized):
+            position = int(match.lastgroup[1:])
+            if best is None or position < best:
+                best = position
+                if best == 0:
+                    break
+        category = self.default if best is None else self.categories[best]
+        mode = self.sort_modes[category]
+        sort_value = None if mode == "speed" else SORT_VALUE_FUNCS[mode](normalized)
+        return category, self.ranks.get(category, len(self.ranks)), sort_value
+
+    def classify(self, channel_name, speed=0):
+        """
+        返回 (分类, 排序键)，排序键 = (分类序号, 分类内排序值, 频道名)
+        speed：按速度排序的分类使用，分类内速度高的在前
+        """
+        entry = self.by_name.get(channel_name)
+        if entry is None:
+            normalized = normalize_name(channel_name)
+            entry = self.by_normalized.get(normalized)
+            if entry is None:
+                entry = self.by_normalized[normalized] = self.evaluate(normalized)
+            self.by_name[channel_name] = entry
+        category, rank, sort_value = entry
+        return category, (rank, -speed if sort_value is None else sort_value, channel_name)
+
+
+def load_classifier(profile, category_order, path=CLASSIFY_RULES_FILE):
+    """读取规则文件中 profile 一组规则并编译成分类器；category_order 为脚本输出分类的顺序（决定排序键的分类序号）"""
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)[profile]
+    return ChannelClassifier(rules, category_order)
@@ -0,0 +1,153 @@
+import contextlib
+import gzip
+import io
+import os
+import xml.etree.ElementTree as ET
+
+import requests
+
+# ====================== 【XMLTV节目单精简：main.py / mains.py 共用】 ======================
+# 备注：第三方XMLTV节目单解压后动辄几百MB，这里边下载边解压边解析（iterparse），每处理完一个 <channel>/<programme>
+#      立即释放，内存占用与节目单大小无关；只保留测速/抓取后仍有效的频道，输出精简后的XML与预压缩的.gz副本
+
+# ---------------------- 【读取配置】 ----------------------
+# 备注：节目单下载的连接/读取超时（秒）
+EPG_TIMEOUT = (10, 60)
+# 备注：读取缓冲区大小，用于识别gzip文件头并为解析器提供整块数据
+EPG_READ_BUFFER = 64 * 1024
+# 备注：输出.gz副本的压缩级别（精简后的节目单体积小，按最高压缩率输出，播放器下载更快）
+EPG_GZIP_LEVEL = 9
+
+GZIP_MAGIC = b"\x1f\x8b"
+XMLTV_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n<tv generator-info-name="tvtest">\n'
+XMLTV_FOOTER = b"</tv>\n"
+
+
+@contextlib.contextmanager
+def open_epg_source(source, session):
+    """
+    打开一个节目单源（远程地址或本地文件），返回二进制读取流
+    备注：按文件头自动识别gzip压缩（.xml.gz 源与 Content-Encoding: gzip 的响应均可直接读取）
+    """
+    with contextlib.ExitStack() as stack:
+        if source.startswith(("http://", "https://")):
+            resp = stack.enter_context(session.get(source, timeout=EPG_TIMEOUT, stream=True))
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            # 备注：读到结尾时不自动关闭，否则外层缓冲区中尚未取走的最后一段数据无法读取
+            resp.raw.auto_close = False
+            stream = io.BufferedReader(resp.raw, EPG_READ_BUFFER)
+        else:
+            stream = stack.enter_context(open(source, "rb", buffering=EPG_READ_BUFFER))
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            stream = stack.enter_context(gzip.GzipFile(fileobj=stream))
+        yield stream
+
+
+def iter_epg_elements(stream):
+    """
+    【生成器】流式解析XMLTV，逐个产出顶层的 <channel>/<programme> 元素
+    备注：调用方处理完当前元素后才会解析下一个，随后清空根节点，已处理的元素不会在内存中累积
+    """
+    root = None
+    depth = 0
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and elem.tag in ("channel", "programme"):
+            yield elem
+            root.clear()
+
+
+class EpgWriter:
+    """同时写入节目单XML与.gz副本（均先写临时文件，全部写完后再替换，读取方不会读到写了一半的节目单）"""
+
+    def __init__(self, output_path):
+        self.paths = [output_path, f"{output_path}.gz"]
+        self.xml_file = open(f"{output_path}.tmp", "wb")
+        self.gz_file = gzip.open(f"{output_path}.gz.tmp", "wb", compresslevel=EPG_GZIP_LEVEL)
+        self.write(XMLTV_HEADER)
+
+    def write(self, data):
+        self.xml_file.write(data)
+        self.gz_file.write(data)
+
+    def write_element(self, elem):
+        elem.tail = None
+        self.write(b"  " + ET.tostring(elem, encoding="unicode").encode("utf-8") + b"\n")
+
+    def commit(self):
+        """写入结尾并替换目标文件"""
+        self.write(XMLTV_FOOTER)
+        self.close()
+        for path in self.paths:
+            os.replace(f"{path}.tmp", path)
+
+    def discard(self):
+        """放弃本次写入，保留原有节目单文件"""
+        self.close()
+        for path in self.paths:
+            if os.path.exists(f"{path}.tmp"):
+                os.remove(f"{path}.tmp")
+
+    def close(self):
+        self.xml_file.close()
+        self.gz_file.close()
+
+
+def write_filtered_epg(sources, channel_keys, normalize, output_path, session):
+    """
+    按顺序读取节目单源，只保留 channel_keys 中频道的 <channel>/<programme>，写入 output_path 与 output_path.gz
+    channel_keys：有效频道的归一化频道名集合（同时作为输出节目单的频道ID，与M3U的 tvg-id 一致）
+    normalize：频道名归一化函数，节目单 <display-name> 按同一规则归一化后匹配
+    备注：同一频道只采用第一个匹配到的源；XMLTV约定 <channel> 在前 <programme> 在后，频道声明之前出现的节目不保留
+    返回值：匹配到的频道归一化名集合，全部源均获取/解析失败时返回None（保留原有节目单文件）
+    """
+    print(f"📺 正在生成节目单（{len(sources)} 个节目单源，{len(channel_keys)} 个有效频道）...")
+    writer = EpgWriter(output_path)
+    matched_keys = set()
+    programme_count = 0
+    failed_sources = 0
+    try:
+        for source in sources:
+            # 备注：本源频道ID → 输出频道ID（归一化频道名）
+            id_map = {}
+            try:
+                with open_epg_source(source, session) as stream:
+                    for elem in iter_epg_elements(stream):
+                        if elem.tag == "programme":
+                            channel_id = id_map.get(elem.get("channel"))
+                            if channel_id:
+                                elem.set("channel", channel_id)
+                                writer.write_element(elem)
+                                programme_count += 1
+                            continue
+                        for display_name in elem.iter("display-name"):
+                            key = normalize(display_name.text or "")
+                            if key in channel_keys and key not in matched_keys:
+                                matched_keys.add(key)
+                                id_map[elem.get("id")] = key
+                                elem.set("id", key)
+                                writer.write_element(elem)
+                                break
+                print(f"    ✅ {source}：累计匹配 {len(matched_keys)} 个频道")
+            except (requests.RequestException, OSError, EOFError, ET.ParseError) as e:
+                failed_sources += 1
+                print(f"    ❌ 节目单源读取失败: {source} {str(e)}")
+    except BaseException:
+        writer.discard()
+        raise
+
+    if sources and failed_sources == len(sources):
+        writer.discard()
+        print(f"    ⚠️  全部节目单源不可用，保留原有节目单文件")
+        return None
+    writer.commit()
+    xml_size, gz_size = (os.path.getsize(path) for path in writer.paths)
+    print(f"    ✅ 节目单匹配 {len(matched_keys)}/{len(channel_keys)} 个频道，节目 {programme_count} 条，"
+          f"{output_path} {xml_size / 1024:.0f} KB（.gz {gz_size / 1024:.0f} KB）")
+    return matched_keys
@@ -0,0 +1,24 @@
+import m3u8
+
+# ====================== 【HLS播放列表解析：main.py / mains.py 共用】 ======================
+# 备注：main.py 的HLS分片测速与 mains.py 的码率阶梯测速共用同一个解析器（基于m3u8库），
+#      主播放列表按 BANDWIDTH 选择码率，媒体播放列表取末尾最新的分片（与播放器起播位置一致）
+
+
+def parse_playlist(playlist_text, playlist_url, variant="highest", segment_count=1):
+    """
+    解析HLS播放列表，相对地址按 playlist_url 补全
+    variant：主播放列表包含多码率时的选择策略，"highest"=BANDWIDTH最高，"lowest"=BANDWIDTH最低
+    segment_count：媒体播放列表返回末尾最新的几个分片
+    返回值：主播放列表返回 ("variant", 选中码率的播放列表地址)
+           媒体播放列表返回 ("media", [(分片地址, 分片时长秒)])
+    """
+    playlist = m3u8.loads(playlist_text, uri=playlist_url)
+    if playlist.is_variant:
+        variants = sorted(playlist.playlists, key=lambda v: v.stream_info.bandwidth or 0)
+        chosen = variants[-1] if variant == "highest" else variants[0]
+        return "variant", chosen.absolute_uri
+    segments = playlist.segments[-segment_count:]
+    if not segments:
+        raise ValueError("HLS播放列表无媒体分片")
+    return "media", [(segment.absolute_uri, segment.duration or 0) for segment in segments]
@@ -0,0 +1,141 @@
+import socket
+import ipaddress
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+# ====================== 【共享HTTP客户端层：main.py / mains.py 共用】 ======================
+# 备注：同步请求统一走 requests.Session（按源站分连接池+keep-alive），异步测速统一走同配置的aiohttp连接器；
+#      进程内DNS缓存替换 socket.getaddrinfo，requests/urllib3 与 aiohttp 默认解析器共用同一份缓存
+
+# ---------------------- 【连接池配置】 ----------------------
+# 备注：缓存的源站连接池数量（每个 scheme+host+port 一个池），超过后最久未用的池被关闭
+POOL_CONNECTIONS = 64
+# 备注：单个源站连接池保留的keep-alive连接数，应不小于对同一源站的并发数，否则多出的连接用完即关
+POOL_MAXSIZE = 8
+# 备注：异步连接器空闲连接保留时间（秒），同一源站的后续请求直接复用已完成TCP+TLS握手的连接
+KEEPALIVE_TIMEOUT = 30
+
+# ---------------------- 【DNS缓存配置】 ----------------------
+# 备注：解析成功的域名缓存有效期（秒），一轮测速内同一源站只解析一次
+DNS_CACHE_TTL = 600
+# 备注：解析失败的域名缓存有效期（秒），死域名预解析失败后测速时不再重复等待解析超时
+DNS_CACHE_FAIL_TTL = 120
+# 备注：并发预解析的线程数
+DNS_PREFETCH_WORKERS = 32
+
+# 备注：host → (过期时间, [(family, sockaddr), ...] 或 socket.gaierror)
+dns_cache = {}
+dns_cache_lock = threading.Lock()
+original_getaddrinfo = socket.getaddrinfo
+
+
+def is_ip_literal(host):
+    """判断host是否为IP地址（IP地址无需解析，直接交给系统处理）"""
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_host(host):
+    """
+    解析host的全部TCP地址并缓存（有效期内直接复用），解析失败抛出 socket.gaierror
+    备注：缓存只记录地址不记录端口，同一域名不同端口/不同地址族的请求共用一次解析结果
+    """
+    now = time.monotonic()
+    with dns_cache_lock:
+        entry = dns_cache.get(host)
+    if entry and entry[0] > now:
+        if isinstance(entry[1], socket.gaierror):
+            raise entry[1]
+        return entry[1]
+    try:
+        infos = original_getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        with dns_cache_lock:
+            dns_cache[host] = (now + DNS_CACHE_FAIL_TTL, e)
+        raise
+    addresses = list(dict.fromkeys((family, sockaddr) for family, _, _, _, sockaddr in infos))
+    with dns_cache_lock:
+        dns_cache[host] = (now + DNS_CACHE_TTL, addresses)
+    return addresses
+
+
+def cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """
+    带缓存的 socket.getaddrinfo，返回格式与原函数一致
+    备注：仅接管TCP连接的常规解析（requests/urllib3、aiohttp默认解析器均属此类），其余调用原样交给系统
+    """
+    if isinstance(host, bytes):
+        host = host.decode("idna")
+    if (not host or type != socket.SOCK_STREAM or flags not in (0, socket.AI_ADDRCONFIG)
+            or not (port is None or isinstance(port, int)) or is_ip_literal(host)):
+        return original_getaddrinfo(host, port, family, type, proto, flags)
+    addresses = [
+        (addr_family, sockaddr) for addr_family, sockaddr in resolve_host(host)
+        if family in (0, addr_family)
+    ]
+    if not addresses:
+        return original_getaddrinfo(host, port, family, type, proto, flags)
+    return [
+        (addr_family, socket.SOCK_STREAM, proto or socket.IPPROTO_TCP, "", (sockaddr[0], port or 0) + tuple(sockaddr[2:]))
+        for addr_family, sockaddr in addresses
+    ]
+
+
+def install_dns_cache():
+    """启用进程内DNS缓存（重复调用无影响）"""
+    socket.getaddrinfo = cached_getaddrinfo
+
+
+def prefetch_hosts(hosts):
+    """
+    并发预解析一批域名写入DNS缓存，返回 (解析成功数, 解析失败数)
+    备注：已在缓存有效期内的域名直接计为成功，不重复解析
+    """
+    hosts = [host for host in dict.fromkeys(hosts) if host and not is_ip_literal(host)]
+    if not hosts:
+        return 0, 0
+
+    def resolve_quietly(host):
+        try:
+            resolve_host(host)
+            return True
+        except (socket.gaierror, UnicodeError):
+            return False
+
+    with ThreadPoolExecutor(max_workers=min(DNS_PREFETCH_WORKERS, len(hosts))) as pool:
+        resolved = sum(pool.map(resolve_quietly, hosts))
+    return resolved, len(hosts) - resolved
+
+
+def create_session(headers=None, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    """
+    创建同步请求会话：按源站分连接池复用keep-alive连接（TLS握手只在建连时发生一次）
+    备注：关闭证书校验（直播源/咪咕跳转地址大量使用自签名证书），重试由调用方自行控制
+    """
+    session = requests.Session()
+    session.verify = False
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def create_async_connector(limit, limit_per_host):
+    """创建异步测速用的aiohttp连接器：并发上限与调用方一致，空闲连接保留 KEEPALIVE_TIMEOUT 秒供同源站复用"""
+    return aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ssl=False,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
@@ -1,23 +1,50 @@
 import requests
+import aiohttp
+import asyncio
 import time
+import os
+import sys
 import re
-import unicodedata
-from collections import defaultdict
-from urllib.parse import urlparse
+import json
+import glob
+import heapq
+import hashlib
+import sqlite3
+import itertools
+import contextlib
+import queue
+import threading
+import http_client
+import hls
+import epg
+import classify
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, urlsplit, urlunsplit
 
 # ====================== 【核心配置区 所有调整均带备注】 ======================
 # 目标M3U地址（已备注：自动兼容GitHub blob/raw链接，避免解析失败）
 M3U_URL = "https://gh-proxy.com/https://github.com/GSD-3726/TY/blob/main/iptv_channels.m3u"
+# 备注：多源聚合：按顺序合并的直播源列表，远程M3U地址与本地M3U文件路径（如 mains.py 生成的 migu.m3u）均可；
+#      全部源并发获取，按链接全局去重后只测速一次，靠前的源优先（同一链接的频道名/分组取最先出现的源）
+M3U_SOURCES = [
+    M3U_URL,
+    "migu.m3u",
+]
+# 备注：并发获取源列表的线程数
+SOURCE_FETCH_WORKERS = 8
 
 # ---------------------- 【按您要求调整：分类置顶顺序 严格固定】 ----------------------
-# 备注：严格按照您要求的 央视>卫视>电影>轮播>其他 顺序置顶，写入文件时强制按此顺序输出
+# 备注：严格按照您要求的 央视>卫视>电影>轮播>其他 顺序置顶，写入文件时强制按此顺序输出；
+#      各分类的关键词与分类内排序方式见 classify_rules.json 的 "main" 一组
 CATEGORY_ORDER = ["央视", "卫视", "电影", "轮播", "其他"]
 
 # ---------------------- 【测速精准度优化配置 全参数带备注】 ----------------------
 # 备注：连接超时+读取超时分离，避免网络波动误判，适配TV播放的网络要求
 CONNECT_TIMEOUT = 5  # 连接超时时间（秒），仅用于TCP握手，超时直接判定无效
 READ_TIMEOUT = 20    # 数据读取超时时间（秒），直播流无数据超过此时长判定无效
-# 备注：测速数据块大小，从原100KB提升至512KB，样本量更大，速度计算更精准，避免瞬时波动
+# 备注：单个源测速最多读取的数据量（512KB），分窗口采样提前判定时实际读取量更少
 TEST_CHUNK_SIZE = 1024 * 512
 # 备注：测速重试机制，单次失败自动重试1次，排除偶发网络抖动导致的误杀
 TEST_RETRY_TIMES = 1
@@ -25,153 +52,587 @@ TEST_RETRY_TIMES = 1
 MIN_PLAY_SPEED = 500
 # 输出文件名
 OUTPUT_FILE = "tv_optimized_channels.m3u"
+# TXT输出文件名（频道名,主用链接#备用链接，兼容DIYP/TVBox多源格式）
+OUTPUT_TXT_FILE = "tv_optimized_channels.txt"
 # 请求头（适配直播源防盗链，提升请求成功率）
 GLOBAL_HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
     "Accept": "*/*",
     "Connection": "keep-alive"
 }
+
+# ---------------------- 【并发测速引擎配置】 ----------------------
+# 备注：测速执行模式，"async"=aiohttp并发测速（默认），"sync"=原逐个串行测速（排查问题时使用）
+PROBE_MODE = "async"
+# 备注：全局最大并发测速数，过高会挤占本机带宽，导致测速结果偏低
+MAX_CONCURRENCY = 32
+# 备注：单个源站（host）最大并发数，同源请求过多容易被限流/封IP
+PER_HOST_CONCURRENCY = 4
+# 备注：测速开始前并发预解析全部待测源站的域名（结果写入进程内DNS缓存），测速时不再逐个等待DNS解析
+DNS_PREFETCH = True
+
+# ---------------------- 【测速结果缓存配置】 ----------------------
+# 备注：测速结果缓存文件（SQLite），按直播链接记录上次速度/状态/时间/连续失败次数，设为None关闭缓存
+PROBE_CACHE_FILE = "probe_cache.db"
+# 备注：有效源缓存有效期（秒），有效期内直接复用上次测速结果，不再重复测速
+PROBE_CACHE_TTL = 6 * 3600
+# 备注：失效源缓存有效期（秒），按连续失败次数翻倍延长（30分钟、1小时、2小时...），避免反复测死链
+PROBE_CACHE_FAIL_TTL = 1800
+# 备注：失效源缓存有效期上限（秒），长期失效的源最多间隔1天重测一次，防止源恢复后一直被漏掉
+PROBE_CACHE_FAIL_TTL_MAX = 24 * 3600
+# 备注：测速中断恢复日志，每完成一个测速立即追加一行结论；运行被中断后重新运行时回放日志，只测剩余频道，
+#      结果文件写入完成后自动删除，设为None关闭
+PROBE_JOURNAL_FILE = "probe_journal.jsonl"
+# 备注：中断恢复日志的最长有效期（秒），超过后视为过期不再回放（与有效源缓存有效期一致）
+PROBE_JOURNAL_MAX_AGE = PROBE_CACHE_TTL
+
+# ---------------------- 【HLS(m3u8)测速配置】 ----------------------
+# 备注：HLS测速开关，开启后m3u8源不再读取几百字节的播放列表文本，而是解析列表并下载真实媒体分片测速
+HLS_PROBE_ENABLED = True
+# 备注：每个HLS源测速下载的媒体分片数（取直播列表末尾最新的分片，与播放器起播位置一致）
+HLS_TEST_SEGMENTS = 2
+# 备注：主播放列表包含多码率时的选择策略，"highest"=最高码率（TV默认起播码率），"lowest"=最低码率
+HLS_VARIANT = "highest"
+# 备注：最低实时倍率 = 分片时长(#EXTINF) / 分片下载耗时，低于1表示下载速度跟不上播放速度，必然卡顿
+HLS_MIN_REALTIME_FACTOR = 1.0
+# 备注：播放列表/单个分片的最大读取字节数，防止伪装成m3u8的无限流占满读取时间
+HLS_PLAYLIST_MAX_BYTES = 1024 * 1024
+HLS_SEGMENT_MAX_BYTES = 1024 * 1024 * 16
+
+# ---------------------- 【内容嗅探配置】 ----------------------
+# 备注：内容嗅探开关：按响应前几KB识别TS/FLV/MP4等容器，网页/JSON错误页不再按速度误判为有效，识别结果记录到频道的container字段
+SNIFF_ENABLED = True
+# 备注：嗅探读取的字节数，签名明确的容器（FLV/MP4/#EXTM3U/网页）读到即判定，TS需读够此长度核对连续同步字节
+SNIFF_BYTES = 1024 * 2
+# 备注：TS判定所需的连续同步字节(0x47，每188字节一个)数量
+SNIFF_TS_PACKETS = 5
+
+# ---------------------- 【源列表增量更新配置】 ----------------------
+# 备注：源列表条件请求开关（ETag/If-Modified-Since），校验值与上次解析出的频道列表一并保存在 PROBE_CACHE_FILE 中
+INCREMENTAL_FETCH = True
+# 备注：源列表中未变化的频道沿用上次有效测速结论的最长时间（秒），超过后即使源列表未变也会重新测速；
+#      上次失效的频道不沿用，按 PROBE_CACHE_FAIL_TTL 退避后复测
+CARRY_FORWARD_MAX_AGE = 24 * 3600
+
+# ---------------------- 【流式流水线配置】 ----------------------
+# 备注：边下载边解析边测速开关，关闭后恢复“整体下载→整体解析→整体测速”的分阶段流程
+STREAM_PIPELINE = True
+# 备注：流式流水线中排队+进行中的测速任务上限，控制超大源列表（5万+频道）的内存占用
+STREAM_PROBE_WINDOW = 2000
+# 备注：异步模式下每次从解析器取出的频道数，批量交接减少线程切换开销
+STREAM_BATCH_SIZE = 256
+
+# ---------------------- 【源站熔断配置】 ----------------------
+# 备注：同一源站（host）连续连接失败/超时达到此次数后熔断，剩余链接暂缓测速；设为0关闭熔断
+HOST_BREAKER_THRESHOLD = 3
+# 备注：熔断冷却时间（秒），冷却后放行1个链接半开复测：成功则恢复该源站测速，失败则本轮跳过该源站剩余链接
+HOST_BREAKER_COOLDOWN = 30
+
+# ---------------------- 【对冲请求配置（异步模式）】 ----------------------
+# 备注：对冲开关：首个请求超过对冲阈值仍未收到响应头时并行发起第二个请求，先收到响应头者胜出，另一个立即取消
+HEDGE_ENABLED = True
+# 备注：对冲阈值取本轮已观测首字节时间(TTFB)的分位数，样本不足 HEDGE_MIN_SAMPLES 个时不对冲
+HEDGE_TTFB_QUANTILE = 0.95
+HEDGE_MIN_SAMPLES = 20
+# 备注：参与分位数计算的最近TTFB样本数
+HEDGE_TTFB_WINDOW = 500
+# 备注：对冲阈值下限（秒），避免同机房源的极小TTFB导致大量请求被对冲
+HEDGE_MIN_DELAY = 0.2
+# 备注：本轮重试预算 = 初始次数 + 已发起测速数×比例；对冲与失败重试都消耗预算，耗尽后不再对冲/重试，避免放大故障源站负载
+RETRY_BUDGET_INITIAL = 10
+RETRY_BUDGET_RATIO = 0.1
+
+# ---------------------- 【带宽感知调度配置（异步模式）】 ----------------------
+# 备注：本机下行链路预算（KB/s）：并发测速测的是各条流分到的本机带宽份额，全部测速的合计下载速度接近预算时暂缓发起新测速，
+#      避免好源因带宽被挤占而测速偏低；设为None关闭
+LINK_BUDGET_KBPS = 60 * 1024
+# 备注：合计下载速度低于预算的该比例时才放行新测速（留出余量给正在测速的流提速）
+LINK_ADMIT_RATIO = 0.8
+# 备注：合计下载速度达到预算的该比例即视为链路饱和，饱和期间测出的不达标结果先以低并发复测再判定
+LINK_SATURATED_RATIO = 0.9
+# 备注：合计下载速度的统计窗口（秒），与测速采样提前判定所需的时长（两个采样窗口）一致，窗口过长会把饱和时段平均掉
+LINK_WINDOW = 0.5
+# 备注：链路饱和期间不达标结果的复测并发数
+LINK_RETEST_CONCURRENCY = 2
+
+# ---------------------- 【分窗口测速采样配置】 ----------------------
+# 备注：单个源的数据读取时间预算（秒），快源确定达标后提前结束，慢源确定无法达标时提前放弃，不再读满512KB
+SAMPLE_TIME_BUDGET = 4.0
+# 备注：吞吐量统计窗口（秒），按窗口计算瞬时速度，作为提前结束的判断依据
+SAMPLE_WINDOW = 0.25
+# 备注：提前达标条件：至少采样N个窗口，平均速度≥最低播放速度×置信倍数，且最近一个窗口也达标
+SAMPLE_MIN_WINDOWS = 4
+SAMPLE_CONFIDENCE_MARGIN = 1.5
+# 备注：两次收到数据的间隔超过此时长（秒）记为一次卡顿
+SAMPLE_STALL_GAP = 1.0
+# 备注：每次读取的数据块大小，越小采样粒度越细
+SAMPLE_CHUNK_SIZE = 1024 * 16
+
+# ---------------------- 【多镜像合并配置】 ----------------------
+# 备注：同一频道多个镜像（如 CCTV-1 / CCTV1 HD / cctv-1高清）按归一化频道名分组，组内竞速测速，每个频道只输出1个条目
+MIRROR_GROUPING = True
+# 备注：每个频道保留的有效镜像数（1个主用+其余备用），组内达到此数量后取消/跳过其余镜像的测速
+MIRROR_TOP_N = 3
+
+# ---------------------- 【分类数量上限配置】 ----------------------
+# 备注：每个分类最多输出的频道数（按分类内排序取最靠前的），超大源列表合并后只保留各分类最优的频道，排序阶段内存占用与上限成正比；
+#      整数=全部分类统一上限，字典=按分类单独设置（如 {"其他": 200}，未列出的分类不限），设为None不限
+CATEGORY_TOP_K = None
+
+# ---------------------- 【分片测速配置】 ----------------------
+# 备注：本机多进程分片测速的进程数（也可用 python main.py --shards N 指定），全部分片测完后自动合并输出，设为1不分片；
+#      多台机器/CI矩阵分片时每个任务运行 python main.py --shard 序号/总数，全部完成后运行 python main.py --merge 合并输出
+SHARD_PROCESSES = 1
+# 备注：分片测速结果文件（每个分片一个，含该分片全部频道的测速结论），{index}=分片序号（从0开始），{count}=分片总数
+SHARD_RESULT_FILE = "probe_shard{index}of{count}.json"
+
+# ---------------------- 【运行指标导出配置】 ----------------------
+# 备注：每轮运行结束后导出分阶段耗时、每次测速的耗时拆解（DNS/建连/首字节/吞吐/重试）与按源站聚合的延迟直方图，设为None不导出
+METRICS_JSON_FILE = "probe_metrics.json"
+# 备注：同一份指标的Prometheus textfile格式（node_exporter textfile collector 可直接采集），设为None不导出
+METRICS_PROM_FILE = "probe_metrics.prom"
+# 备注：延迟直方图分桶上界（毫秒）
+METRICS_LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# ---------------------- 【EPG节目单配置】 ----------------------
+# 备注：XMLTV节目单源（远程地址或本地文件，支持.gz），按顺序匹配，同一频道采用第一个匹配到的源；设为空列表不生成节目单
+EPG_SOURCES = [
+    "http://epg.51zmt.top:8000/e.xml.gz",
+]
+# 备注：精简后的节目单输出文件（只含有效频道，同时生成同名.gz预压缩副本），M3U中每个频道写入对应的 tvg-id
+EPG_OUTPUT_FILE = "tv_optimized_epg.xml"
+# 备注：写入M3U文件头 x-tvg-url 的节目单地址（播放器按此地址下载节目单，应指向发布后的 EPG_OUTPUT_FILE.gz），设为None不写入
+EPG_PUBLIC_URL = None
+
+# ---------------------- 【常驻监控模式配置】 ----------------------
+# 备注：常驻模式开关（也可用 python main.py --watch 开启）：频道状态常驻内存，按优先队列持续复测最需要复测的频道，
+#      并通过本地HTTP服务提供最新的M3U/TXT；GitHub Actions 定时运行保持关闭（一次性运行）
+WATCH_MODE = False
+# 备注：本地HTTP服务监听地址与端口，访问路径为输出文件名，如 http://127.0.0.1:8866/tv_optimized_channels.m3u
+WATCH_HTTP_HOST = "127.0.0.1"
+WATCH_HTTP_PORT = 8866
+# 备注：有效源的复测间隔（秒），失效源按 PROBE_CACHE_FAIL_TTL 随连续失败次数退避
+WATCH_REPROBE_INTERVAL = 2 * 3600
+# 备注：分类权重加成：按 CATEGORY_ORDER 从后往前线性递增，排第一的分类复测间隔缩短为 1/(1+加成)，设为0各分类一视同仁
+WATCH_CATEGORY_BOOST = 1.0
+# 备注：每轮最多复测的到期频道数，一轮测完立即更新播放列表
+WATCH_BATCH_SIZE = 64
+# 备注：没有到期频道时的最长等待时间（秒）
+WATCH_IDLE_SLEEP = 30
+# 备注：重新获取源列表的间隔（秒），新增频道立即排队测速，已移除的频道从内存状态中删除
+WATCH_SOURCE_REFRESH = 1800
 # ==============================================================================
 
-# ---------------------- 【按您要求调整：删除全部熊猫频道相关函数与逻辑】 ----------------------
-def extract_cctv_number(channel_name):
-    """提取CCTV频道序号，用于央视内部精准排序，带备注"""
-    match = re.search(r'CCTV[-\s]?(\d+)', channel_name, re.IGNORECASE)
-    if match:
-        try:
-            return int(match.group(1))
-        except:
-            return 999
-    # CGTN系列排序后置
-    if 'CCTV' in channel_name or 'CGTN' in channel_name:
-        cgtn_map = {'法语': 1001, '西班牙语': 1002, '俄语': 1003, '阿拉伯语': 1004, '纪录': 1005}
-        for k, v in cgtn_map.items():
-            if k in channel_name:
-                return v
-        return 1000
-    return 9999
-
-def extract_satellite_first_char(channel_name):
-    """提取卫视频道首字，用于卫视拼音排序，带备注"""
-    if not channel_name:
-        return 'z'
-    # 归一化全角/半角字符，保证排序准确
-    return unicodedata.normalize('NFKC', channel_name[0]).lower()
-
-def get_sort_key(channel_item):
-    """
-    【按您要求调整：排序权重重构，置顶指定分类】
-    排序优先级：央视(0) > 卫视(1) > 电影(2) > 轮播(3) > 其他(4)
-    分类内部排序：央视按频道号升序，卫视按首字母升序，其余分类按速度降序
-    """
-    channel_name = channel_item['name']
-    category = channel_item['category']
-    # 分类权重映射，严格对应置顶顺序
-    category_weight = {
-        "央视": 0,
-        "卫视": 1,
-        "电影": 2,
-        "轮播": 3,
-        "其他": 4
-    }
-    # 基础权重：先按分类置顶
-    base_weight = category_weight.get(category, 99)
-    
-    # 分类内部精细化排序
-    if category == "央视":
-        return (base_weight, extract_cctv_number(channel_name), channel_name)
-    elif category == "卫视":
-        return (base_weight, extract_satellite_first_char(channel_name), channel_name)
-    else:
-        # 电影/轮播/其他 内部按速度从高到低排序，保证最优源在最前
-        return (base_weight, -channel_item['speed'], channel_name)
+# 本轮运行统计（测速阶段写入，写入文件时汇总输出）
+run_stats = defaultdict(int)
+# 备注：同步请求共用的会话，按源站复用keep-alive连接，同一源站的后续请求不再重复TCP/TLS握手
+http_session = http_client.create_session(pool_maxsize=PER_HOST_CONCURRENCY)
+# 备注：频道分类器（规则编译一次，按频道名缓存分类结果，全程复用）
+channel_classifier = classify.load_classifier("main", CATEGORY_ORDER)
+
+# ---------------------- 【多镜像分组：归一化频道名】 ----------------------
+# 备注：归一化规则见 classify.normalize_channel_key（与节目单tvg-id、mains.py共用同一套规则）
+def mirror_key(channel):
+    """频道的镜像分组键（首次计算后缓存在频道记录中，同一频道的多个镜像共用同一个字符串对象）"""
+    if "mirror_key" not in channel:
+        channel["mirror_key"] = sys.intern(classify.normalize_channel_key(channel['name']))
+    return channel["mirror_key"]
 
 # ---------------------- 【按您要求调整：分类重构，删除熊猫频道，新增指定分类】 ----------------------
 def smart_classify(channel_name):
     """
     【核心调整】频道智能分类，严格匹配您要求的5个分类
-    匹配优先级：央视 > 卫视 > 电影 > 轮播 > 其他，避免关键词冲突
-    """
-    name_clean = channel_name.strip().upper()
-    # 1. 央视分类匹配（优先级最高）
-    if 'CCTV' in name_clean or 'CGTN' in name_clean or '中国教育' in name_clean:
-        return "央视"
-    # 2. 卫视分类匹配
-    if '卫视' in name_clean:
-        return "卫视"
-    # 3. 电影分类匹配（新增精准关键词）
-    movie_keywords = ['电影', '影院', '影视', '大片', '院线', '影城']
-    for keyword in movie_keywords:
-        if keyword in channel_name:
-            return "电影"
-    # 4. 轮播分类匹配（新增精准关键词）
-    loop_keywords = ['轮播', '循环', '24小时', '全天', '不间断', '全天候']
-    for keyword in loop_keywords:
-        if keyword in channel_name:
-            return "轮播"
-    # 5. 兜底分类
-    return "其他"
+    匹配优先级：央视 > 卫视 > 电影 > 轮播 > 其他，避免关键词冲突（关键词见 classify_rules.json）
+    """
+    return channel_classifier.classify(channel_name)[0]
+
+# ---------------------- 【HLS测速：解析m3u8播放列表，按真实媒体分片吞吐量测速】 ----------------------
+def is_hls_url(stream_url):
+    """按链接后缀判断是否为HLS播放列表"""
+    return urlparse(stream_url).path.lower().endswith(".m3u8")
+
+def is_hls_content_type(content_type):
+    """按响应Content-Type判断是否为HLS播放列表（兼容无.m3u8后缀的跳转源）"""
+    return "mpegurl" in (content_type or "").lower()
+
+def parse_hls_playlist(playlist_text, playlist_url):
+    """
+    解析HLS播放列表（同步/异步测速共用，解析器见 hls.parse_playlist）
+    返回值：主播放列表返回 ("variant", 选中码率的播放列表地址)
+           媒体播放列表返回 ("media", [(分片地址, 分片时长秒)])
+    """
+    return hls.parse_playlist(playlist_text, playlist_url, HLS_VARIANT, HLS_TEST_SEGMENTS)
+
+def summarize_hls_probe(segment_stats, segment_container=None):
+    """
+    汇总HLS分片测速结果，segment_stats为 [(下载字节数, 下载耗时秒, 分片时长秒)]，segment_container为分片嗅探出的容器类型
+    备注：下载耗时包含分片请求的往返时间，与播放器逐个拉取分片的真实体验一致
+    返回值：达标返回测速结果字典（速度+实时倍率+容器类型，如"hls/ts"），不达标返回None
+    """
+    total_bytes = sum(stat[0] for stat in segment_stats)
+    total_time = sum(stat[1] for stat in segment_stats)
+    total_duration = sum(stat[2] for stat in segment_stats)
+    if total_bytes < 1024 or total_time <= 0:
+        return None
+    speed_kb_s = (total_bytes / total_time) / 1024
+    realtime_factor = total_duration / total_time
+    if speed_kb_s < MIN_PLAY_SPEED or realtime_factor < HLS_MIN_REALTIME_FACTOR:
+        return None
+    return {"speed": round(speed_kb_s, 2), "kind": "hls", "realtime_factor": round(realtime_factor, 2),
+            "container": f"hls/{segment_container}" if segment_container else "hls"}
+
+def finish_hls_probe(segment_stats, segment_container, timing):
+    """汇总HLS测速结果；下载到了分片但速度/实时倍率不达标时在timing中标记too_slow"""
+    result = summarize_hls_probe(segment_stats, segment_container)
+    if result is None and timing is not None and sum(stat[0] for stat in segment_stats) >= 1024:
+        timing["too_slow"] = True
+    return result
+
+def test_hls_speed(playlist_url, timing=None):
+    """【HLS测速】解析播放列表（主列表自动选择码率），下载媒体分片计算吞吐量与实时倍率；传入timing时记录首个响应头到达时间"""
+    # 备注：最多向下解析3层（主列表→子列表），防止异常源循环嵌套
+    for _ in range(3):
+        with http_session.get(playlist_url, headers=GLOBAL_HEADERS, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                              stream=True) as resp:
+            if timing is not None and timing["ttfb_ms"] is None:
+                timing["ttfb_ms"] = resp.elapsed.total_seconds() * 1000
+            resp.raise_for_status()
+            playlist_text = resp.raw.read(HLS_PLAYLIST_MAX_BYTES, decode_content=True).decode("utf-8", "ignore")
+            playlist_url = resp.url
+        kind, target = parse_hls_playlist(playlist_text, playlist_url)
+        if kind == "media":
+            break
+        playlist_url = target
+    else:
+        raise ValueError("HLS播放列表嵌套层级过深")
+    
+    segment_stats, container = [], None
+    for segment_url, duration in target:
+        start_time = time.time()
+        with http_session.get(segment_url, headers=GLOBAL_HEADERS, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                              stream=True) as resp:
+            resp.raise_for_status()
+            data = resp.raw.read(HLS_SEGMENT_MAX_BYTES)
+        segment_stats.append((len(data), time.time() - start_time, duration))
+        link_budget.feed(len(data))
+        container = sniff_hls_segment(data, resp.headers.get("Content-Type"))
+    return finish_hls_probe(segment_stats, container, timing)
+
+# ---------------------- 【内容嗅探：按响应前几KB识别容器类型，网页/JSON等非音视频响应直接判定无效】 ----------------------
+TS_PACKET_SIZE = 188
+# 备注：常见非音视频响应的开头（忽略前导空白、不区分大小写），CDN错误页/认证页/接口错误多为这几类
+NON_MEDIA_PREFIXES = (b"<!doctype", b"<html", b"<head", b"<body", b"<?xml", b"{", b"[")
+# 备注：未识别出容器签名时，Content-Type属于以下类型仍视为音视频流（如MKV以外的少见容器）
+MEDIA_CONTENT_TYPE_PREFIXES = ("video/", "audio/", "application/octet-stream", "binary/octet-stream")
+
+def has_ts_sync(view, packet_size, header_size=0):
+    """检查是否为连续的TS包：任一起始偏移处每隔packet_size字节都是同步字节0x47（至少SNIFF_TS_PACKETS个包）"""
+    for offset in range(header_size, min(packet_size, len(view))):
+        if view[offset] != 0x47:
+            continue
+        positions = range(offset, offset + packet_size * SNIFF_TS_PACKETS, packet_size)
+        if positions[-1] < len(view) and all(view[position] == 0x47 for position in positions):
+            return True
+    return False
+
+def sniff_container(view, content_type=None, final=False):
+    """
+    按响应开头的字节（memoryview，不复制数据）识别容器类型
+    返回值："ts"/"m2ts"/"flv"/"mp4"/"mkv"/"adts"/"mp3"=识别出的音视频容器，"hls"=实为HLS播放列表，
+          "unknown"=未识别但Content-Type为音视频，"reject"=网页/JSON等非音视频响应，None=数据不足需继续读取（final=True时不会返回None）
+    """
+    start = 0
+    while start < min(len(view), 64) and view[start] in b" \t\r\n\xef\xbb\xbf":
+        start += 1
+    head = bytes(view[start:start + 16]).lower()
+    if head.startswith(b"#extm3u"):
+        return "hls"
+    if view[:3] == b"FLV":
+        return "flv"
+    if len(view) >= 8 and view[4:8] in (b"ftyp", b"styp", b"moof", b"moov"):
+        return "mp4"
+    if view[:4] == b"\x1a\x45\xdf\xa3":
+        return "mkv"
+    if view[:3] == b"ID3":
+        return "mp3"
+    if head.startswith(NON_MEDIA_PREFIXES):
+        return "reject"
+    if len(view) < SNIFF_BYTES and not final:
+        return None
+    if has_ts_sync(view, TS_PACKET_SIZE):
+        return "ts"
+    if has_ts_sync(view, TS_PACKET_SIZE + 4, 4):
+        return "m2ts"
+    if len(view) >= 2 and view[0] == 0xFF and view[1] & 0xF6 == 0xF0:
+        return "adts"
+    if (content_type or "").lower().startswith(MEDIA_CONTENT_TYPE_PREFIXES):
+        return "unknown"
+    return "reject"
+
+class ContentSniffer:
+    """
+    测速读取过程中的内容嗅探（同步/异步测速共用）：累积响应前 SNIFF_BYTES 字节，识别出结果后不再复制数据
+    备注：关闭嗅探时直接判定为"unknown"，与原先只按速度判定的行为一致
+    """
+    
+    def __init__(self, content_type):
+        self.content_type = content_type
+        self.buffer = bytearray()
+        self.container = None if SNIFF_ENABLED else "unknown"
+    
+    def feed(self, chunk):
+        """读到一块数据，返回当前判定结果（None表示仍需继续读取）"""
+        if self.container is None:
+            self.buffer += memoryview(chunk)[:SNIFF_BYTES - len(self.buffer)]
+            with memoryview(self.buffer) as view:
+                self.container = sniff_container(view, self.content_type)
+        return self.container
+    
+    def finish(self):
+        """读取结束时仍未判定（数据不足 SNIFF_BYTES），按已读取的数据判定"""
+        if self.container is None:
+            with memoryview(self.buffer) as view:
+                self.container = sniff_container(view, self.content_type, final=True)
+        return self.container
+
+def sniff_hls_segment(data, content_type):
+    """HLS分片内容嗅探，非音视频分片（如鉴权失败返回的网页）抛出异常判定该源无效，返回分片容器类型"""
+    if not SNIFF_ENABLED:
+        return "unknown"
+    with memoryview(data) as view:
+        container = sniff_container(view, content_type, final=True)
+    if container in ("reject", "hls"):
+        raise ValueError("HLS分片不是音视频数据")
+    return container
+
+# ---------------------- 【带宽感知调度：统计全部测速的合计下载速度，链路接近饱和时暂缓新测速并标记受影响的结果】 ----------------------
+# 备注：等待带宽余量时的检查间隔（秒）
+LINK_ADMIT_POLL = 0.05
+
+class LinkBudget:
+    """
+    全部测速的合计下载速度（滑动窗口统计，同步/异步测速共用，线程安全）
+    备注：并发测速时单条流的速度是它分到的本机带宽份额，合计速度接近 LINK_BUDGET_KBPS 时测出的低速不代表源本身慢
+    """
+    
+    def __init__(self):
+        self.samples = deque()
+        self.window_bytes = 0
+        self.saturated_at = None
+        self.lock = threading.Lock()
+    
+    def trim(self, now):
+        while self.samples and now - self.samples[0][0] > LINK_WINDOW:
+            self.window_bytes -= self.samples.popleft()[1]
+    
+    def feed(self, size, now=None):
+        """累计一块下载数据；合计速度达到饱和线时记录饱和时间"""
+        if not LINK_BUDGET_KBPS:
+            return
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            self.samples.append((now, size))
+            self.window_bytes += size
+            self.trim(now)
+            if self.window_bytes / LINK_WINDOW / 1024 >= LINK_BUDGET_KBPS * LINK_SATURATED_RATIO:
+                self.saturated_at = now
+    
+    def rate(self):
+        """当前合计下载速度（KB/s）"""
+        with self.lock:
+            self.trim(time.perf_counter())
+            return self.window_bytes / LINK_WINDOW / 1024
+    
+    def has_headroom(self):
+        """合计下载速度低于放行线（未配置预算时总是放行）"""
+        return not LINK_BUDGET_KBPS or self.rate() < LINK_BUDGET_KBPS * LINK_ADMIT_RATIO
+    
+    def saturated_since(self, start):
+        """start（perf_counter时间）之后链路是否出现过饱和"""
+        return self.saturated_at is not None and self.saturated_at >= start
+
+# 本进程全部测速共用的链路带宽统计
+link_budget = LinkBudget()
+
+# ---------------------- 【分窗口测速采样：提前达标/提前放弃，记录首字节时间与卡顿】 ----------------------
+class ThroughputSampler:
+    """
+    分窗口吞吐量采样器（同步/异步测速共用），每读到一块数据调用feed，返回False时停止读取
+    备注：速度口径与原来一致，从收到响应头后开始计时，排除握手时间
+    """
+    
+    def __init__(self, request_start):
+        self.request_start = request_start
+        self.read_start = time.perf_counter()
+        self.first_byte_at = None
+        self.last_data_at = self.read_start
+        self.end_at = self.read_start
+        self.total_bytes = 0
+        self.window_start = self.read_start
+        self.window_bytes = 0
+        self.window_speeds = []
+        self.stalls = 0
+    
+    def feed(self, size):
+        """累计一块数据，返回是否需要继续读取"""
+        now = time.perf_counter()
+        if self.first_byte_at is None:
+            self.first_byte_at = now
+        elif now - self.last_data_at > SAMPLE_STALL_GAP:
+            self.stalls += 1
+        self.last_data_at = now
+        self.end_at = now
+        self.total_bytes += size
+        link_budget.feed(size, now)
+        self.window_bytes += size
+        if now - self.window_start >= SAMPLE_WINDOW:
+            self.window_speeds.append(self.window_bytes / (now - self.window_start) / 1024)
+            self.window_start = now
+            self.window_bytes = 0
+        return not self.is_decided(now)
+    
+    def mark_stalled(self):
+        """预算内等不到新数据：记为一次卡顿，等待时间计入测速耗时"""
+        self.stalls += 1
+        self.end_at = time.perf_counter()
+    
+    def remaining_budget(self):
+        """剩余读取时间预算（秒）"""
+        return SAMPLE_TIME_BUDGET - (time.perf_counter() - self.read_start)
+    
+    def speed(self):
+        """当前平均速度（KB/s）"""
+        return self.total_bytes / max(self.end_at - self.read_start, 1e-6) / 1024
+    
+    def is_decided(self, now):
+        """判断结果是否已确定：读满上限/预算用完/确定达标/确定无法达标"""
+        elapsed = now - self.read_start
+        if self.total_bytes >= TEST_CHUNK_SIZE or elapsed >= SAMPLE_TIME_BUDGET:
+            return True
+        if len(self.window_speeds) >= SAMPLE_MIN_WINDOWS:
+            if self.speed() >= MIN_PLAY_SPEED * SAMPLE_CONFIDENCE_MARGIN and self.window_speeds[-1] >= MIN_PLAY_SPEED:
+                return True
+        if len(self.window_speeds) >= 2:
+            # 备注：乐观估计——剩余预算全部按已观测到的最快窗口速度下载，平均速度仍不达标则提前放弃
+            best_speed = max(self.window_speeds)
+            reachable = (self.total_bytes / 1024 + best_speed * (SAMPLE_TIME_BUDGET - elapsed)) / SAMPLE_TIME_BUDGET
+            if reachable < MIN_PLAY_SPEED:
+                return True
+        return False
+    
+    def result(self):
+        """汇总采样结果：达标返回测速结果字典（速度+首字节时间+卡顿次数），不达标返回None"""
+        speed_kb_s = self.speed()
+        if speed_kb_s < MIN_PLAY_SPEED:
+            return None
+        return {
+            "speed": round(speed_kb_s, 2),
+            "kind": "stream",
+            "ttfb_ms": round((self.first_byte_at - self.request_start) * 1000),
+            "stalls": self.stalls
+        }
 
 # ---------------------- 【核心优化：测速函数重构，精准度大幅提升，全逻辑带备注】 ----------------------
-def test_stream_speed(stream_url):
+def test_stream_speed(stream_url, health=None, timing=None):
     """
     【精准测速优化】直播流速度测试，排除干扰因素，保证测速结果贴合实际播放体验
     优化点：
     1. 分离连接/读取超时，避免握手超时误判
     2. 重试机制，排除偶发网络抖动
     3. 排除TCP握手/DNS解析时间，仅计算纯数据下载速度
-    4. 大样本数据块，避免瞬时带宽波动
+    4. 分窗口采样，达标/无法达标时提前结束，同时记录首字节时间与卡顿次数
     5. 自动过滤低于最低阈值的无效源
-    返回值：测速成功返回速度(KB/s)，失败/不达标返回None
+    6. HLS(m3u8)源改为下载真实媒体分片测速，TS/FLV等裸流仍按字节读取测速
+    7. 传入health（源站熔断器）时上报连接失败/超时，源站熔断后不再重试
+    8. 传入timing（new_probe_timing）时记录DNS解析/首个响应头到达时间与重试次数（requests不暴露建连耗时，不记录）
+    返回值：测速成功返回测速结果字典 {"speed": 速度(KB/s), "kind": 源类型, ...}，失败/不达标返回None
     """
+    host = urlparse(stream_url).hostname or ""
+    if timing is not None:
+        measure_dns(host, timing)
     # 重试机制
     for retry in range(TEST_RETRY_TIMES + 1):
+        if timing is not None:
+            timing["retries"] = retry
         try:
-            # 备注：stream模式，不自动下载全量数据，仅读取指定块大小
-            with requests.get(
+            if HLS_PROBE_ENABLED and is_hls_url(stream_url):
+                result = test_hls_speed(stream_url, timing)
+                if health:
+                    health.record_success(host)
+                return result
+            request_start = time.perf_counter()
+            # 备注：stream模式，不自动下载全量数据，由采样器决定读取多少
+            with http_session.get(
                 stream_url,
                 headers=GLOBAL_HEADERS,
                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
-                stream=True,
-                verify=False
+                stream=True
             ) as resp:
+                if timing is not None and timing["ttfb_ms"] is None:
+                    timing["ttfb_ms"] = resp.elapsed.total_seconds() * 1000
+                # 备注：收到响应头即说明源站可达，重置该源站的连续失败计数
+                if health:
+                    health.record_success(host)
                 resp.raise_for_status()  # 备注：4xx/5xx状态码直接抛出异常，判定无效
+                # 备注：无.m3u8后缀但实际返回HLS播放列表（常见于跳转源），转为HLS测速
+                if HLS_PROBE_ENABLED and is_hls_content_type(resp.headers.get("Content-Type")):
+                    resp.close()
+                    return test_hls_speed(resp.url, timing)
                 
                 # 备注：排除握手时间，从数据读取开始计时，保证速度计算精准
-                start_time = time.time()
-                # 读取指定大小的数据块
-                data = resp.raw.read(TEST_CHUNK_SIZE)
-                end_time = time.time()
+                # 备注：同步模式单次读取仍受READ_TIMEOUT限制，时间预算在每次读到数据后检查
+                sampler = ThroughputSampler(request_start)
+                # 备注：边读边嗅探前几KB，识别出非音视频响应立即停止读取
+                sniffer = ContentSniffer(resp.headers.get("Content-Type"))
+                for chunk in resp.raw.stream(SAMPLE_CHUNK_SIZE, decode_content=False):
+                    if sniffer.container is None and sniffer.feed(chunk) in ("reject", "hls"):
+                        break
+                    if not sampler.feed(len(chunk)):
+                        break
+                
+                # 备注：网页/JSON等非音视频响应直接判定无效（不重试）；响应体实为HLS播放列表时转为HLS测速
+                container = sniffer.finish() if sniffer.buffer else None
+                if container == "reject":
+                    return None
+                if container == "hls" and HLS_PROBE_ENABLED:
+                    resp.close()
+                    return test_hls_speed(resp.url, timing)
                 
                 # 备注：无数据返回，判定无效
-                if not data or len(data) < 1024:
+                if sampler.total_bytes < 1024:
                     if retry < TEST_RETRY_TIMES:
                         time.sleep(0.5)  # 重试前短暂等待
                         continue
                     return None
                 
-                # 计算纯下载速度（字节/秒 转 KB/s）
-                cost_time = end_time - start_time
-                speed_kb_s = (len(data) / cost_time) / 1024
-                
                 # 备注：低于最低播放阈值，直接过滤
-                if speed_kb_s < MIN_PLAY_SPEED:
-                    return None
-                
-                return round(speed_kb_s, 2)
+                result = sampler.result()
+                if result:
+                    result["container"] = container
+                elif timing is not None:
+                    timing["too_slow"] = True
+                return result
         
-        except Exception:
-            # 重试逻辑
-            if retry < TEST_RETRY_TIMES:
+        except Exception as e:
+            if health and is_host_failure(e):
+                health.record_failure(host)
+            # 重试逻辑（源站已熔断时不再重试）
+            if retry < TEST_RETRY_TIMES and not (health and health.is_tripped(host)):
                 time.sleep(0.5)
                 continue
             return None
     return None
 
 # ---------------------- 【优化：M3U获取函数，自动处理GitHub链接，带备注】 ----------------------
-def fetch_m3u_content(url):
-    """获取M3U文件原始内容，自动兼容GitHub blob/raw链接，避免HTML页面解析失败"""
-    print(f"[1/5] 正在获取直播源列表...")
+def fetch_m3u_content(url, validators=None):
+    """
+    获取M3U文件原始内容，自动兼容GitHub blob/raw链接，避免HTML页面解析失败
+    validators为上次保存的 {"etag", "last_modified"} 时发起条件请求，源列表未变化时服务端返回304不再下载正文
+    备注：正文不整体加载到内存，而是返回逐行读取的迭代器，供解析器边下载边解析
+    返回值：{"lines": 文本行迭代器(304时为None), "not_modified": 是否未变化, "etag", "last_modified"}，获取失败返回None
+    """
+    if not url.startswith(("http://", "https://")):
+        return read_local_m3u(url, validators)
     try:
         # 备注：自动将GitHub blob页面链接转为raw原始文本链接，解决解析失败问题
         parsed_url = urlparse(url)
@@ -180,29 +641,111 @@ def fetch_m3u_content(url):
             print(f"    自动转换为GitHub Raw链接: {raw_url}")
             url = raw_url
         
-        # 发起请求
-        resp = requests.get(url, headers=GLOBAL_HEADERS, timeout=30, verify=False)
-        resp.raise_for_status()
-        content = resp.text
+        # 备注：携带上次的ETag/Last-Modified发起条件请求
+        request_headers = dict(GLOBAL_HEADERS)
+        if validators and validators.get("etag"):
+            request_headers["If-None-Match"] = validators["etag"]
+        if validators and validators.get("last_modified"):
+            request_headers["If-Modified-Since"] = validators["last_modified"]
         
-        # 备注：校验是否为有效M3U文件，避免返回HTML页面
-        if not content.startswith("#EXTM3U"):
-            print(f"    ⚠️  警告：获取的内容不是标准M3U格式，可能解析异常")
-        return content
+        # 发起请求（stream模式，仅读取响应头，正文由解析器按行读取）
+        resp = http_session.get(url, headers=request_headers, timeout=30, stream=True)
+        if resp.status_code == 304:
+            resp.close()
+            print(f"    ♻️  源列表未变化（304 Not Modified），跳过下载")
+            return {
+                "lines": None,
+                "not_modified": True,
+                "etag": validators.get("etag"),
+                "last_modified": validators.get("last_modified")
+            }
+        resp.raise_for_status()
+        return {
+            "lines": iter_response_lines(resp),
+            "not_modified": False,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified")
+        }
     
     except Exception as e:
-        print(f"    ❌ 源列表获取失败: {str(e)}")
+        print(f"    ❌ 源列表获取失败: {url} {str(e)}")
         return None
 
-# ---------------------- 【优化：M3U解析函数，兼容性提升，带备注】 ----------------------
-def parse_m3u(m3u_text):
-    """解析M3U文本，提取频道名称和直播链接，兼容多种M3U格式"""
-    print(f"[2/5] 正在解析频道列表...")
-    channels = []
-    if not m3u_text:
-        return channels
+def read_local_m3u(path, validators=None):
+    """
+    读取本地M3U文件，返回值与 fetch_m3u_content 一致
+    备注：以“修改时间:文件大小”作为校验值，文件未变化时同样按未变化处理，不再重复解析
+    """
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        print(f"    ⚠️  本地源列表不可用，跳过: {path} {str(e)}")
+        return None
+    file_version = f"{stat.st_mtime_ns}:{stat.st_size}"
+    if validators and validators.get("last_modified") == file_version:
+        print(f"    ♻️  本地源列表未变化，跳过读取: {path}")
+        return {"lines": None, "not_modified": True, "etag": None, "last_modified": file_version}
+    return {"lines": iter_file_lines(path), "not_modified": False, "etag": None, "last_modified": file_version}
+
+def iter_file_lines(path):
+    """逐行读取本地文件（兼容带BOM的UTF-8），读取完毕自动关闭文件"""
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for index, line in enumerate(f):
+            if index == 0 and not line.startswith("#EXTM3U"):
+                print(f"    ⚠️  警告：{path} 不是标准M3U格式，可能解析异常")
+            yield line.rstrip("\r\n")
+
+def iter_response_lines(resp):
+    """逐行读取响应正文并解码（M3U8标准规定为UTF-8编码），读取完毕自动关闭连接"""
+    try:
+        for index, raw_line in enumerate(resp.iter_lines(chunk_size=64 * 1024)):
+            line = raw_line.decode("utf-8-sig" if index == 0 else "utf-8", "replace")
+            # 备注：校验是否为有效M3U文件，避免返回HTML页面
+            if index == 0 and not line.startswith("#EXTM3U"):
+                print(f"    ⚠️  警告：获取的内容不是标准M3U格式，可能解析异常")
+            yield line
+    finally:
+        resp.close()
+
+# ---------------------- 【频道记录：紧凑存储解析出的频道，超大源列表（几十万条目）内存占用更低】 ----------------------
+class ChannelRecord:
+    """
+    解析出的单个频道（__slots__ 定长存储，不带实例字典），兼容频道字典的 channel['name'] / channel.get() / in 写法
+    备注：值为None的字段视为未设置（in 判断为False，get 返回默认值）
+    备注：频道名与分组名驻留（sys.intern），多个源/多个镜像中重复出现的频道名、同一分组下的全部频道共用同一个字符串对象
+    """
+    __slots__ = ("name", "raw_url", "raw_group", "unchanged", "sources", "mirror_key", "category")
+    
+    def __init__(self, name, raw_url, raw_group=None):
+        self.name = sys.intern(name)
+        self.raw_url = raw_url
+        self.raw_group = sys.intern(raw_group) if raw_group else raw_group
+        self.unchanged = False
+        self.sources = None
+        self.mirror_key = None
+        self.category = None
+    
+    def __getitem__(self, key):
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return getattr(self, key, None) is not None
     
-    lines = m3u_text.splitlines()
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+# ---------------------- 【优化：M3U解析函数，兼容性提升，带备注】 ----------------------
+# 备注：正则预编译，超大列表逐行解析时避免重复查找正则缓存
+EXTINF_GROUP_PATTERN = re.compile(r'group-title="([^"]+)"', re.IGNORECASE)
+EXTINF_NAME_PATTERN = re.compile(r',\s*(.+)$')
+STREAM_URL_PREFIXES = ("http://", "https://", "rtmp://", "rtsp://")
+
+def iter_parse_m3u(lines):
+    """【生成器解析】逐行解析M3U，每解析出一个频道立即产出，不构建完整列表，兼容多种M3U格式"""
     current_channel_name = "未知频道"
     current_group = None
     
@@ -215,111 +758,1879 @@ def parse_m3u(m3u_text):
         # 解析#EXTINF行，提取频道名称
         if line.startswith("#EXTINF"):
             # 兼容带group-title的格式
-            group_match = re.search(r'group-title="([^"]+)"', line, re.IGNORECASE)
+            group_match = EXTINF_GROUP_PATTERN.search(line)
             if group_match:
                 current_group = group_match.group(1)
             # 提取频道名称（逗号后的内容为频道名）
-            name_match = re.search(r',\s*(.+)$', line)
+            name_match = EXTINF_NAME_PATTERN.search(line)
             if name_match:
                 current_channel_name = name_match.group(1).strip()
             continue
         
         # 解析直播链接行（非#开头的行均为链接）
-        if not line.startswith("#") and line.startswith(("http://", "https://", "rtmp://", "rtsp://")):
-            channels.append({
-                "name": current_channel_name,
-                "raw_url": line,
-                "raw_group": current_group
-            })
+        if line.startswith(STREAM_URL_PREFIXES):
+            yield ChannelRecord(current_channel_name, line, current_group)
+
+# ---------------------- 【源站熔断：同源站连续连接失败/超时后暂缓测速，冷却后半开复测】 ----------------------
+# 备注：只有连接失败/超时才计入源站故障，4xx/5xx/速度不达标说明源站可达，不触发熔断
+HOST_FAILURE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.packages.urllib3.exceptions.ReadTimeoutError,
+    aiohttp.ClientConnectorError,
+    aiohttp.ServerTimeoutError,
+    asyncio.TimeoutError
+)
+
+def is_host_failure(error):
+    """判断测速异常是否属于源站故障（连接失败/超时）"""
+    return isinstance(error, HOST_FAILURE_ERRORS)
+
+class HostHealth:
+    """
+    单轮运行内的源站健康度跟踪（熔断器），同步/异步两种模式共用
+    状态流转：正常 →(连续失败达到阈值)→ 熔断 →(冷却结束)→ 半开复测 →(成功)→ 正常 / (失败)→ 本轮放弃
+    """
+    
+    def __init__(self):
+        self.failure_streaks = defaultdict(int)
+        self.states = {}       # host -> "open"(熔断) / "half_open"(复测中) / "dead"(复测失败，本轮放弃)
+        self.opened_at = {}
+        self.skipped_urls = set()
+    
+    def is_tripped(self, host):
+        """源站是否处于熔断/复测/放弃状态"""
+        return host in self.states
+    
+    def admit(self, host):
+        """
+        测速前询问是否放行
+        返回值："probe"=正常测速，"trial"=半开复测（每个源站仅放行1个），"wait"=冷却中/复测进行中，"skip"=直接跳过
+        """
+        if not HOST_BREAKER_THRESHOLD:
+            return "probe"
+        state = self.states.get(host)
+        if state is None:
+            return "probe"
+        if state == "dead":
+            return "skip"
+        if state == "open" and self.retry_after(host) <= 0:
+            self.states[host] = "half_open"
+            return "trial"
+        return "wait"
+    
+    def retry_after(self, host):
+        """距离下次可询问的秒数：熔断中为剩余冷却时间，复测进行中为短暂轮询间隔"""
+        if self.states.get(host) == "open":
+            return max(HOST_BREAKER_COOLDOWN - (time.time() - self.opened_at[host]), 0)
+        return 0.5
+    
+    def record_success(self, host):
+        """源站有响应（收到响应头），清零连续失败次数并恢复正常"""
+        self.failure_streaks[host] = 0
+        self.states.pop(host, None)
+    
+    def record_failure(self, host):
+        """源站连接失败/超时：连续失败达到阈值进入熔断，半开复测失败则本轮放弃"""
+        if self.states.get(host) == "half_open":
+            self.states[host] = "dead"
+            return
+        self.failure_streaks[host] += 1
+        if HOST_BREAKER_THRESHOLD and self.failure_streaks[host] >= HOST_BREAKER_THRESHOLD and host not in self.states:
+            self.states[host] = "open"
+            self.opened_at[host] = time.time()
+    
+    def finish_trial(self, host):
+        """半开复测结束仍未判定（非连接类异常），视为源站可达，恢复正常"""
+        if self.states.get(host) == "half_open":
+            self.record_success(host)
+    
+    def release_trial(self, host):
+        """半开复测未完成（被竞速取消/测速中断），退回熔断状态（冷却已结束），下一个等待的链接立即接替复测"""
+        if self.states.get(host) == "half_open":
+            self.states[host] = "open"
+    
+    def skip(self, url):
+        """记录被熔断跳过的链接（未实际测速，不写入测速缓存）"""
+        self.skipped_urls.add(url)
+    
+    def update_run_stats(self):
+        """写入本轮熔断统计，供输出汇总使用"""
+        run_stats["breaker_skipped"] = len(self.skipped_urls)
+        run_stats["breaker_hosts"] = sum(1 for state in self.states.values() if state == "dead")
+
+# ---------------------- 【多镜像竞速：同频道镜像组内竞速，选出前N个后取消其余镜像测速】 ----------------------
+class MirrorRace:
+    """同一频道（归一化频道名相同）的多个镜像竞速：组内有效镜像达到 MIRROR_TOP_N 个后，取消进行中的、跳过未开始的镜像测速"""
+    
+    def __init__(self):
+        self.winners = defaultdict(int)
+        self.running = defaultdict(set)
+        self.cancelled_tasks = set()
+        self.lost_urls = set()
+    
+    def is_settled(self, key):
+        """该频道是否已选出足够的有效镜像"""
+        return MIRROR_GROUPING and self.winners[key] >= MIRROR_TOP_N
+    
+    def record(self, key, result):
+        """记录一个镜像的测速结果（含缓存命中），选满后取消该频道其余正在测速的镜像（仅异步模式存在）"""
+        if result and result["speed"] >= MIN_PLAY_SPEED:
+            self.winners[key] += 1
+        if self.is_settled(key):
+            for task in self.running.pop(key, ()):
+                if not task.done():
+                    self.cancelled_tasks.add(task)
+                    task.cancel()
+    
+    def lose(self, url):
+        """记录落选（被取消/跳过）的镜像链接（未完成测速，不写入测速缓存）"""
+        self.lost_urls.add(url)
+
+# ---------------------- 【对冲请求：按本轮首字节时间分布对冲慢握手，重试预算防止放大故障源站负载】 ----------------------
+class ProbeHedger:
+    """
+    单轮运行的对冲请求控制（异步模式）：对冲阈值取本轮已观测TTFB（请求发出→收到响应头）的分位数
+    备注：对冲与失败重试共用本轮重试预算，每发起1次测速积累 RETRY_BUDGET_RATIO 次；预算耗尽、源站已熔断或已有连续失败时不再对冲
+    """
+    
+    def __init__(self):
+        self.ttfb_samples = deque(maxlen=HEDGE_TTFB_WINDOW)
+        self.budget = float(RETRY_BUDGET_INITIAL)
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+    
+    def observe(self, ttfb_seconds):
+        """记录一次收到响应头的耗时"""
+        self.ttfb_samples.append(ttfb_seconds)
+    
+    def delay(self):
+        """当前对冲阈值（秒），样本不足时返回None（不对冲）"""
+        if len(self.ttfb_samples) < HEDGE_MIN_SAMPLES:
+            return None
+        samples = sorted(self.ttfb_samples)
+        return max(samples[min(int(len(samples) * HEDGE_TTFB_QUANTILE), len(samples) - 1)], HEDGE_MIN_DELAY)
+    
+    def deposit(self):
+        """每发起1次测速积累一部分预算"""
+        self.budget += RETRY_BUDGET_RATIO
+    
+    def try_spend(self, host, health=None):
+        """申请1次对冲/重试；传入health时源站已熔断或已有连续失败则拒绝（不向故障源站追加请求）"""
+        if health and (health.is_tripped(host) or health.failure_streaks[host]):
+            return False
+        if self.budget < 1:
+            self.denied += 1
+            return False
+        self.budget -= 1
+        return True
     
-    print(f"    ✅ 共解析到 {len(channels)} 个频道")
-    return channels
+    def record_hedge(self, hedge_won):
+        """记录一次已发起的对冲，hedge_won 表示对冲请求先于首个请求收到响应头"""
+        self.hedged += 1
+        self.hedge_wins += int(hedge_won)
+    
+    def update_run_stats(self):
+        """写入本轮对冲统计，供输出汇总使用"""
+        run_stats["hedged"] = self.hedged
+        run_stats["hedge_wins"] = self.hedge_wins
+        run_stats["retry_budget_denied"] = self.denied
+
+class ProbeRun:
+    """单轮测速的共享状态（同步/异步两种模式共用）：源站熔断器、多镜像竞速、对冲请求控制与带宽饱和标记（仅异步模式使用）、中断恢复日志"""
+    
+    def __init__(self, journal=None):
+        self.health = HostHealth()
+        self.race = MirrorRace()
+        self.hedger = ProbeHedger()
+        self.journal = journal
+        # 备注：链路饱和期间测出不达标的链接，测速结束后以低并发复测
+        self.saturated_urls = set()
+    
+    def record_probe(self, url, timing, result):
+        """记录一次完成的测速：写入运行指标，并立即追加到中断恢复日志"""
+        run_metrics.record_probe(url, timing, result)
+        if self.journal:
+            self.journal.append(url, result)
+    
+    def unprobed_urls(self):
+        """本轮未完成测速的链接（熔断跳过+镜像落选），不写入测速缓存"""
+        return self.health.skipped_urls | self.race.lost_urls
+    
+    def update_run_stats(self):
+        """写入本轮测速统计，供输出汇总使用"""
+        self.health.update_run_stats()
+        self.hedger.update_run_stats()
+        run_stats["mirror_lost"] = len(self.race.lost_urls)
+
+# ---------------------- 【运行指标：分阶段耗时、单次测速耗时拆解、按源站聚合的延迟直方图】 ----------------------
+def new_probe_timing():
+    """
+    单次测速的耗时记录（同步/异步测速函数逐项填写），未测到的项保持None
+    备注：too_slow 表示收到了数据但速度不达标（区别于连接失败/非音视频响应），供带宽饱和复测判断
+    """
+    return {"started_at": time.perf_counter(), "dns_ms": None, "connect_ms": None, "ttfb_ms": None, "retries": 0,
+            "too_slow": False}
+
+def add_timing(timing, key, elapsed_seconds):
+    """累加一项耗时（毫秒），HLS测速的多次请求按总和计算"""
+    timing[key] = (timing[key] or 0) + elapsed_seconds * 1000
+
+def measure_dns(host, timing):
+    """同步测速用：单独计时域名解析，启用DNS缓存时随后的请求直接复用本次解析结果"""
+    if not host or http_client.is_ip_literal(host):
+        return
+    start = time.perf_counter()
+    try:
+        http_client.resolve_host(host)
+    except (OSError, UnicodeError):
+        pass
+    add_timing(timing, "dns_ms", time.perf_counter() - start)
+
+def create_probe_trace_config():
+    """
+    异步测速用的aiohttp请求追踪：按 session.get(..., trace_request_ctx=timing) 传入的耗时记录累加DNS/建连时间，记录首个响应头到达时间
+    备注：aiohttp不单独暴露TLS握手事件，HTTPS源的建连时间包含TLS握手；复用keep-alive连接时不产生建连时间
+    """
+    trace_config = aiohttp.TraceConfig()
+    
+    async def on_request_start(session, ctx, params):
+        ctx.request_start = time.perf_counter()
+    
+    async def on_dns_start(session, ctx, params):
+        ctx.dns_start = time.perf_counter()
+    
+    async def on_dns_end(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            add_timing(ctx.trace_request_ctx, "dns_ms", time.perf_counter() - ctx.dns_start)
+    
+    async def on_connect_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+    
+    async def on_connect_end(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            add_timing(ctx.trace_request_ctx, "connect_ms", time.perf_counter() - ctx.connect_start)
+    
+    async def on_request_end(session, ctx, params):
+        timing = ctx.trace_request_ctx
+        if timing is not None and timing["ttfb_ms"] is None:
+            timing["ttfb_ms"] = (time.perf_counter() - ctx.request_start) * 1000
+    
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_end)
+    trace_config.on_connection_create_start.append(on_connect_start)
+    trace_config.on_connection_create_end.append(on_connect_end)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+def latency_histogram(values):
+    """按 METRICS_LATENCY_BUCKETS_MS 统计累计直方图（与Prometheus histogram口径一致）"""
+    values = [value for value in values if value is not None]
+    return {
+        "buckets": {str(bound): sum(1 for value in values if value <= bound) for bound in METRICS_LATENCY_BUCKETS_MS},
+        "count": len(values),
+        "sum_ms": round(sum(values), 1),
+        "p50_ms": round(sorted(values)[len(values) // 2], 1) if values else None,
+        "max_ms": round(max(values), 1) if values else None,
+    }
+
+def prometheus_label(value):
+    """Prometheus标签值转义"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class RunMetrics:
+    """
+    本轮运行指标：fetch/parse/probe/sort/write 分阶段耗时 + 每次测速的耗时拆解，运行结束后导出JSON与Prometheus textfile
+    备注：流式流水线下解析与测速同时进行，parse 与 probe 两个阶段的耗时互相重叠
+    """
+    
+    def __init__(self):
+        self.phases = defaultdict(float)
+        self.probes = []
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时（同一阶段多次进入时累加）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+    
+    def timed_iter(self, name, iterable):
+        """包装生成器，把每次取值花费的时间计入指定阶段（流式解析时包含边下载边解析的时间）"""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.phases[name] += time.perf_counter() - start
+            yield item
+    
+    def record_probe(self, url, timing, result):
+        """记录一次实际完成的测速（缓存命中/熔断跳过/竞速取消的不记录）"""
+        record = {"host": urlparse(url).hostname or "", "url": url, "ok": bool(result),
+                  "kind": result.get("kind") if result else None, "speed": result.get("speed") if result else None,
+                  "retries": timing["retries"], "total_ms": round((time.perf_counter() - timing["started_at"]) * 1000, 1)}
+        for key in ("dns_ms", "connect_ms", "ttfb_ms"):
+            record[key] = round(timing[key], 1) if timing[key] is not None else None
+        self.probes.append(record)
+    
+    def host_summary(self):
+        """按源站聚合：测速次数、成功/失败数、重试次数、平均速度、DNS/建连/首字节延迟直方图"""
+        by_host = defaultdict(list)
+        for record in self.probes:
+            by_host[record["host"]].append(record)
+        summary = {}
+        for host, records in sorted(by_host.items()):
+            speeds = [record["speed"] for record in records if record["speed"] is not None]
+            summary[host] = {
+                "probes": len(records),
+                "ok": sum(1 for record in records if record["ok"]),
+                "retries": sum(record["retries"] for record in records),
+                "avg_speed": round(sum(speeds) / len(speeds), 2) if speeds else None,
+                **{key: latency_histogram([record[key] for record in records]) for key in ("dns_ms", "connect_ms", "ttfb_ms", "total_ms")},
+            }
+        return summary
+    
+    def export_json(self, path):
+        summary = {
+            "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "probes_total": len(self.probes),
+            "probes_ok": sum(1 for record in self.probes if record["ok"]),
+            "retries_total": sum(record["retries"] for record in self.probes),
+            "hosts": self.host_summary(),
+            "probes": self.probes,
+        }
+        write_file_atomic(path, json.dumps(summary, ensure_ascii=False, indent=1))
+    
+    def export_prometheus(self, path):
+        """Prometheus textfile：阶段耗时、按源站的测速次数/重试/平均速度、延迟直方图（秒）"""
+        lines = [
+            "# HELP iptv_phase_duration_seconds Wall time spent in each pipeline phase of the last run.",
+            "# TYPE iptv_phase_duration_seconds gauge",
+        ]
+        lines += [f'iptv_phase_duration_seconds{{phase="{name}"}} {seconds:.3f}' for name, seconds in self.phases.items()]
+        hosts = self.host_summary()
+        gauges = [
+            ("iptv_probe_count", "Probes run against the host in the last run.", lambda s: s["probes"]),
+            ("iptv_probe_ok_count", "Probes that passed the speed threshold.", lambda s: s["ok"]),
+            ("iptv_probe_retries_count", "Probe retries against the host.", lambda s: s["retries"]),
+            ("iptv_probe_speed_kbps_avg", "Average measured speed of passing probes (KB/s).", lambda s: s["avg_speed"]),
+        ]
+        for name, help_text, getter in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f'{name}{{host="{prometheus_label(host)}"}} {getter(stats)}'
+                      for host, stats in hosts.items() if getter(stats) is not None]
+        for key, metric in (("dns_ms", "dns"), ("connect_ms", "connect"), ("ttfb_ms", "ttfb"), ("total_ms", "total")):
+            name = f"iptv_probe_{metric}_seconds"
+            lines += [f"# HELP {name} Per-probe {metric} latency by host.", f"# TYPE {name} histogram"]
+            for host, stats in hosts.items():
+                histogram, label = stats[key], f'host="{prometheus_label(host)}"'
+                if not histogram["count"]:
+                    continue
+                for bound, count in histogram["buckets"].items():
+                    lines.append(f'{name}_bucket{{{label},le="{int(bound) / 1000:g}"}} {count}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+                lines.append(f"{name}_sum{{{label}}} {histogram['sum_ms'] / 1000:.3f}")
+                lines.append(f"{name}_count{{{label}}} {histogram['count']}")
+        write_file_atomic(path, "\n".join(lines) + "\n")
+    
+    def export(self):
+        """按配置导出JSON/Prometheus指标文件"""
+        for path, exporter in ((METRICS_JSON_FILE, self.export_json), (METRICS_PROM_FILE, self.export_prometheus)):
+            if path:
+                exporter(path)
+                print(f"📈 运行指标已导出：{path}")
+
+@contextlib.contextmanager
+def open_atomic(path):
+    """
+    以写入方式打开临时文件，正常写完后原子替换目标文件，读取方只会看到旧文件或完整的新文件
+    备注：写入过程中出错/被中断时删除临时文件，原有目标文件保持不变
+    """
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_file_atomic(path, text):
+    """先写临时文件再替换，采集程序不会读到写了一半的文件"""
+    with open_atomic(path) as f:
+        f.write(text)
+
+# 本轮运行指标（各阶段与测速函数写入，程序结束时导出）
+run_metrics = RunMetrics()
+
+# ---------------------- 【并发测速引擎：aiohttp异步测速，全局+单源站双重并发限制】 ----------------------
+async def read_stream_chunk(resp, size):
+    """读取至多size字节数据，语义与requests的raw.read一致：读满或数据流结束才返回"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = await resp.content.read(size - len(buffer))
+        if not chunk:
+            break
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+async def async_test_hls_speed(session, playlist_url, timing=None):
+    """test_hls_speed 的异步版本，播放列表解析与结果汇总逻辑共用"""
+    for _ in range(3):
+        # 备注：会话默认关闭自动解压，播放列表文本需单独开启，兼容gzip压缩的m3u8
+        async with session.get(playlist_url, headers=GLOBAL_HEADERS, auto_decompress=True, trace_request_ctx=timing) as resp:
+            resp.raise_for_status()
+            playlist_text = (await read_stream_chunk(resp, HLS_PLAYLIST_MAX_BYTES)).decode("utf-8", "ignore")
+            playlist_url = str(resp.url)
+        kind, target = parse_hls_playlist(playlist_text, playlist_url)
+        if kind == "media":
+            break
+        playlist_url = target
+    else:
+        raise ValueError("HLS播放列表嵌套层级过深")
+    
+    segment_stats, container = [], None
+    for segment_url, duration in target:
+        start_time = time.time()
+        async with session.get(segment_url, headers=GLOBAL_HEADERS, trace_request_ctx=timing) as resp:
+            resp.raise_for_status()
+            data = await read_stream_chunk(resp, HLS_SEGMENT_MAX_BYTES)
+        segment_stats.append((len(data), time.time() - start_time, duration))
+        link_budget.feed(len(data))
+        container = sniff_hls_segment(data, resp.headers.get("Content-Type"))
+    return finish_hls_probe(segment_stats, container, timing)
+
+async def open_stream_hedged(session, stream_url, timing=None, hedger=None, health=None):
+    """
+    发起直播流请求，返回已收到响应头的响应；传入hedger时首个请求超过对冲阈值仍未收到响应头，则并行发起第二个请求，先成功者胜出
+    备注：落选请求立即取消（已收到的响应直接释放）；两个请求都失败时抛出首个请求的异常
+    """
+    host = urlparse(stream_url).hostname or ""
+    
+    async def attempt():
+        started = time.perf_counter()
+        resp = await session.get(stream_url, headers=GLOBAL_HEADERS, trace_request_ctx=timing)
+        if hedger:
+            hedger.observe(time.perf_counter() - started)
+        return resp
+    
+    tasks = [asyncio.ensure_future(attempt())]
+    delay = hedger.delay() if hedger else None
+    if delay is not None:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done and hedger.try_spend(host, health):
+            tasks.append(asyncio.ensure_future(attempt()))
+    
+    pending = set(tasks)
+    winner_task, error = None, None
+    try:
+        while pending and winner_task is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif winner_task is None:
+                    winner_task = task
+                else:
+                    task.result().release()
+    finally:
+        for task in pending:
+            task.cancel()
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, aiohttp.ClientResponse):
+                result.release()
+    
+    if len(tasks) > 1:
+        hedger.record_hedge(winner_task is tasks[1])
+    if winner_task is None:
+        raise error
+    return winner_task.result()
+
+async def async_test_stream_speed(session, stream_url, health=None, timing=None, hedger=None):
+    """
+    test_stream_speed 的异步版本，测速口径/重试次数/速度阈值/熔断上报与同步版本完全一致
+    传入timing时由会话的请求追踪记录DNS/建连/首个响应头到达时间（见 create_probe_trace_config），本函数记录重试次数
+    传入hedger（ProbeHedger）时慢握手的源发起对冲请求，失败重试同样消耗本轮重试预算
+    返回值：测速成功返回测速结果字典，失败/不达标返回None
+    """
+    host = urlparse(stream_url).hostname or ""
+    if hedger:
+        hedger.deposit()
+    for retry in range(TEST_RETRY_TIMES + 1):
+        if timing is not None:
+            timing["retries"] = retry
+        try:
+            if HLS_PROBE_ENABLED and is_hls_url(stream_url):
+                result = await async_test_hls_speed(session, stream_url, timing)
+                if health:
+                    health.record_success(host)
+                return result
+            request_start = time.perf_counter()
+            async with await open_stream_hedged(session, stream_url, timing, hedger, health) as resp:
+                if health:
+                    health.record_success(host)
+                resp.raise_for_status()
+                if HLS_PROBE_ENABLED and is_hls_content_type(resp.headers.get("Content-Type")):
+                    resp.close()
+                    return await async_test_hls_speed(session, str(resp.url), timing)
+                
+                # 备注：同样排除握手时间，从数据读取开始计时；每次等待数据不超过剩余时间预算
+                sampler = ThroughputSampler(request_start)
+                sniffer = ContentSniffer(resp.headers.get("Content-Type"))
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(resp.content.readany(), timeout=max(sampler.remaining_budget(), 0.01))
+                    except asyncio.TimeoutError:
+                        # 备注：预算内一直没有新数据，按已读取的数据判定（记为一次卡顿）
+                        sampler.mark_stalled()
+                        break
+                    if not chunk:
+                        break
+                    if sniffer.container is None and sniffer.feed(chunk) in ("reject", "hls"):
+                        break
+                    if not sampler.feed(len(chunk)):
+                        break
+                
+                container = sniffer.finish() if sniffer.buffer else None
+                if container == "reject":
+                    return None
+                if container == "hls" and HLS_PROBE_ENABLED:
+                    resp.close()
+                    return await async_test_hls_speed(session, str(resp.url), timing)
+                
+                if sampler.total_bytes < 1024:
+                    if retry < TEST_RETRY_TIMES and (hedger is None or hedger.try_spend(host)):
+                        await asyncio.sleep(0.5)
+                        continue
+                    return None
+                result = sampler.result()
+                if result:
+                    result["container"] = container
+                elif timing is not None:
+                    timing["too_slow"] = True
+                return result
+        
+        except Exception as e:
+            if health and is_host_failure(e):
+                health.record_failure(host)
+            if (retry < TEST_RETRY_TIMES and not (health and health.is_tripped(host))
+                    and (hedger is None or hedger.try_spend(host))):
+                await asyncio.sleep(0.5)
+                continue
+            return None
+    return None
+
+# 备注：未实际完成测速的频道进度提示
+PROBE_NOTE_BREAKER = "⏭️  源站熔断，跳过"
+PROBE_NOTE_MIRROR = "🏁 已选出更优镜像，取消测速"
+
+def print_probe_result(index, total_count, channel_name, result, note=None):
+    """输出单个频道的测速结果（同步/异步两种模式共用，流式测速时总数未知显示为?）"""
+    progress = f"{index}/{total_count if total_count is not None else '?'}"
+    if note:
+        print(f"    测速 [{progress}] {channel_name:<30}{note}")
+    elif result:
+        category = smart_classify(channel_name)
+        extra = f" 实时倍率: {result['realtime_factor']}x" if "realtime_factor" in result else ""
+        if "ttfb_ms" in result:
+            extra += f" 首字节: {result['ttfb_ms']}ms"
+        if result.get("stalls"):
+            extra += f" 卡顿: {result['stalls']}次"
+        print(f"    测速 [{progress}] {channel_name:<30}✅ 有效 速度: {result['speed']} KB/s{extra} 分类: {category}")
+    else:
+        print(f"    测速 [{progress}] {channel_name:<30}❌ 无效/速度不达标")
+
+def create_probe_session():
+    """创建测速用的aiohttp会话（连接池上限与并发配置一致）"""
+    # 备注：sock_connect/sock_read 分别对应同步版本的连接超时/读取超时
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    # 备注：开启对冲时连接池上限翻倍，给对冲请求留出连接名额（测速并发仍由引擎的信号量控制，对冲次数受重试预算限制）
+    pool_factor = 2 if HEDGE_ENABLED else 1
+    connector = http_client.create_async_connector(limit=MAX_CONCURRENCY * pool_factor,
+                                                   limit_per_host=PER_HOST_CONCURRENCY * pool_factor)
+    # 备注：关闭自动解压，与requests的raw.read一样按原始字节计算速度
+    return aiohttp.ClientSession(timeout=timeout, connector=connector, auto_decompress=False,
+                                 trace_configs=[create_probe_trace_config()])
+
+class AsyncProbeEngine:
+    """
+    并发测速引擎：全局+单源站双重并发限制，批量测速与流式测速共用
+    备注：先占用源站并发名额再占用全局名额，排队中的同源请求不会挤占全局并发
+    """
+    
+    def __init__(self, session, probe_run, total_count=None, concurrency=None):
+        self.session = session
+        self.probe_run = probe_run
+        self.health = probe_run.health
+        self.race = probe_run.race
+        self.hedger = probe_run.hedger if HEDGE_ENABLED else None
+        self.total_count = total_count
+        self.finished_count = 0
+        self.active_count = 0
+        self.global_semaphore = asyncio.Semaphore(concurrency or MAX_CONCURRENCY)
+        self.host_semaphores = defaultdict(lambda: asyncio.Semaphore(PER_HOST_CONCURRENCY))
+    
+    async def wait_for_link_headroom(self):
+        """链路合计下载速度接近预算时暂缓发起新测速（没有进行中的测速时直接放行，避免空等）"""
+        if self.active_count and not link_budget.has_headroom():
+            run_stats["link_throttled"] += 1
+            while self.active_count and not link_budget.has_headroom():
+                await asyncio.sleep(LINK_ADMIT_POLL)
+    
+    async def probe(self, channel):
+        """测速单个频道并输出进度，返回测速结果字典或None（源站熔断时等待半开复测结果或直接跳过）"""
+        host = urlparse(channel['raw_url']).hostname or ""
+        async with self.host_semaphores[host]:
+            decision = self.health.admit(host)
+            completed = False
+            # 备注：从放行到测速结束整体包在try中，半开复测在等待并发名额/带宽余量时被竞速取消也会交还复测资格，
+            #      否则源站永远停在复测中，其余链接无限等待
+            try:
+                # 备注：熔断冷却期间释放源站并发名额等待，不占用任何测速名额
+                while decision == "wait":
+                    self.host_semaphores[host].release()
+                    try:
+                        await asyncio.sleep(self.health.retry_after(host))
+                    finally:
+                        await self.host_semaphores[host].acquire()
+                    decision = self.health.admit(host)
+                
+                result = None
+                if decision != "skip":
+                    async with self.global_semaphore:
+                        await self.wait_for_link_headroom()
+                        timing = new_probe_timing()
+                        self.active_count += 1
+                        try:
+                            result = await async_test_stream_speed(self.session, channel['raw_url'], self.health, timing, self.hedger)
+                            completed = True
+                        finally:
+                            self.active_count -= 1
+                        self.probe_run.record_probe(channel['raw_url'], timing, result)
+                        # 备注：收到了数据但速度不达标、且测速期间链路饱和过，结果可能被并发挤占带宽拖低，留待低并发复测
+                        if result is None and timing["too_slow"] and link_budget.saturated_since(timing["started_at"]):
+                            self.probe_run.saturated_urls.add(channel['raw_url'])
+            finally:
+                if decision == "trial":
+                    if completed:
+                        self.health.finish_trial(host)
+                    else:
+                        self.health.release_trial(host)
+        
+        self.finished_count += 1
+        if decision == "skip":
+            self.health.skip(channel['raw_url'])
+        print_probe_result(self.finished_count, self.total_count, channel['name'], result,
+                           PROBE_NOTE_BREAKER if decision == "skip" else None)
+        return result
+    
+    async def race_probe(self, channel):
+        """参与多镜像竞速的测速：该频道已选满时直接跳过，测速中被其他镜像选满时取消"""
+        key = mirror_key(channel)
+        if not self.race.is_settled(key):
+            task = asyncio.create_task(self.probe(channel))
+            self.race.running[key].add(task)
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                # 备注：仅处理被竞速取消的情况，整体任务被取消时照常向上抛出
+                if task not in self.race.cancelled_tasks:
+                    raise
+            else:
+                self.race.running[key].discard(task)
+                self.race.record(key, result)
+                return result
+        
+        self.race.lose(channel['raw_url'])
+        self.finished_count += 1
+        print_probe_result(self.finished_count, self.total_count, channel['name'], None, PROBE_NOTE_MIRROR)
+        return None
+
+async def probe_channels_async(channels, probe_run, concurrency=None):
+    """【并发测速】全部频道并发测速（concurrency 指定时覆盖 MAX_CONCURRENCY），返回与输入顺序一一对应的测速结果列表"""
+    async with create_probe_session() as session:
+        engine = AsyncProbeEngine(session, probe_run, len(channels), concurrency)
+        return await asyncio.gather(*(engine.race_probe(channel) for channel in channels))
+
+async def probe_channel_stream_async(channel_iter, lookup_cached, probe_run):
+    """
+    【流式并发测速】从解析器（同步生成器，内部边下载边解析）按批取出频道，取出即投入测速，下载/解析/测速同时进行
+    lookup_cached(channel) 返回 (是否命中缓存, 缓存结果)，命中缓存的频道不再测速
+    返回值：(频道列表, 与频道一一对应的测速结果列表, 本次实际测速的频道下标列表)
+    """
+    loop = asyncio.get_running_loop()
+    channels, results, probed_indexes = [], [], []
+    running_tasks = set()
+    # 备注：限制排队+进行中的任务数，解析速度远快于测速时让解析器等待，避免任务无限堆积
+    window = asyncio.Semaphore(STREAM_PROBE_WINDOW)
+    
+    async with create_probe_session() as session:
+        engine = AsyncProbeEngine(session, probe_run)
+        
+        async def probe_one(index, channel):
+            try:
+                results[index] = await engine.race_probe(channel)
+            finally:
+                window.release()
+        
+        while True:
+            # 备注：解析器内部是阻塞的网络读取，放到线程池执行，不阻塞事件循环中正在进行的测速
+            batch = await loop.run_in_executor(None, lambda: list(itertools.islice(channel_iter, STREAM_BATCH_SIZE)))
+            if not batch:
+                break
+            for channel in batch:
+                index = len(channels)
+                channels.append(channel)
+                hit, result = lookup_cached(channel)
+                results.append(result)
+                if hit:
+                    continue
+                probed_indexes.append(index)
+                await window.acquire()
+                task = asyncio.create_task(probe_one(index, channel))
+                running_tasks.add(task)
+                task.add_done_callback(running_tasks.discard)
+        
+        if running_tasks:
+            await asyncio.gather(*running_tasks)
+    return channels, results, probed_indexes
+
+def probe_channel_stream_sync(channel_iter, lookup_cached, probe_run, total_count=None):
+    """
+    probe_channel_stream_async 的串行版本：逐个取出频道逐个测速，返回值含义一致
+    备注：熔断源站的链接先跳过，全部处理完后再按冷却时间半开复测，不阻塞其他源站
+    备注：多镜像竞速按顺序进行，频道已选满有效镜像后跳过其余镜像
+    """
+    health, race = probe_run.health, probe_run.race
+    channels, results, probed_indexes, deferred_indexes = [], [], [], []
+    
+    def probe_one(index, decision):
+        channel = channels[index]
+        host = urlparse(channel['raw_url']).hostname or ""
+        key = mirror_key(channel)
+        note = None
+        if decision == "lost":
+            race.lose(channel['raw_url'])
+            note = PROBE_NOTE_MIRROR
+        elif decision == "skip":
+            health.skip(channel['raw_url'])
+            note = PROBE_NOTE_BREAKER
+        else:
+            timing = new_probe_timing()
+            completed = False
+            try:
+                results[index] = test_stream_speed(channel['raw_url'], health, timing)
+                completed = True
+            finally:
+                if decision == "trial":
+                    if completed:
+                        health.finish_trial(host)
+                    else:
+                        health.release_trial(host)
+            probe_run.record_probe(channel['raw_url'], timing, results[index])
+            race.record(key, results[index])
+        print_probe_result(len(probed_indexes) - len(deferred_indexes), total_count, channel['name'], results[index], note)
+    
+    def admit(channel):
+        """频道已选满有效镜像时直接判负（不占用源站的半开复测资格），否则询问熔断器"""
+        if race.is_settled(mirror_key(channel)):
+            return "lost"
+        return health.admit(urlparse(channel['raw_url']).hostname or "")
+    
+    for channel in channel_iter:
+        index = len(channels)
+        channels.append(channel)
+        hit, result = lookup_cached(channel)
+        results.append(result)
+        if hit:
+            continue
+        probed_indexes.append(index)
+        decision = admit(channel)
+        if decision == "wait":
+            deferred_indexes.append(index)
+        else:
+            probe_one(index, decision)
+    
+    # 备注：处理被熔断延后的链接，冷却未结束时等待
+    while deferred_indexes:
+        index = deferred_indexes.pop(0)
+        host = urlparse(channels[index]['raw_url']).hostname or ""
+        decision = admit(channels[index])
+        while decision == "wait":
+            time.sleep(health.retry_after(host))
+            decision = admit(channels[index])
+        probe_one(index, decision)
+    return channels, results, probed_indexes
+
+def probe_channels_sync(channels, probe_run):
+    """【串行测速】逐个频道测速，返回与输入顺序一一对应的测速结果列表"""
+    return probe_channel_stream_sync(iter(channels), lambda channel: (False, None), probe_run, len(channels))[1]
+
+# ---------------------- 【测速结果缓存：SQLite持久化，重复运行跳过近期已测的源】 ----------------------
+# 备注：缓存文件表结构版本号，结构调整时递增，旧缓存自动丢弃重建（缓存可随时删除，不影响结果）
+STATE_DB_SCHEMA_VERSION = 3
+STATE_DB_TABLES = {
+    "probe_result": (
+        "url TEXT PRIMARY KEY, speed REAL, status TEXT NOT NULL, "
+        "checked_at REAL NOT NULL, fail_streak INTEGER NOT NULL DEFAULT 0, detail TEXT"
+    ),
+    "source_meta": "source_url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, updated_at REAL NOT NULL",
+    "source_channel": "source_url TEXT NOT NULL, position INTEGER NOT NULL, name TEXT, raw_url TEXT NOT NULL, raw_group TEXT"
+}
+
+def open_state_db(path):
+    """打开缓存数据库（测速结果+源列表状态共用一个文件），版本不一致时整体重建"""
+    # 备注：流式流水线中解析器在线程池中运行，允许跨线程（顺序）访问同一连接
+    conn = sqlite3.connect(path, check_same_thread=False)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != STATE_DB_SCHEMA_VERSION:
+        for table in STATE_DB_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"PRAGMA user_version = {STATE_DB_SCHEMA_VERSION}")
+    for table, columns in STATE_DB_TABLES.items():
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+    conn.commit()
+    return conn
+
+class ProbeCache:
+    """测速结果持久化缓存，以直播链接为键，记录上次速度、状态、测速时间、连续失败次数"""
+    
+    def __init__(self, path):
+        self.conn = open_state_db(path)
+    
+    def load(self):
+        """一次性读取全部缓存记录，返回 {url: {result, status, checked_at, fail_streak}}，result为上次测速结果字典"""
+        rows = self.conn.execute("SELECT url, speed, status, checked_at, fail_streak, detail FROM probe_result")
+        return {
+            url: {
+                "result": dict(json.loads(detail or "{}"), speed=speed) if status == "ok" else None,
+                "status": status,
+                "checked_at": checked_at,
+                "fail_streak": fail_streak
+            }
+            for url, speed, status, checked_at, fail_streak, detail in rows
+        }
+    
+    @staticmethod
+    def fail_ttl(record):
+        """失效源的缓存有效期：按连续失败次数翻倍退避，不超过PROBE_CACHE_FAIL_TTL_MAX"""
+        return min(PROBE_CACHE_FAIL_TTL * 2 ** max(record["fail_streak"] - 1, 0), PROBE_CACHE_FAIL_TTL_MAX)
+    
+    @staticmethod
+    def is_fresh(record, now, unchanged=False):
+        """
+        判断缓存记录是否仍在有效期内：有效源按PROBE_CACHE_TTL，失效源按连续失败次数退避
+        unchanged=True 表示该频道在源列表中未变化，上次有效的结论在 CARRY_FORWARD_MAX_AGE 内直接沿用；
+        失效结论不沿用，仍按失败退避复测（一次偶发失败不会让频道消失一整天）
+        """
+        if unchanged and record["status"] == "ok" and now - record["checked_at"] < CARRY_FORWARD_MAX_AGE:
+            return True
+        ttl = PROBE_CACHE_TTL if record["status"] == "ok" else ProbeCache.fail_ttl(record)
+        return now - record["checked_at"] < ttl
+    
+    @staticmethod
+    def updated_record(record, result, now):
+        """按本次测速结果生成新的缓存记录（与 record_many 写入数据库的规则一致），供常驻模式在内存中维护"""
+        fail_streak = 0 if result else (record["fail_streak"] if record else 0) + 1
+        return {"result": result, "status": "ok" if result else "fail", "checked_at": now, "fail_streak": fail_streak}
+    
+    def record_many(self, results, now):
+        """批量写入本次测速结果，results为 [(url, 测速结果字典)]，结果为None表示失效，失效时连续失败次数+1"""
+        rows = []
+        for url, result in dict(results).items():
+            if result:
+                detail = {key: value for key, value in result.items() if key != "speed"}
+                rows.append((url, result["speed"], "ok", now, 0, json.dumps(detail, ensure_ascii=False)))
+            else:
+                rows.append((url, None, "fail", now, 1, None))
+        self.conn.executemany(
+            "INSERT INTO probe_result (url, speed, status, checked_at, fail_streak, detail) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET speed = excluded.speed, status = excluded.status, "
+            "checked_at = excluded.checked_at, detail = excluded.detail, "
+            "fail_streak = CASE WHEN excluded.status = 'ok' THEN 0 ELSE probe_result.fail_streak + 1 END",
+            rows
+        )
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+class ProbeJournal:
+    """
+    测速中断恢复日志（JSON Lines）：首行记录日志创建时间，之后每完成一个测速追加一行 [直播链接, 测速结果]
+    备注：每行写入后立即flush，进程被强制结束时最多丢失正在写的最后一行（回放时忽略不完整的行）；
+         同一链接出现多次时以最后一行为准
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.replayed = self.load()
+        if self.replayed is None:
+            self.replayed = {}
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps({"created_at": time.time()}) + "\n")
+            self.file.flush()
+        else:
+            self.trim_partial_line()
+            self.file = open(path, 'a', encoding='utf-8')
+    
+    def trim_partial_line(self):
+        """续写前截掉上次被强制结束时写了一半的最后一行（否则新记录接在半行之后，回放时连同新记录一起被忽略）"""
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            if not end:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b"\n":
+                return
+            # 备注：从文件末尾按块向前查找最后一个换行符，保留到该换行符为止
+            position = end
+            while position > 0:
+                step = min(64 * 1024, position)
+                f.seek(position - step)
+                newline = f.read(step).rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(position - step + newline + 1)
+                    return
+                position -= step
+            # 备注：整个文件只有一行（首行不带换行符），补上换行符
+            f.write(b"\n")
+    
+    def load(self):
+        """读取上次中断留下的日志，返回 {直播链接: 测速结果}；日志不存在/已过期/无法识别时返回None"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8', errors='replace') as f:
+            try:
+                header = json.loads(f.readline())
+                created_at = float(header["created_at"])
+            except (ValueError, TypeError, KeyError):
+                return None
+            if time.time() - created_at > PROBE_JOURNAL_MAX_AGE:
+                return None
+            replayed = {}
+            for line in f:
+                try:
+                    url, result = json.loads(line)
+                except ValueError:
+                    continue
+                replayed[url] = result
+        return replayed
+    
+    def append(self, url, result):
+        self.file.write(json.dumps([url, result], ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+def discard_probe_journal():
+    """结果文件完整写入后删除中断恢复日志，下轮运行重新开始"""
+    if PROBE_JOURNAL_FILE and os.path.exists(PROBE_JOURNAL_FILE):
+        os.remove(PROBE_JOURNAL_FILE)
+
+def probe_priority(record):
+    """待测频道排序优先级：上次失效的源 > 缓存过期的有效源 > 从未测过的新源"""
+    if record is None:
+        return 2
+    return 0 if record["status"] != "ok" else 1
+
+def run_probes(channels, probe_run):
+    """按PROBE_MODE执行测速，返回与输入顺序一一对应的测速结果列表"""
+    if not channels:
+        return []
+    if PROBE_MODE == "async":
+        return asyncio.run(probe_channels_async(channels, probe_run))
+    return probe_channels_sync(channels, probe_run)
+
+def retest_saturated(channels, results, probed_indexes, probe_run):
+    """
+    链路饱和期间测出不达标的链接，以 LINK_RETEST_CONCURRENCY 低并发复测，复测结果覆盖原结果
+    备注：复测沿用本轮的熔断/竞速状态，所在频道已选满有效镜像的链接不再复测
+    """
+    indexes = [
+        i for i in probed_indexes
+        if results[i] is None and channels[i]['raw_url'] in probe_run.saturated_urls
+        and not probe_run.race.is_settled(mirror_key(channels[i]))
+    ]
+    if not indexes:
+        return
+    print(f"    📶 链路饱和期间有 {len(indexes)} 个链接测速不达标，以 {LINK_RETEST_CONCURRENCY} 并发复测...")
+    retest_results = asyncio.run(probe_channels_async([channels[i] for i in indexes], probe_run, LINK_RETEST_CONCURRENCY))
+    for index, result in zip(indexes, retest_results):
+        results[index] = result
+    run_stats["saturated_retested"] = len(indexes)
+    run_stats["saturated_recovered"] = sum(1 for result in retest_results if result)
+
+# ---------------------- 【源列表增量更新：条件请求+与上次解析结果对比】 ----------------------
+class SourceState:
+    """源列表状态持久化：保存条件请求校验值(ETag/Last-Modified)与上次解析出的频道列表"""
+    
+    def __init__(self, path):
+        self.conn = open_state_db(path)
+    
+    def load(self, source_url):
+        """读取上次保存的状态，返回 {"etag", "last_modified", "channels"}，无记录返回None"""
+        meta = self.conn.execute(
+            "SELECT etag, last_modified FROM source_meta WHERE source_url = ?", (source_url,)
+        ).fetchone()
+        if meta is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT name, raw_url, raw_group FROM source_channel WHERE source_url = ? ORDER BY position", (source_url,)
+        )
+        channels = [ChannelRecord(name, raw_url, raw_group) for name, raw_url, raw_group in rows]
+        return {"etag": meta[0], "last_modified": meta[1], "channels": channels}
+    
+    def save(self, source_url, etag, last_modified, channels):
+        """整体替换保存本次的校验值与频道列表"""
+        self.conn.execute("DELETE FROM source_channel WHERE source_url = ?", (source_url,))
+        self.conn.executemany(
+            "INSERT INTO source_channel (source_url, position, name, raw_url, raw_group) VALUES (?, ?, ?, ?, ?)",
+            [(source_url, position, ch['name'], ch['raw_url'], ch['raw_group']) for position, ch in enumerate(channels)]
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO source_meta (source_url, etag, last_modified, updated_at) VALUES (?, ?, ?, ?)",
+            (source_url, etag, last_modified, time.time())
+        )
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+def iter_source_channels(url, fetch_result, previous, state):
+    """
+    【生成器】边下载边解析源列表，逐个产出频道并打上 unchanged 标记（链接在上次解析结果中已存在）
+    备注：全部产出完毕后输出增量对比统计，并保存本次校验值与频道列表
+    """
+    previous_urls = {ch['raw_url'] for ch in previous["channels"]} if previous else set()
+    channels = []
+    try:
+        for channel in iter_parse_m3u(fetch_result["lines"]):
+            channel["unchanged"] = channel['raw_url'] in previous_urls
+            channels.append(channel)
+            yield channel
+        
+        print(f"    ✅ {url}：共解析到 {len(channels)} 个频道")
+        if previous:
+            unchanged_count = sum(1 for ch in channels if ch["unchanged"])
+            removed_count = len(previous_urls - {ch['raw_url'] for ch in channels})
+            print(f"    🔍 {url} 增量对比：新增/变更 {len(channels) - unchanged_count} 个，未变化 {unchanged_count} 个，已移除 {removed_count} 个")
+        if state and channels:
+            state.save(url, fetch_result["etag"], fetch_result["last_modified"], channels)
+    finally:
+        if state:
+            state.close()
+
+def load_source_channels(url):
+    """
+    【增量获取】条件请求获取单个源列表，与上次解析结果对比，给每个频道打上 unchanged 标记
+    备注：源列表未变化(304)时直接复用上次解析结果，不再下载与解析；未变化的频道在测速阶段沿用上次结论
+    返回值：源列表未变化时返回频道列表，否则返回边下载边解析的频道生成器，获取失败返回None
+    """
+    state = SourceState(PROBE_CACHE_FILE) if (INCREMENTAL_FETCH and PROBE_CACHE_FILE) else None
+    previous = state.load(url) if state else None
+    fetch_result = fetch_m3u_content(url, previous)
+    if fetch_result is None or (fetch_result["not_modified"] and previous):
+        if state:
+            state.close()
+        if fetch_result is None:
+            return None
+        print(f"    ♻️  {url}：源列表未变化，复用上次解析结果 {len(previous['channels'])} 个频道")
+        channels = previous["channels"]
+        for channel in channels:
+            channel["unchanged"] = True
+        return channels
+    return iter_source_channels(url, fetch_result, previous, state)
+
+# ---------------------- 【多源聚合：并发获取全部源列表，按链接全局去重，记录每个频道的来源】 ----------------------
+# 备注：各协议的默认端口，归一化链接时去掉
+DEFAULT_PORTS = {"http": 80, "https": 443, "rtsp": 554, "rtmp": 1935}
+
+def normalize_stream_url(url):
+    """
+    去重用的归一化链接：协议/域名转小写，去掉默认端口、#锚点与TVBox风格的$线路备注
+    例：HTTP://Example.COM:80/live/1.m3u8$线路1 → http://example.com/live/1.m3u8
+    """
+    parts = urlsplit(url.split("$", 1)[0].strip())
+    scheme = parts.scheme.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    netloc = (parts.hostname or "") + (f":{port}" if port and port != DEFAULT_PORTS.get(scheme) else "")
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+def drain_into_queue(channel_iter, channel_queue):
+    """后台线程：边下载边解析一个源列表，解析出的频道依次放入队列，结束（含出错）后放入None"""
+    try:
+        for channel in channel_iter:
+            channel_queue.put(channel)
+    except Exception as e:
+        print(f"    ❌ 源列表读取中断: {str(e)}")
+    finally:
+        channel_queue.put(None)
+
+def iter_until_read_error(channel_iter):
+    """【生成器】当前线程边下载边解析一个源列表，下载中途出错时与后台线程一致：输出提示后结束该源，已解析的频道照常保留"""
+    try:
+        yield from channel_iter
+    except (requests.RequestException, OSError) as e:
+        print(f"    ❌ 源列表读取中断: {str(e)}")
+
+def iter_merged_channels(loaded_sources):
+    """
+    【生成器】按源列表顺序合并产出频道，原样链接与归一化链接重复的条目只保留最先出现的一个，
+    重复条目所在的源追加到保留条目的 sources 字段
+    备注：第一个源在当前线程边下载边解析，其余源同时在后台线程下载解析，轮到时直接从队列取出；
+         任一源下载中途出错只结束该源，不影响其余源的合并
+    """
+    channel_iters = []
+    for position, (source, channels) in enumerate(loaded_sources):
+        if isinstance(channels, list):
+            channel_iters.append((source, channels))
+        elif position == 0:
+            channel_iters.append((source, iter_until_read_error(channels)))
+        else:
+            channel_queue = queue.Queue()
+            threading.Thread(target=drain_into_queue, args=(channels, channel_queue), daemon=True).start()
+            channel_iters.append((source, iter(channel_queue.get, None)))
+    
+    by_url = {}
+    by_key = {}
+    total_count = exact_duplicates = normalized_duplicates = 0
+    for source, channels in channel_iters:
+        for channel in channels:
+            total_count += 1
+            kept = by_url.get(channel['raw_url'])
+            if kept is None:
+                url_key = normalize_stream_url(channel['raw_url'])
+                kept = by_key.get(url_key)
+                if kept is None:
+                    channel["sources"] = [source]
+                    by_url[channel['raw_url']] = by_key[url_key] = channel
+                    yield channel
+                    continue
+                normalized_duplicates += 1
+            else:
+                exact_duplicates += 1
+            if source not in kept["sources"]:
+                kept["sources"].append(source)
+    
+    if exact_duplicates or normalized_duplicates or len(loaded_sources) > 1:
+        print(f"    🔗 多源合并：{len(loaded_sources)} 个源共 {total_count} 个条目，去除重复链接 {exact_duplicates} 个、"
+              f"归一化后重复 {normalized_duplicates} 个，保留 {len(by_key)} 个")
+
+def load_all_sources(sources):
+    """
+    【多源聚合】并发获取全部源列表（各源独立做增量对比），按源列表顺序合并并全局去重，合并结果只测速一次
+    返回值：关闭流式流水线时返回频道列表，否则返回边下载边解析的合并频道生成器，全部源获取失败返回None
+    """
+    print(f"[1/5] 正在获取直播源列表（共 {len(sources)} 个源）...")
+    with run_metrics.phase("fetch"):
+        with ThreadPoolExecutor(max_workers=max(1, min(SOURCE_FETCH_WORKERS, len(sources)))) as pool:
+            loaded = list(pool.map(load_source_channels, sources))
+    loaded_sources = [(source, channels) for source, channels in zip(sources, loaded) if channels is not None]
+    if not loaded_sources:
+        return None
+    if len(loaded_sources) < len(sources):
+        print(f"    ⚠️  {len(sources) - len(loaded_sources)} 个源获取失败，使用其余 {len(loaded_sources)} 个源")
+    
+    print(f"[2/5] 正在解析并合并频道列表{'（边下载边解析边测速）' if STREAM_PIPELINE else ''}...")
+    channel_iter = run_metrics.timed_iter("parse", iter_merged_channels(loaded_sources))
+    return channel_iter if STREAM_PIPELINE else list(channel_iter)
 
 # ---------------------- 【核心流程：测速筛选+排序】 ----------------------
+def new_valid_channel(name, url, result, sources, backup_urls=None):
+    """有效频道条目：分类与排序键在此一次算好，排序/分类上限/写入阶段直接使用，不再重复正则匹配"""
+    category, sort_key = channel_classifier.classify(name, result["speed"])
+    channel = {"name": name, "url": url, "category": category, **result}
+    if backup_urls is not None:
+        channel["backup_urls"] = backup_urls
+    channel["sources"] = sources
+    channel["sort_key"] = sort_key
+    return channel
+
+def iter_valid_channels(channels, results):
+    """
+    【生成器】逐个产出有效频道（复用的缓存速度同样按当前阈值再校验一次，阈值调整后立即生效）
+    开启多镜像合并时每个归一化频道名只输出1个条目：最快镜像为主用，其余有效镜像按速度降序作为备用
+    备注：sources 为频道所在的源列表（多镜像合并时为主用+备用镜像来源的并集，按源列表顺序）
+    """
+    if not MIRROR_GROUPING:
+        for channel, result in zip(channels, results):
+            if result and result["speed"] >= MIN_PLAY_SPEED:
+                yield new_valid_channel(channel['name'], channel['raw_url'], result, channel.get("sources", []))
+        return
+    
+    # 备注：频道名取该组在源列表中首次出现的名称，避免每轮主用镜像变化导致频道名来回变化
+    groups = {}
+    for channel, result in zip(channels, results):
+        group = groups.setdefault(mirror_key(channel), {"name": channel['name'], "mirrors": {}})
+        if result and result["speed"] >= MIN_PLAY_SPEED:
+            group["mirrors"].setdefault(channel['raw_url'], (result, channel.get("sources", [])))
+    
+    source_order = {source: position for position, source in enumerate(M3U_SOURCES)}
+    for group in groups.values():
+        if not group["mirrors"]:
+            continue
+        mirrors = sorted(group["mirrors"].items(), key=lambda item: -item[1][0]["speed"])[:MIRROR_TOP_N]
+        primary_url, (primary_result, _) = mirrors[0]
+        sources = {source for _, (_, mirror_sources) in mirrors for source in mirror_sources}
+        yield new_valid_channel(
+            group["name"], primary_url, primary_result,
+            sorted(sources, key=lambda source: source_order.get(source, len(source_order))),
+            backup_urls=[url for url, _ in mirrors[1:]]
+        )
+
+def category_limit(category):
+    """分类的频道数上限（CATEGORY_TOP_K），不限时返回None"""
+    if isinstance(CATEGORY_TOP_K, dict):
+        return CATEGORY_TOP_K.get(category)
+    return CATEGORY_TOP_K
+
+class WorstFirst:
+    """定长堆元素：排序越靠后越先出堆（heapq为小顶堆，堆顶需要是当前保留的频道中最差的一个）"""
+    __slots__ = ("key", "channel")
+    
+    def __init__(self, key, channel):
+        self.key = key
+        self.channel = channel
+    
+    def __lt__(self, other):
+        return other.key < self.key
+
+def rank_channels(valid_channels):
+    """
+    按预先算好的排序键排序有效频道
+    配置了 CATEGORY_TOP_K 时，每个分类维护一个定长堆，频道逐个产出逐个入堆，只保留排序最靠前的K个，其余频道随即释放
+    备注：排序键相同的频道按产出顺序排列（与整体稳定排序结果一致）
+    """
+    if not CATEGORY_TOP_K:
+        return sorted(valid_channels, key=lambda channel: channel["sort_key"])
+    heaps = defaultdict(list)
+    unlimited = []
+    dropped = 0
+    for position, channel in enumerate(valid_channels):
+        entry = WorstFirst((channel["sort_key"], position), channel)
+        limit = category_limit(channel['category'])
+        if limit is None:
+            unlimited.append(entry)
+            continue
+        heap = heaps[channel['category']]
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        else:
+            dropped += 1
+            if heap and heap[0] < entry:
+                heapq.heapreplace(heap, entry)
+    if dropped:
+        run_stats["category_dropped"] = dropped
+        print(f"    ✂️  分类数量上限：舍弃排序靠后的频道 {dropped} 个")
+    kept = unlimited + [entry for heap in heaps.values() for entry in heap]
+    return [entry.channel for entry in sorted(kept, key=lambda entry: entry.key)]
+
+def prefetch_channel_hosts(channels, seen_hosts=None):
+    """并发预解析一批频道的源站域名；传入seen_hosts时跳过其中已预解析过的域名并把本批域名加入其中"""
+    hosts = {urlparse(channel['raw_url']).hostname for channel in channels}
+    if seen_hosts is not None:
+        hosts -= seen_hosts
+        seen_hosts |= hosts
+    resolved, failed = http_client.prefetch_hosts(hosts)
+    run_stats["dns_resolved"] += resolved
+    run_stats["dns_failed"] += failed
+
+def iter_with_dns_prefetch(channel_iter):
+    """流式流水线用：每取出 STREAM_BATCH_SIZE 个频道，先并发预解析其中的新域名再交给测速"""
+    seen_hosts = set()
+    while True:
+        batch = list(itertools.islice(channel_iter, STREAM_BATCH_SIZE))
+        if not batch:
+            return
+        prefetch_channel_hosts(batch, seen_hosts)
+        yield from batch
+
+def probe_channel_results(channels):
+    """
+    批量测速（复用缓存/中断恢复日志中的结论），返回 (频道列表, 与频道一一对应的测速结果列表)
+    channels 为列表时先整体判断缓存、按优先级排队测速；为生成器时走流式流水线，边解析边测速
+    """
+    print(f"[3/5] 开始频道测速筛选（最低播放速度要求：{MIN_PLAY_SPEED} KB/s，模式：{PROBE_MODE}）...")
+    
+    cache = ProbeCache(PROBE_CACHE_FILE) if PROBE_CACHE_FILE else None
+    cached_records = cache.load() if cache else {}
+    now = time.time()
+    journal = ProbeJournal(PROBE_JOURNAL_FILE) if PROBE_JOURNAL_FILE else None
+    probe_run = ProbeRun(journal)
+    run_stats.clear()
+    # 备注：上次中断前已完成的测速结论，本轮直接采用，结束时与本轮测速结果一并写入缓存
+    replayed_results = []
+    if journal and journal.replayed:
+        print(f"    ♻️  检测到上次中断的测速记录，恢复已完成的测速结论 {len(journal.replayed)} 个")
+    
+    def lookup_cached(channel):
+        """
+        缓存有效期内的结果直接复用，返回 (是否命中, 缓存结果)；命中的有效结果计入多镜像竞速
+        备注：中断恢复日志中的结论比缓存更新，优先采用
+        """
+        if journal and channel['raw_url'] in journal.replayed:
+            result = journal.replayed[channel['raw_url']]
+            replayed_results.append((channel['raw_url'], result))
+            probe_run.race.record(mirror_key(channel), result)
+            return True, result
+        record = cached_records.get(channel['raw_url'])
+        if record and ProbeCache.is_fresh(record, now, channel.get("unchanged", False)):
+            probe_run.race.record(mirror_key(channel), record["result"])
+            return True, record["result"]
+        return False, None
+    
+    if isinstance(channels, list):
+        results = [None] * len(channels)
+        pending_indexes = []
+        for index, channel in enumerate(channels):
+            hit, results[index] = lookup_cached(channel)
+            if not hit:
+                pending_indexes.append(index)
+        # 备注：未命中缓存的频道按优先级排队重测
+        pending_indexes.sort(key=lambda i: probe_priority(cached_records.get(channels[i]['raw_url'])))
+        if cache:
+            print(f"    ♻️  复用缓存结果 {len(channels) - len(pending_indexes)} 个，需重新测速 {len(pending_indexes)} 个")
+        
+        if DNS_PREFETCH:
+            prefetch_channel_hosts([channels[i] for i in pending_indexes])
+        
+        # 执行测速（两种模式返回结果顺序均与输入一致，保证排序结果完全相同）
+        with run_metrics.phase("probe"):
+            probe_results = run_probes([channels[i] for i in pending_indexes], probe_run)
+        for index, result in zip(pending_indexes, probe_results):
+            results[index] = result
+    else:
+        # 备注：流式流水线无法预知全部频道，按解析顺序直接测速，不做优先级排队
+        if DNS_PREFETCH:
+            channels = iter_with_dns_prefetch(channels)
+        with run_metrics.phase("probe"):
+            if PROBE_MODE == "async":
+                channels, results, pending_indexes = asyncio.run(probe_channel_stream_async(channels, lookup_cached, probe_run))
+            else:
+                channels, results, pending_indexes = probe_channel_stream_sync(channels, lookup_cached, probe_run)
+        if cache:
+            print(f"    ♻️  复用缓存结果 {len(channels) - len(pending_indexes)} 个，实际测速 {len(pending_indexes)} 个")
+    
+    if PROBE_MODE == "async" and probe_run.saturated_urls:
+        with run_metrics.phase("probe"):
+            retest_saturated(channels, results, pending_indexes, probe_run)
+    
+    probe_run.update_run_stats()
+    if run_stats["dns_resolved"] or run_stats["dns_failed"]:
+        print(f"    🌐 DNS预解析：{run_stats['dns_resolved']} 个源站解析成功，{run_stats['dns_failed']} 个解析失败")
+    if run_stats["hedged"] or run_stats["retry_budget_denied"]:
+        print(f"    🛡️  对冲请求：发起 {run_stats['hedged']} 次（{run_stats['hedge_wins']} 次先于首个请求收到响应），"
+              f"重试预算不足拒绝 {run_stats['retry_budget_denied']} 次")
+    if run_stats["link_throttled"] or run_stats["saturated_retested"]:
+        print(f"    📶 带宽调度：{run_stats['link_throttled']} 次等待带宽余量后发起测速，"
+              f"饱和期间不达标复测 {run_stats['saturated_retested']} 个（{run_stats['saturated_recovered']} 个复测后达标）")
+    if run_stats["breaker_skipped"]:
+        print(f"    ⏭️  源站熔断：{run_stats['breaker_hosts']} 个源站不可用，跳过 {run_stats['breaker_skipped']} 个链接")
+    if run_stats["mirror_lost"]:
+        print(f"    🏁 多镜像竞速：取消/跳过 {run_stats['mirror_lost']} 个落后镜像的测速")
+    
+    # 备注：被熔断跳过/镜像竞速落选的链接未完成测速，不写入缓存，下轮运行照常测速
+    if cache:
+        unprobed_urls = probe_run.unprobed_urls()
+        cache.record_many(
+            replayed_results
+            + [(channels[i]['raw_url'], results[i]) for i in pending_indexes if channels[i]['raw_url'] not in unprobed_urls],
+            time.time()
+        )
+        cache.close()
+    if journal:
+        journal.close()
+    return channels, results
+
 def filter_and_sort_channels(channels):
     """批量测速筛选有效频道，并按指定规则排序"""
-    print(f"[3/5] 开始频道测速筛选（最低播放速度要求：{MIN_PLAY_SPEED} KB/s）...")
-    valid_channels = []
-    total_count = len(channels)
-    
-    for index, channel in enumerate(channels):
-        channel_name = channel['name']
-        channel_url = channel['raw_url']
-        # 进度输出
-        print(f"    测速 [{index+1}/{total_count}] {channel_name:<30}", end="", flush=True)
-        
-        # 执行测速
-        speed = test_stream_speed(channel_url)
-        if speed:
-            # 分类匹配
-            category = smart_classify(channel_name)
-            valid_channels.append({
-                "name": channel_name,
-                "url": channel_url,
-                "speed": speed,
-                "category": category
-            })
-            print(f"✅ 有效 速度: {speed} KB/s 分类: {category}")
-        else:
-            print(f"❌ 无效/速度不达标")
+    channels, results = probe_channel_results(channels)
     
     # 按指定规则排序
     print(f"[4/5] 正在按置顶规则排序频道...")
-    valid_channels.sort(key=get_sort_key)
+    with run_metrics.phase("sort"):
+        valid_channels = rank_channels(iter_valid_channels(channels, results))
     print(f"    ✅ 筛选完成，有效频道数：{len(valid_channels)} 个")
     return valid_channels
 
 # ---------------------- 【优化：M3U文件写入，严格按分类置顶顺序】 ----------------------
-def write_optimized_m3u(channels, output_path):
-    """写入最终优化后的M3U文件，严格按指定分类顺序输出，适配TV播放器"""
-    print(f"[5/5] 正在写入优化后的M3U文件...")
-    
-    # 按分类分组
+def group_by_category(channels):
+    """按分类分组（分类内保持传入顺序）"""
     category_channel_map = defaultdict(list)
     for channel in channels:
         category_channel_map[channel['category']].append(channel)
+    return category_channel_map
+
+def iter_m3u_lines(category_channel_map):
+    """【生成器】逐行产出M3U内容，严格按指定的置顶顺序输出分类，每个频道只写主用链接"""
+    # M3U文件头（生成节目单时附带节目单地址）
+    yield f'#EXTM3U x-tvg-url="{EPG_PUBLIC_URL}"\n' if EPG_SOURCES and EPG_PUBLIC_URL else "#EXTM3U\n"
+    for category in CATEGORY_ORDER:
+        for channel in category_channel_map.get(category, []):
+            # EXTINF行带分类group-title，适配TV播放器的文件夹分类；生成节目单时带tvg-id（与节目单频道ID一致）
+            tvg_id = f' tvg-id="{classify.epg_channel_id(channel["name"])}"' if EPG_SOURCES else ""
+            yield f'#EXTINF:-1{tvg_id} group-title="{category}",{channel["name"]}\n'
+            yield f'{channel["url"]}\n'
+
+def iter_txt_lines(category_channel_map):
+    """【生成器】逐行产出TXT内容（与migu.txt格式一致：分类,#genre# 行 + 频道名,链接 行），备用镜像以#拼接在主用链接之后"""
+    for category in CATEGORY_ORDER:
+        if category not in category_channel_map:
+            continue
+        yield f"{category},#genre#\n"
+        for channel in category_channel_map[category]:
+            urls = "#".join([channel["url"]] + channel.get("backup_urls", []))
+            yield f"{channel['name']},{urls}\n"
+
+def write_optimized_m3u(channels, output_path, txt_path=None):
+    """
+    写入最终优化后的M3U文件，严格按指定分类顺序输出，适配TV播放器
+    备注：M3U每个频道只写主用链接；指定txt_path时同时写入TXT，备用镜像以#拼接在主用链接之后
+    """
+    print(f"[5/5] 正在写入优化后的M3U文件...")
     
-    # 写入文件
-    with open(output_path, 'w', encoding='utf-8') as f:
-        # M3U文件头
-        f.write("#EXTM3U\n")
-        # 严格按指定的置顶顺序写入分类
-        for category in CATEGORY_ORDER:
-            if category not in category_channel_map:
-                continue
-            channel_list = category_channel_map[category]
-            print(f"    写入分类 [{category}]：{len(channel_list)} 个频道")
-            # 写入该分类下的所有频道
-            for channel in channel_list:
-                # 写入EXTINF行，带分类group-title，适配TV播放器的文件夹分类
-                f.write(f'#EXTINF:-1 group-title="{category}",{channel["name"]}\n')
-                # 写入直播链接
-                f.write(f'{channel["url"]}\n')
+    # 按分类分组
+    category_channel_map = group_by_category(channels)
+    for category in CATEGORY_ORDER:
+        if category in category_channel_map:
+            print(f"    写入分类 [{category}]：{len(category_channel_map[category])} 个频道")
+    
+    # 写入文件（先写临时文件再替换，运行中断时不会留下写了一半的播放列表）
+    with open_atomic(output_path) as f:
+        f.writelines(iter_m3u_lines(category_channel_map))
+    if txt_path:
+        with open_atomic(txt_path) as f:
+            f.writelines(iter_txt_lines(category_channel_map))
     
     print(f"\n🎉 全部任务执行完成！")
     print(f"📁 优化后的M3U文件路径：{output_path}")
+    if txt_path:
+        print(f"📁 优化后的TXT文件路径：{txt_path}")
     print(f"📊 最终有效频道总数：{len(channels)} 个")
+    backup_count = sum(len(channel.get("backup_urls", [])) for channel in channels)
+    if backup_count:
+        print(f"🔁 备用镜像：{backup_count} 个（已合并到对应频道）")
+    if run_stats["mirror_lost"]:
+        print(f"🏁 多镜像竞速取消/跳过：{run_stats['mirror_lost']} 个落后镜像")
+    if run_stats["breaker_skipped"]:
+        print(f"⏭️  源站熔断跳过：{run_stats['breaker_skipped']} 个链接（{run_stats['breaker_hosts']} 个源站不可用）")
+    # 来源统计输出（多源聚合时，同一频道可同时计入多个源）
+    source_counts = defaultdict(int)
+    for channel in channels:
+        for source in channel.get("sources", []):
+            source_counts[source] += 1
+    if len(source_counts) > 1:
+        print(f"📚 来源统计：")
+        for source in M3U_SOURCES:
+            if source in source_counts:
+                print(f"    {source}：{source_counts[source]} 个频道")
     # 分类统计输出
     for category in CATEGORY_ORDER:
         count = len(category_channel_map.get(category, []))
         print(f"    【{category}】：{count} 个频道")
 
-# ---------------------- 主程序入口 ----------------------
-if __name__ == "__main__":
-    # 关闭SSL警告，避免部分自签名证书站点请求失败
+# ---------------------- 【EPG节目单：只保留有效频道的节目单】 ----------------------
+def write_channel_epg(channels):
+    """从 EPG_SOURCES 流式筛选出有效频道的节目单，写入 EPG_OUTPUT_FILE 及其.gz副本"""
+    channel_keys = {classify.epg_channel_id(channel['name']) for channel in channels}
+    epg.write_filtered_epg(EPG_SOURCES, channel_keys, classify.epg_channel_id, EPG_OUTPUT_FILE, http_session)
+
+def write_outputs(channels):
+    """写入最终的M3U/TXT（及节目单），没有有效频道时只输出提示"""
+    if not channels:
+        print("❌ 未筛选出符合速度要求的有效频道，请检查M3U地址是否有效、源地址是否可用或降低最低速度阈值")
+        return
+    with run_metrics.phase("write"):
+        write_optimized_m3u(channels, OUTPUT_FILE, OUTPUT_TXT_FILE)
+    if EPG_SOURCES:
+        with run_metrics.phase("epg"):
+            write_channel_epg(channels)
+
+# ---------------------- 【分片测速：按归一化链接的稳定哈希分片，多进程/多机独立测速后合并输出】 ----------------------
+def shard_of(url, count):
+    """链接所属的分片序号：归一化链接的SHA1取模（与进程、机器、Python哈希随机化无关，同一链接每次都落在同一分片）"""
+    digest = hashlib.sha1(normalize_stream_url(url).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+def shard_path(path, index, count):
+    """分片专用的文件名（测速缓存/中断恢复日志/运行指标），同一台机器运行多个分片时互不覆盖；path为None时返回None"""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}of{count}{ext}"
+
+def parse_shard_spec(spec):
+    """解析 --shard 参数 "序号/总数"（如 0/4，序号从0开始）"""
+    index, count = (int(part) for part in spec.split("/", 1))
+    if not 0 <= index < count:
+        raise ValueError(f"分片序号超出范围: {spec}")
+    return index, count
+
+@contextlib.contextmanager
+def shard_settings(index, count, link_share):
+    """
+    分片运行期间使用分片专用的文件名（测速缓存/中断恢复日志/运行指标）与均分后的带宽预算，并从空白的运行统计开始；
+    结束后恢复原有设置
+    备注：进程池可能在同一个进程中先后运行多个分片，每个分片都从原有设置推算，不会叠加上一个分片的文件名/带宽均分/统计
+    """
+    global PROBE_CACHE_FILE, PROBE_JOURNAL_FILE, METRICS_JSON_FILE, METRICS_PROM_FILE, LINK_BUDGET_KBPS, run_metrics, link_budget
+    saved = (PROBE_CACHE_FILE, PROBE_JOURNAL_FILE, METRICS_JSON_FILE, METRICS_PROM_FILE, LINK_BUDGET_KBPS, run_metrics, link_budget)
+    PROBE_CACHE_FILE = shard_path(PROBE_CACHE_FILE, index, count)
+    PROBE_JOURNAL_FILE = shard_path(PROBE_JOURNAL_FILE, index, count)
+    METRICS_JSON_FILE = shard_path(METRICS_JSON_FILE, index, count)
+    METRICS_PROM_FILE = shard_path(METRICS_PROM_FILE, index, count)
+    if LINK_BUDGET_KBPS:
+        LINK_BUDGET_KBPS /= link_share
+    run_metrics = RunMetrics()
+    link_budget = LinkBudget()
+    run_stats.clear()
+    try:
+        yield
+    finally:
+        (PROBE_CACHE_FILE, PROBE_JOURNAL_FILE, METRICS_JSON_FILE, METRICS_PROM_FILE,
+         LINK_BUDGET_KBPS, run_metrics, link_budget) = saved
+
+def run_shard(index, count, link_share=1):
+    """
+    【分片测速】获取并合并全部源列表，只测速归一化链接落在本分片的频道，测速结论（含失效频道）写入分片结果文件
+    备注：各分片解析出的合并频道列表完全一致，结果文件记录每个频道在列表中的位置，合并后的频道顺序与不分片运行相同
+    link_share：本机同时运行的分片数，链路带宽预算按此均分
+    返回值：分片结果文件路径，源列表获取失败返回None
+    """
+    with shard_settings(index, count, link_share):
+        return probe_shard(index, count)
+
+def probe_shard(index, count):
+    """run_shard 的测速部分（在 shard_settings 生效期间调用），返回分片结果文件路径，源列表获取失败返回None"""
+    print(f"🧩 分片测速：第 {index + 1}/{count} 片")
+    raw_channel_list = load_all_sources(M3U_SOURCES)
+    if raw_channel_list is None:
+        print("❌ 无法获取M3U源文件，请检查网络连接或地址是否正确")
+        run_metrics.export()
+        return None
+    
+    # 备注：链接 → 在合并频道列表中的位置（多源合并后链接唯一）
+    positions = {}
+    
+    def iter_shard_channels():
+        for position, channel in enumerate(raw_channel_list):
+            if shard_of(channel['raw_url'], count) == index:
+                positions[channel['raw_url']] = position
+                yield channel
+    
+    channels = iter_shard_channels()
+    channels, results = probe_channel_results(channels if STREAM_PIPELINE else list(channels))
+    path = SHARD_RESULT_FILE.format(index=index, count=count)
+    entries = [[positions[channel['raw_url']], channel['name'], channel['raw_url'], channel.get("sources", []), result]
+               for channel, result in zip(channels, results)]
+    write_file_atomic(path, json.dumps({"shard": index, "count": count, "created_at": time.time(), "channels": entries},
+                                       ensure_ascii=False, separators=(",", ":")))
+    valid_count = sum(1 for result in results if result and result["speed"] >= MIN_PLAY_SPEED)
+    print(f"📁 分片结果已写入 {path}：{len(entries)} 个频道，有效 {valid_count} 个")
+    discard_probe_journal()
+    run_metrics.export()
+    return path
+
+def load_shard_results(paths):
+    """
+    读取分片结果文件，返回按源列表位置排好序的 (频道列表, 测速结果列表)，没有可用分片结果时返回None
+    备注：文件中混有不同分片总数的结果时只采用最新写入的一批；缺少分片时照常合并并提示
+    """
+    shards = {}
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                shard = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"    ⚠️  分片结果文件读取失败，已跳过: {path} {str(e)}")
+            continue
+        shards.setdefault(shard["count"], {})[shard["shard"]] = shard
+    if not shards:
+        return None
+    count = max(shards, key=lambda c: max(shard["created_at"] for shard in shards[c].values()))
+    batch = shards[count]
+    missing = [str(index) for index in range(count) if index not in batch]
+    if missing:
+        print(f"    ⚠️  缺少分片 {', '.join(missing)}（共 {count} 片），合并结果不含这些分片的频道")
+    
+    entries = sorted((entry for shard in batch.values() for entry in shard["channels"]), key=lambda entry: entry[0])
+    channels, results = [], []
+    for _, name, raw_url, sources, result in entries:
+        channel = ChannelRecord(name, raw_url)
+        channel["sources"] = sources
+        channels.append(channel)
+        results.append(result)
+    print(f"    ✅ 已读取 {len(batch)}/{count} 个分片，共 {len(channels)} 个频道")
+    return channels, results
+
+def merge_shards(paths=None):
+    """
+    【分片合并】合并全部分片的测速结论，多镜像合并+按 rank_channels 分类排序后写入最终M3U/TXT（与不分片运行的输出一致）
+    paths 为空时读取当前目录下全部匹配 SHARD_RESULT_FILE 的分片结果文件
+    """
+    paths = paths or sorted(glob.glob(SHARD_RESULT_FILE.format(index="*", count="*")))
+    print(f"🧩 正在合并分片测速结果（{len(paths)} 个文件）...")
+    loaded = load_shard_results(paths)
+    if loaded is None:
+        print("❌ 没有可用的分片测速结果，请先运行 python main.py --shard 序号/总数")
+        return
+    print(f"[4/5] 正在按置顶规则排序频道...")
+    with run_metrics.phase("sort"):
+        valid_channels = rank_channels(iter_valid_channels(*loaded))
+    print(f"    ✅ 合并完成，有效频道数：{len(valid_channels)} 个")
+    write_outputs(valid_channels)
+
+def setup_process():
+    """进程初始化：关闭SSL警告（部分自签名证书站点），启用进程内DNS缓存（同步/异步测速共用，配合测速前的并发预解析）"""
     requests.packages.urllib3.disable_warnings()
+    http_client.install_dns_cache()
+
+def run_local_shards(count):
+    """【本机分片】count 个进程并行测速全部分片（链路带宽预算均分），全部完成后合并输出"""
+    print(f"🧩 本机分片测速：{count} 个进程并行")
+    with ProcessPoolExecutor(max_workers=count, initializer=setup_process) as pool:
+        paths = list(pool.map(run_shard, range(count), [count] * count, [count] * count))
+    if None in paths:
+        print(f"❌ {paths.count(None)} 个分片源列表获取失败，合并其余分片的结果")
+    merge_shards([path for path in paths if path])
+
+# ---------------------- 【常驻监控模式：按到期时间优先队列持续复测，本地HTTP服务提供最新播放列表】 ----------------------
+class PlaylistRequestHandler(BaseHTTPRequestHandler):
+    """提供当前播放列表，支持 If-None-Match 条件请求（内容未变化时返回304，播放器无需重复下载）"""
     
-    # 主流程执行
-    m3u_raw_content = fetch_m3u_content(M3U_URL)
-    if m3u_raw_content:
-        raw_channel_list = parse_m3u(m3u_raw_content)
-        if raw_channel_list:
-            optimized_channel_list = filter_and_sort_channels(raw_channel_list)
-            if optimized_channel_list:
-                write_optimized_m3u(optimized_channel_list, OUTPUT_FILE)
-            else:
-                print("❌ 未筛选出符合速度要求的有效频道，请检查源地址或降低最低速度阈值")
+    def do_GET(self):
+        self.send_playlist(with_body=True)
+    
+    def do_HEAD(self):
+        self.send_playlist(with_body=False)
+    
+    def send_playlist(self, with_body):
+        entry = self.server.playlists.get(urlparse(self.path).path)
+        if entry is None:
+            self.send_error(404)
+            return
+        body, etag, content_type = entry
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+class WatchService:
+    """
+    常驻监控：频道状态常驻内存（启动时从测速缓存恢复，无需冷启动全量测速），按到期时间小顶堆持续复测
+    到期时间 = 上次测速时间 + 复测间隔 / 分类权重：有效源间隔 WATCH_REPROBE_INTERVAL，失效源按连续失败次数退避，从未测过的频道立即到期
+    备注：每轮复测后重新生成播放列表，内容变化时写入输出文件并更新HTTP服务的内容与ETag
+    """
+    
+    def __init__(self):
+        self.cache = ProbeCache(PROBE_CACHE_FILE) if PROBE_CACHE_FILE else None
+        # 备注：链接 → 测速记录（与测速缓存记录格式一致）
+        self.records = self.cache.load() if self.cache else {}
+        self.channels = []
+        self.channel_by_url = {}
+        # 备注：(到期时间, 链接) 小顶堆；scheduled 记录每个链接当前有效的到期时间，堆中过时的条目取出时丢弃
+        self.queue = []
+        self.scheduled = {}
+        self.sources_loaded_at = None
+        self.server = ThreadingHTTPServer((WATCH_HTTP_HOST, WATCH_HTTP_PORT), PlaylistRequestHandler)
+        self.server.daemon_threads = True
+        self.server.playlists = {}
+    
+    @staticmethod
+    def category_weight(channel):
+        """分类权重：CATEGORY_ORDER 中排第一的分类为 1+WATCH_CATEGORY_BOOST，排最后的为1（分类结果缓存在频道字典中）"""
+        if "category" not in channel:
+            channel["category"] = smart_classify(channel['name'])
+        last = len(CATEGORY_ORDER) - 1
+        position = CATEGORY_ORDER.index(channel["category"]) if channel["category"] in CATEGORY_ORDER else last
+        return 1 + WATCH_CATEGORY_BOOST * (last - position) / max(last, 1)
+    
+    def schedule(self, channel, base_time=None):
+        """
+        按测速记录计算到期时间并加入优先队列
+        base_time：本轮未完成测速（熔断跳过/镜像落选）的链接沿用上次结论，从本轮时间起重新计算到期时间
+        """
+        record = self.records.get(channel['raw_url'])
+        if record is None and base_time is None:
+            due_at = 0
         else:
-            print("❌ 未能解析出任何频道，请检查M3U地址是否有效")
+            interval = WATCH_REPROBE_INTERVAL if record is None or record["status"] == "ok" else ProbeCache.fail_ttl(record)
+            start = record["checked_at"] if base_time is None else base_time
+            due_at = start + interval / self.category_weight(channel)
+        self.scheduled[channel['raw_url']] = due_at
+        heapq.heappush(self.queue, (due_at, channel['raw_url']))
+    
+    def refresh_sources(self):
+        """重新获取源列表：新增频道立即到期，已移除频道的状态与排队条目删除"""
+        channels = load_all_sources(M3U_SOURCES)
+        self.sources_loaded_at = time.monotonic()
+        if channels is None:
+            print("    ⚠️  源列表获取失败，继续使用上次的频道列表")
+            return
+        self.channels = list(channels)
+        self.channel_by_url = {channel['raw_url']: channel for channel in self.channels}
+        self.records = {url: record for url, record in self.records.items() if url in self.channel_by_url}
+        for url in [url for url in self.scheduled if url not in self.channel_by_url]:
+            del self.scheduled[url]
+        for channel in self.channels:
+            if channel['raw_url'] not in self.scheduled:
+                self.schedule(channel)
+    
+    def pop_due(self):
+        """取出已到期的频道（最多 WATCH_BATCH_SIZE 个，最早到期的优先）"""
+        now = time.time()
+        batch = []
+        while self.queue and len(batch) < WATCH_BATCH_SIZE and self.queue[0][0] <= now:
+            due_at, url = heapq.heappop(self.queue)
+            if self.scheduled.get(url) == due_at:
+                del self.scheduled[url]
+                batch.append(self.channel_by_url[url])
+        return batch
+    
+    def next_due_in(self):
+        """距离下一个频道到期的秒数，队列为空时返回None"""
+        while self.queue and self.scheduled.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        return self.queue[0][0] - time.time() if self.queue else None
+    
+    def probe_batch(self, batch):
+        """复测一批到期频道，更新内存状态与测速缓存，并重新排队"""
+        run_stats.clear()
+        if DNS_PREFETCH:
+            prefetch_channel_hosts(batch)
+        probe_run = ProbeRun()
+        results = run_probes(batch, probe_run)
+        # 备注：链路饱和期间测出的不达标先低并发复测，再写入状态与缓存（否则会按失效退避 fail_ttl）
+        if PROBE_MODE == "async" and probe_run.saturated_urls:
+            retest_saturated(batch, results, range(len(batch)), probe_run)
+        probe_run.update_run_stats()
+        unprobed_urls = probe_run.unprobed_urls()
+        now = time.time()
+        probed = []
+        for channel, result in zip(batch, results):
+            if channel['raw_url'] in unprobed_urls:
+                self.schedule(channel, base_time=now)
+                continue
+            self.records[channel['raw_url']] = ProbeCache.updated_record(self.records.get(channel['raw_url']), result, now)
+            probed.append((channel['raw_url'], result))
+            self.schedule(channel)
+        if self.cache and probed:
+            self.cache.record_many(probed, now)
+    
+    def publish(self):
+        """按当前状态重新生成播放列表，内容变化时写入输出文件并更新HTTP服务内容（ETag为内容摘要）"""
+        results = [(self.records.get(channel['raw_url']) or {}).get("result") for channel in self.channels]
+        valid_channels = rank_channels(iter_valid_channels(self.channels, results))
+        category_channel_map = group_by_category(valid_channels)
+        outputs = [(OUTPUT_FILE, iter_m3u_lines, "audio/x-mpegurl; charset=utf-8"),
+                   (OUTPUT_TXT_FILE, iter_txt_lines, "text/plain; charset=utf-8")]
+        playlists = {}
+        changed = False
+        for path, iter_lines, content_type in outputs:
+            if not path:
+                continue
+            text = "".join(iter_lines(category_channel_map))
+            body = text.encode("utf-8")
+            etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+            route = "/" + os.path.basename(path)
+            previous = self.server.playlists.get(route)
+            if previous is None or previous[1] != etag:
+                write_file_atomic(path, text)
+                changed = True
+            playlists[route] = (body, etag, content_type)
+        self.server.playlists = playlists
+        if changed:
+            print(f"📡 播放列表已更新：有效频道 {len(valid_channels)} 个（待复测队列 {len(self.scheduled)} 个）")
+    
+    def run(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        for route in ("/" + os.path.basename(path) for path in (OUTPUT_FILE, OUTPUT_TXT_FILE) if path):
+            print(f"👀 常驻监控模式已启动：http://{WATCH_HTTP_HOST}:{self.server.server_address[1]}{route}")
+        try:
+            while True:
+                if self.sources_loaded_at is None or time.monotonic() - self.sources_loaded_at >= WATCH_SOURCE_REFRESH:
+                    self.refresh_sources()
+                    self.publish()
+                batch = self.pop_due()
+                if batch:
+                    print(f"🔄 复测 {len(batch)} 个到期频道...")
+                    with run_metrics.phase("probe"):
+                        self.probe_batch(batch)
+                    self.publish()
+                    # 备注：常驻运行时每轮导出一次指标，导出后清空单次测速记录，内存占用不随运行时间增长
+                    run_metrics.export()
+                    run_metrics.probes.clear()
+                    continue
+                wait = self.next_due_in()
+                time.sleep(max(0, min(WATCH_IDLE_SLEEP, wait if wait is not None else WATCH_IDLE_SLEEP)))
+        except KeyboardInterrupt:
+            print("👋 常驻监控模式已退出")
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            if self.cache:
+                self.cache.close()
+
+# ---------------------- 主程序入口 ----------------------
+if __name__ == "__main__":
+    setup_process()
+    args = sys.argv[1:]
+    
+    if WATCH_MODE or "--watch" in args:
+        # 常驻监控模式：持续复测并通过本地HTTP服务提供最新播放列表（Ctrl+C退出）
+        WatchService().run()
+    elif "--shard" in args:
+        # 分片测速（CI矩阵的每个任务/每台机器运行一片）：只写分片结果文件，由 --merge 合并输出
+        run_shard(*parse_shard_spec(args[args.index("--shard") + 1]))
+    elif "--merge" in args:
+        # 合并分片结果：未指定文件时读取当前目录下全部分片结果文件
+        merge_shards([arg for arg in args[args.index("--merge") + 1:] if not arg.startswith("--")])
+        run_metrics.export()
     else:
-        print("❌ 无法获取M3U源文件，请检查网络连接或地址是否正确")
+        shard_processes = int(args[args.index("--shards") + 1]) if "--shards" in args else SHARD_PROCESSES
+        if shard_processes > 1:
+            run_local_shards(shard_processes)
+        else:
+            # 主流程执行（获取+解析+增量对比，流式流水线下解析与测速同时进行）
+            raw_channel_list = load_all_sources(M3U_SOURCES)
+            if raw_channel_list is None:
+                print("❌ 无法获取M3U源文件，请检查网络连接或地址是否正确")
+            else:
+                write_outputs(filter_and_sort_channels(raw_channel_list))
+                # 结果文件完整写入后才删除中断恢复日志，写入前被中断时下次运行仍可回放
+                discard_probe_journal()
+        
+        # 导出本轮运行指标（获取失败时同样导出，便于定位源列表获取耗时/失败）
+        run_metrics.export()
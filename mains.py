@@ -3,21 +3,53 @@ import json
 import time
 import random
 import hashlib
-import re
-import unicodedata
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from collections import defaultdict
+from urllib.parse import urlparse, parse_qs
 import os
+import http_client
+import hls
+import epg
+import classify
 
 # -------------------------- 全局配置（Win7 32位+咪咕最新接口） --------------------------
 # 关闭SSL警告
 requests.packages.urllib3.disable_warnings()
 
-# 核心配置（单线程+长间隔，避免风控）
-thread_mum = 1  # 强制单线程，降低风控概率
-DELAY = 3  # 每个频道请求间隔3秒，适配咪咕风控
+# 核心配置（默认单线程+自适应限速，避免风控；可选多线程）
+thread_mum = 1  # 默认单线程，降低风控概率；设为大于1时分类列表与播放链接并发获取，请求速率由自适应限速统一控制
+DELAY = 3  # 初始请求间隔3秒（自适应限速的起始速率），接口正常时逐步提速，异常时自动降速
 TIMEOUT = 30  # 超时时间延长到30秒
 
+# 自适应限速配置（令牌桶+加性增/乘性减）
+RATE_MIN = 0.2  # 最低请求速率（次/秒），即最长5秒一次
+RATE_MAX = 5.0  # 最高请求速率（次/秒）
+RATE_INCREASE = 0.1  # 接口返回code=200时速率加性增加（次/秒）
+RATE_DECREASE = 0.5  # 请求失败/非200时速率乘以该系数
+RATE_THROTTLED_PAUSE = 30  # 触发风控（HTTP 429/403）且无Retry-After时暂停请求的秒数
+
+# 播放链接缓存配置（pID→302后的最终地址，按签名地址自带的有效期复用，有效期内跳过两次接口请求）
+PLAY_URL_CACHE_FILE = 'migu_playurl_cache.json'
+PLAY_URL_CACHE_MARGIN = 300  # 距签名过期不足300秒的缓存视为失效，留出播放端拉流余量
+PLAY_URL_ISSUED_TTL = 3600  # 签名地址只带签发时间（如timestamp=20260101120000）时，按签发后1小时有效计算
+PLAY_URL_EXPIRY_PARAMS = ('expires', 'expire', 'e', 'wstime', 'deadline')  # 携带过期时间（Unix秒）的参数名（不区分大小写）
+PLAY_URL_ISSUED_PARAMS = ('timestamp',)  # 携带签发时间（YYYYMMDDHHMMSS或Unix秒）的参数名（不区分大小写）
+
+# 播放地址清晰度配置（rateType越大清晰度越高，xh265=true时优先返回H265编码）
+PLAY_RATE_TYPE = 3  # 关闭码率阶梯测速时固定请求的清晰度
+PLAY_H265 = True  # 关闭码率阶梯测速时是否请求H265编码
+
+# 码率阶梯测速配置（可选）：每个pID并发解析多个清晰度/编码的播放地址，从高到低逐个短时下载测速，选用达标的最高清晰度
+LADDER_ENABLED = False  # 是否启用码率阶梯测速（启用后每个频道的接口请求数为候选数量，仍受自适应限速控制）
+LADDER_VARIANTS = [(4, True), (3, True), (3, False), (2, False)]  # 候选 (rateType, 是否H265)，按清晰度从高到低排列
+LADDER_MIN_SPEED = 1024  # 达标速度（KB/s），测速不低于该值的最高清晰度作为主用地址
+LADDER_TEST_BYTES = 256 * 1024  # 每个候选测速下载的媒体数据量（字节），HLS地址下载最新的一个分片
+LADDER_TEST_TIMEOUT = 8  # 单个候选测速的总时限（秒），包含跟进HLS播放列表的请求
+LADDER_STALL_TIMEOUT = 2  # 测速中单次等待数据的最长时间（秒），超过视为卡顿并结束读取（总时限最多因此延长这么久）
+LADDER_FALLBACKS = 1  # 主用地址之后再写入几个测速可用的更低清晰度作为备用（TXT中以#拼接），0为不写备用
+
 # 最新咪咕H5请求头（2026年可用版本）
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36",
@@ -51,94 +83,179 @@ LIVE = {
     '少儿': 'fc2f5b8fd7db43ff88c4243e731ecede',
     '纪实': 'e1165138bdaa44b9a3138d74af6c6673'
 }
+# 输出分类顺序（各分类的关键词与分类内排序方式见 classify_rules.json 的 "mains" 一组）
+CATEGORY_ORDER = ['📺央视频道', '📡卫视频道', '🐼熊猫频道', '🎬影音娱乐', '📰生活资讯']
 
 # 输出路径
 m3u_path = 'migu.m3u'
 txt_path = 'migu.txt'
-M3U_HEADER = '#EXTM3U\n'
+epg_path = 'epg.xml'  # 精简节目单（只含本次抓取到的频道，同时生成epg.xml.gz），M3U中每个频道写入对应的tvg-id
+
+# 节目单配置（XMLTV源支持远程地址/本地文件/.gz，按顺序匹配，同一频道采用第一个匹配到的源；设为空列表不生成节目单）
+EPG_SOURCES = [
+    'http://epg.51zmt.top:8000/e.xml.gz',
+]
+EPG_PUBLIC_URL = None  # 写入M3U文件头x-tvg-url的节目单地址（应指向发布后的epg.xml.gz），设为None不写入
+M3U_HEADER = f'#EXTM3U x-tvg-url="{EPG_PUBLIC_URL}"\n' if EPG_SOURCES and EPG_PUBLIC_URL else '#EXTM3U\n'
+
+# 咪咕接口地址（分类频道列表 / v3播放地址），接口域名在启动时并发预解析
+MIGU_LIST_API = 'https://program-sc.miguvideo.com/live/v2/tv-data/{category_id}'
+MIGU_PLAY_API = 'https://webapi.miguvideo.com/gateway/playurl/v3/play/playurl?contId={pid}&rateType={rate_type}&xh265={h265}'
+
+# 接口请求复用keep-alive连接（连接池大小与并发请求数一致）；302跳转解析与测速单独一个会话，只带UA
+session_pool_size = thread_mum * (len(LADDER_VARIANTS) if LADDER_ENABLED else 1)
+api_session = http_client.create_session(headers=headers, pool_maxsize=session_pool_size)
+redirect_session = http_client.create_session(headers={"User-Agent": headers["User-Agent"]}, pool_maxsize=session_pool_size)
+
+# -------------------------- 自适应限速（令牌桶+AIMD） --------------------------
+class AdaptiveRateLimiter:
+    """令牌桶限速器（线程安全）：接口正常时加性提速，失败/非200时乘性降速，触发风控时暂停"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一个请求令牌，令牌不足时等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # 令牌桶容量为1，不允许长时间空闲后突发请求
+                self.tokens = min(1.0, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def on_success(self):
+        """接口返回code=200，加性提速"""
+        with self.lock:
+            self.rate = min(self.rate + RATE_INCREASE, RATE_MAX)
+
+    def on_failure(self, pause=0):
+        """请求失败/非200乘性降速；pause>0时（触发风控）暂停请求并清空令牌"""
+        with self.lock:
+            self.rate = max(self.rate * RATE_DECREASE, RATE_MIN)
+            if pause:
+                self.tokens = 0.0
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+
+rate_limiter = AdaptiveRateLimiter(1 / DELAY)
 
 # 全局变量
 channels_dict = {}
 processed_pids = set()
 valid_channels = 0  # 有效频道计数
+play_url_cache = {}  # 缓存键（pID，非默认清晰度带清晰度后缀）→ {'url': 最终地址, 'expires_at': 签名过期时间}，main()启动时从缓存文件加载
+ladder_test_lock = threading.Lock()  # 码率阶梯测速逐个进行，多线程抓取时各频道的测速不互相抢占带宽
 
 
 # -------------------------- 排序与分类函数（保留） --------------------------
-def extract_cctv_number(channel_name):
-    match = re.search(r'CCTV[-\s]?(\d+)', channel_name)
-    if match:
-        try:
-            return int(match.group(1))
-        except:
-            return 999
-    if 'CCTV' in channel_name:
-        cgtn_map = {'法语': 1001, '西班牙语': 1002, '俄语': 1003, '阿拉伯语': 1004, '外语纪录': 1005}
-        for k, v in cgtn_map.items():
-            if k in channel_name:
-                return v
-        return 1000
-    return 9999
-
-
-def extract_panda_number(channel_name):
-    zero_match = re.search(r'熊猫0(\d+)', channel_name)
-    if zero_match:
-        try:
-            return (0, int(zero_match.group(1)))
-        except:
-            return (999, 999)
-    normal_match = re.search(r'熊猫(\d+)', channel_name)
-    if normal_match:
+# 频道分类器（规则编译一次，按频道名缓存分类结果，一次返回分类与排序键）
+channel_classifier = classify.load_classifier("mains", CATEGORY_ORDER)
+
+
+# -------------------------- 播放链接缓存（按签名有效期复用） --------------------------
+def parse_signed_time(value):
+    """解析签名参数中的时间：Unix秒（10位）/毫秒（13位）/YYYYMMDDHHMMSS；无法识别返回None"""
+    value = value.strip()
+    if not value.isdigit():
+        return None
+    if len(value) == 14:
         try:
-            return (1, int(normal_match.group(1)))
-        except:
-            return (999, 999)
-    return (9999, 9999)
+            return datetime.strptime(value, '%Y%m%d%H%M%S').timestamp()
+        except ValueError:
+            return None
+    if len(value) == 13:
+        return int(value) / 1000
+    if len(value) == 10:
+        return float(value)
+    return None
+
+
+def get_url_expiry(url):
+    """从签名地址的查询参数中提取过期时间（Unix秒）；找不到有效期信息返回None（该地址不缓存）"""
+    params = {key.lower(): values[0] for key, values in parse_qs(urlparse(url).query).items() if values}
+    for key in PLAY_URL_EXPIRY_PARAMS:
+        expires_at = parse_signed_time(params.get(key, ''))
+        if expires_at:
+            return expires_at
+    for key in PLAY_URL_ISSUED_PARAMS:
+        issued_at = parse_signed_time(params.get(key, ''))
+        if issued_at:
+            return issued_at + PLAY_URL_ISSUED_TTL
+    return None
+
+
+def load_play_url_cache():
+    """读取播放链接缓存，丢弃已过期（含余量）的条目"""
+    try:
+        with open(PLAY_URL_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {
+        pid: entry for pid, entry in cache.items()
+        if isinstance(entry, dict) and entry.get('expires_at', 0) - PLAY_URL_CACHE_MARGIN > now
+    }
+
+
+def save_play_url_cache():
+    """保存播放链接缓存（仅主线程在抓取结束后调用）"""
+    try:
+        with open(PLAY_URL_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(play_url_cache, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"⚠️  播放链接缓存保存失败: {str(e)[:50]}")
 
 
-def extract_satellite_first_char(channel_name):
-    if not channel_name:
-        return 'z'
-    return unicodedata.normalize('NFKC', channel_name[0])
+def play_url_cache_key(pid, rate_type, h265):
+    """播放链接缓存键：默认清晰度直接用pID（与旧缓存文件兼容），其余清晰度带 @rateType/编码 后缀"""
+    if (rate_type, h265) == (PLAY_RATE_TYPE, PLAY_H265):
+        return pid
+    return f"{pid}@{variant_name(rate_type, h265)}"
 
 
-def get_sort_key(channel_name):
-    if 'CCTV' in channel_name:
-        return (0, extract_cctv_number(channel_name), channel_name)
-    if '熊猫' in channel_name:
-        return (1, extract_panda_number(channel_name), channel_name)
-    if '卫视' in channel_name and 'CCTV' not in channel_name:
-        return (2, extract_satellite_first_char(channel_name), channel_name)
-    return (3, channel_name)
+def get_cached_play_url(pid):
+    """命中且未过期（含余量）时返回缓存的最终地址，否则返回None"""
+    entry = play_url_cache.get(pid)
+    if entry and entry['expires_at'] - PLAY_URL_CACHE_MARGIN > time.time():
+        return entry['url']
+    return None
 
 
-def smart_classify_5_categories(channel_name):
-    if channel_name in channels_dict:
-        return None
-    if '熊猫' in channel_name:
-        return '🐼熊猫频道'
-    if 'CCTV' in channel_name or 'CGTN' in channel_name:
-        return '📺央视频道'
-    if '卫视' in channel_name and 'CCTV' not in channel_name:
-        return '📡卫视频道'
-    entertainment_keywords = ['电影', '影视', '少儿', '卡通', '动漫', '综艺', '音乐', '戏曲']
-    for keyword in entertainment_keywords:
-        if keyword in channel_name:
-            return '🎬影音娱乐'
-    return '📰生活资讯'
+def cache_play_url(pid, final_url):
+    """按最终地址自带的签名有效期写入缓存；无有效期信息的地址不缓存"""
+    expires_at = get_url_expiry(final_url)
+    if expires_at and expires_at - PLAY_URL_CACHE_MARGIN > time.time():
+        play_url_cache[pid] = {'url': final_url, 'expires_at': expires_at}
+
+
+def resolve_redirect(raw_url):
+    """流式请求只读响应头解析302跳转，读完即关闭连接（不下载响应体）；失败时返回原地址"""
+    try:
+        with redirect_session.get(raw_url, allow_redirects=False, timeout=10, stream=True) as resp:
+            final_url = resp.headers.get('Location', raw_url)
+        if final_url.startswith('http'):
+            return final_url
+        return raw_url
+    except Exception:
+        return raw_url
 
 
 # -------------------------- 核心请求函数（修复NoneType+更换新接口） --------------------------
 def get_live_channel_list(category_id):
     """获取分类下的频道列表（修复接口请求）"""
-    url = f'https://program-sc.miguvideo.com/live/v2/tv-data/{category_id}'
+    url = MIGU_LIST_API.format(category_id=category_id)
     try:
-        resp = requests.get(
-            url,
-            headers=headers,
-            timeout=TIMEOUT,
-            verify=False
-        )
+        resp = api_session.get(url, timeout=TIMEOUT)
         resp.raise_for_status()
         resp_json = resp.json()
         # 增加空值判断
@@ -150,28 +267,47 @@ def get_live_channel_list(category_id):
         return []
 
 
-def get_play_url(pid):
-    """获取播放链接（更换咪咕v3接口+完善判空）"""
-    global valid_channels
-    # 新接口：无需复杂签名，直接请求
-    url = f'https://webapi.miguvideo.com/gateway/playurl/v3/play/playurl?contId={pid}&rateType=3&xh265=true'
-
+def request_play_api(url):
+    """请求播放地址接口（经自适应限速），按结果反馈限速器；失败/非200抛出异常"""
+    rate_limiter.acquire()  # 自适应间隔防封
+    try:
+        resp = api_session.get(url, timeout=TIMEOUT)
+    except Exception:
+        rate_limiter.on_failure()
+        raise
+    # 429/403视为触发风控：优先按Retry-After暂停
+    if resp.status_code in (429, 403):
+        retry_after = resp.headers.get('Retry-After', '')
+        rate_limiter.on_failure(pause=int(retry_after) if retry_after.isdigit() else RATE_THROTTLED_PAUSE)
+        raise Exception(f"触发风控限流: HTTP {resp.status_code}")
     try:
-        time.sleep(DELAY)  # 间隔防封
-        resp = requests.get(
-            url,
-            headers=headers,
-            timeout=TIMEOUT,
-            verify=False
-        )
         resp.raise_for_status()
         resp_json = resp.json()
-
-        # 逐层判空，避免NoneType错误
         if not resp_json:
             raise Exception("接口返回空数据")
         if resp_json.get('code') != '200':
             raise Exception(f"接口返回错误码: {resp_json.get('code')}")
+    except Exception:
+        rate_limiter.on_failure()
+        raise
+    rate_limiter.on_success()
+    return resp_json
+
+
+def get_play_url(pid, rate_type=PLAY_RATE_TYPE, h265=PLAY_H265):
+    """获取指定清晰度的播放链接（更换咪咕v3接口+完善判空），签名有效期内直接复用缓存的最终地址"""
+    cache_key = play_url_cache_key(pid, rate_type, h265)
+    cached_url = get_cached_play_url(cache_key)
+    if cached_url:
+        return cached_url
+
+    # 新接口：无需复杂签名，直接请求
+    url = MIGU_PLAY_API.format(pid=pid, rate_type=rate_type, h265='true' if h265 else 'false')
+
+    try:
+        resp_json = request_play_api(url)
+
+        # 逐层判空，避免NoneType错误
         if 'body' not in resp_json:
             raise Exception("无body字段")
         if 'urlInfo' not in resp_json['body']:
@@ -183,42 +319,146 @@ def get_play_url(pid):
         if not raw_url or raw_url == '':
             raise Exception("播放url为空")
 
-        # 处理302跳转（简化逻辑）
-        try:
-            resp_redirect = requests.get(
-                raw_url,
-                allow_redirects=False,
-                timeout=10,
-                verify=False,
-                headers={"User-Agent": headers["User-Agent"]}
-            )
-            final_url = resp_redirect.headers.get('Location', raw_url)
-            if final_url.startswith('http'):
-                return final_url
-            return raw_url
-        except:
-            return raw_url
+        # 处理302跳转（只读响应头）
+        final_url = resolve_redirect(raw_url)
+        cache_play_url(cache_key, final_url)
+        return final_url
 
     except Exception as e:
-        print(f"❌ PID {pid} 播放链接获取失败: {str(e)[:50]}")
+        print(f"❌ PID {pid} 播放链接获取失败（{variant_name(rate_type, h265)}）: {str(e)[:50]}")
         return None
 
 
+# -------------------------- 码率阶梯测速（可选，LADDER_ENABLED） --------------------------
+def variant_name(rate_type, h265):
+    """清晰度名称（记录在输出条目旁，也用作缓存键后缀），如 rateType3-H265"""
+    return f"rateType{rate_type}-{'H265' if h265 else 'H264'}"
+
+
+def read_test_bytes(resp, deadline):
+    """
+    读取响应体直到 LADDER_TEST_BYTES 字节或到达总时限，返回 (数据, 下载速度KB/s)
+    备注：计时从收到第一块数据开始（不含建连与等待响应头的时间），速度只统计第一块之后的数据；数据不足两块时速度为None；
+         读取中途卡顿超时/连接断开时保留已读到的数据，按已测得的数据量与耗时计算速度
+    """
+    data = bytearray()
+    started, first_size = None, 0
+    try:
+        for chunk in resp.iter_content(chunk_size=4 * 1024):
+            if started is None:
+                started, first_size = time.monotonic(), len(chunk)
+            data += chunk
+            if len(data) >= LADDER_TEST_BYTES or time.monotonic() >= deadline:
+                break
+    except requests.RequestException:
+        if not data:
+            raise
+    elapsed = time.monotonic() - started if started is not None else 0
+    if len(data) <= first_size or elapsed <= 0:
+        return data, None
+    return data, (len(data) - first_size) / 1024 / elapsed
+
+
+def measure_stream_speed(url):
+    """
+    短时下载测速：返回媒体数据的下载速度（KB/s），失败返回None
+    备注：响应内容为HLS播放列表时经 hls.parse_playlist 逐层跟进（主列表按BANDWIDTH取最高码率，媒体列表取最新的分片），
+         下载分片的前 LADDER_TEST_BYTES 字节；跟进播放列表与下载分片共用一个 LADDER_TEST_TIMEOUT 总时限
+         （卡住不返回数据的读取最多再等 LADDER_STALL_TIMEOUT）
+    """
+    deadline = time.monotonic() + LADDER_TEST_TIMEOUT
+    try:
+        for _ in range(3):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # 备注：requests的timeout只限制单次建连/读取，读取循环每收到一块数据检查总时限，单次读取最多等待 LADDER_STALL_TIMEOUT；
+            #      不从其他线程强制关闭响应（读取中被关闭的连接可能带着未读完的数据回到连接池，下一个请求读到错乱的响应）
+            with redirect_session.get(url, timeout=(remaining, min(remaining, LADDER_STALL_TIMEOUT)), stream=True) as resp:
+                resp.raise_for_status()
+                data, speed = read_test_bytes(resp, deadline)
+                playlist_url = resp.url
+            if not data.lstrip().startswith(b'#EXTM3U'):
+                return speed
+            kind, target = hls.parse_playlist(data.decode('utf-8', 'ignore'), playlist_url, "highest", 1)
+            url = target if kind == "variant" else target[-1][0]
+    except Exception:
+        return None
+    return None
+
+
+def resolve_rate_ladder(pid):
+    """
+    码率阶梯：并发解析全部候选清晰度的播放地址，再从高到低逐个短时下载测速
+    返回 (主用地址, 备用地址列表, 清晰度名称, 速度KB/s)，全部候选均解析失败返回None
+    备注：选用速度达到 LADDER_MIN_SPEED 的最高清晰度，其后继续测速直到凑够 LADDER_FALLBACKS 个可用的更低清晰度；
+         没有达标的清晰度时选用测速成功的最低清晰度，全部测速失败时选用首个解析成功的地址（速度记为None）
+    """
+    with ThreadPoolExecutor(max_workers=len(LADDER_VARIANTS)) as pool:
+        urls = list(pool.map(lambda variant: get_play_url(pid, *variant), LADDER_VARIANTS))
+    candidates = [(variant_name(*variant), url) for variant, url in zip(LADDER_VARIANTS, urls) if url]
+    if not candidates:
+        return None
+
+    chosen, below_threshold, fallbacks = None, None, []
+    with ladder_test_lock:
+        for name, url in candidates:
+            if chosen and len(fallbacks) >= LADDER_FALLBACKS:
+                break
+            speed = measure_stream_speed(url)
+            if speed is None:
+                continue
+            if chosen:
+                fallbacks.append(url)
+            elif speed >= LADDER_MIN_SPEED:
+                chosen = (url, name, speed)
+            else:
+                below_threshold = (url, name, speed)
+    url, name, speed = chosen or below_threshold or (candidates[0][1], candidates[0][0], None)
+    return url, fallbacks, name, speed
+
+
+def resolve_channel_stream(pid):
+    """
+    解析频道的播放地址，返回 (主用地址, 备用地址列表, 清晰度名称, 速度KB/s)，获取失败返回None
+    备注：未启用码率阶梯测速时只请求默认清晰度，不测速（速度记为None）
+    """
+    if LADDER_ENABLED:
+        return resolve_rate_ladder(pid)
+    playurl = get_play_url(pid)
+    if not playurl:
+        return None
+    return playurl, [], variant_name(PLAY_RATE_TYPE, PLAY_H265), None
+
+
 def process_channel(channel_data):
     """处理单个频道（完善容错）"""
-    global valid_channels
     try:
         # 提取核心字段并判空
         pid = channel_data.get('pID')
-        ch_name = channel_data.get('name', '未知频道')
         if not pid or pid in processed_pids:
             return
         processed_pids.add(pid)
 
         # 获取播放链接
-        playurl = get_play_url(pid)
-        if not playurl:
+        stream = resolve_channel_stream(pid)
+        if not stream:
             return
+        register_channel(channel_data, *stream)
+
+    except Exception as e:
+        ch_name = channel_data.get('name', '未知频道')
+        print(f"❌ 频道 {ch_name} 处理失败: {str(e)[:50]}")
+
+
+def register_channel(channel_data, playurl, backup_urls=(), variant=None, speed=None):
+    """
+    登记已获取播放链接的频道（修正频道名+分类+排序键），同名频道先登记者保留；仅在主线程调用
+    备注：清晰度名称与测速速度（KB/s，未测速为None）记录在 channels_dict 条目末尾，备用地址以#拼接在TXT主用链接之后
+    """
+    global valid_channels
+    try:
+        ch_name = channel_data.get('name', '未知频道')
 
         # 处理频道名
         if "CCTV" in ch_name and "CCTV-" not in ch_name:
@@ -226,39 +466,29 @@ def process_channel(channel_data):
         if "熊猫" in ch_name:
             ch_name = ch_name.replace("高清", "")
 
-        # 分类与排序
-        category = smart_classify_5_categories(ch_name)
-        if category is None:
+        # 分类与排序（同名频道已登记时跳过）
+        if ch_name in channels_dict:
             return
-        sort_key = get_sort_key(ch_name)
+        category, sort_key = channel_classifier.classify(ch_name)
 
-        # 构造输出条目
-        m3u_item = f'#EXTINF:-1 group-title="{category}",{ch_name}\n{playurl}\n'
-        txt_item = f"{ch_name},{playurl}\n"
+        # 构造输出条目（生成节目单时带tvg-id，与节目单频道ID一致）
+        tvg_id = f' tvg-id="{classify.epg_channel_id(ch_name)}"' if EPG_SOURCES else ''
+        m3u_item = f'#EXTINF:-1{tvg_id} group-title="{category}",{ch_name}\n{playurl}\n'
+        txt_item = f"{ch_name},{'#'.join([playurl, *backup_urls])}\n"
 
-        channels_dict[ch_name] = [m3u_item, txt_item, category, sort_key]
+        channels_dict[ch_name] = [m3u_item, txt_item, category, sort_key, variant, speed]
         valid_channels += 1
-        print(f'✅ 成功抓取: [{category}] {ch_name}')
+        speed_info = f" {variant} {speed:.0f}KB/s" if speed is not None else ""
+        print(f'✅ 成功抓取: [{category}] {ch_name}{speed_info}')
 
     except Exception as e:
         ch_name = channel_data.get('name', '未知频道')
         print(f"❌ 频道 {ch_name} 处理失败: {str(e)[:50]}")
 
 
-# -------------------------- 主函数（单线程+逐分类抓取） --------------------------
-def main():
-    print("=" * 60)
-    print("🚀 咪咕直播源抓取（Win7 32位终极修复版）")
-    print("⚠️  单线程+3秒间隔，避免咪咕风控拦截")
-    print("=" * 60)
-
-    # 初始化输出文件
-    with open(m3u_path, 'w', encoding='utf-8') as f:
-        f.write(M3U_HEADER)
-    with open(txt_path, 'w', encoding='utf-8') as f:
-        f.write("")
-
-    # 逐分类抓取（单线程）
+# -------------------------- 单线程抓取（逐分类逐频道） --------------------------
+def crawl_serially():
+    """单线程抓取：逐分类获取频道列表并逐频道解析"""
     for live in lives:
         print(f"\n📌 开始抓取分类: {live}")
         category_id = LIVE.get(live)
@@ -277,17 +507,83 @@ def main():
         for channel_data in channel_list:
             process_channel(channel_data)
 
+
+# -------------------------- 多线程抓取（分类列表并发获取+pID去重+播放链接并发解析） --------------------------
+def collect_unique_channels(category_lists):
+    """按分类顺序合并频道列表并按pID去重（保留首次出现），顺序与单线程模式的处理顺序完全一致"""
+    unique_channels = []
+    for channel_list in category_lists:
+        for channel_data in channel_list:
+            pid = channel_data.get('pID')
+            if not pid or pid in processed_pids:
+                continue
+            processed_pids.add(pid)
+            unique_channels.append(channel_data)
+    return unique_channels
+
+
+def crawl_concurrently():
+    """
+    多线程抓取：并发获取全部分类列表 → 跨分类pID去重 → 线程池并发解析播放链接（共用自适应限速）
+    备注：解析结果按单线程模式的顺序登记，同名频道取舍与输出文件和单线程模式完全一致
+    """
+    with ThreadPoolExecutor(max_workers=thread_mum) as pool:
+        valid_lives = [live for live in lives if LIVE.get(live)]
+        for live in lives:
+            if not LIVE.get(live):
+                print(f"❌ 分类 {live} 无对应ID，跳过")
+        category_lists = list(pool.map(lambda live: get_live_channel_list(LIVE[live]), valid_lives))
+        for live, channel_list in zip(valid_lives, category_lists):
+            if channel_list:
+                print(f"📥 分类 {live} 共 {len(channel_list)} 个频道待抓取")
+            else:
+                print(f"❌ 分类 {live} 无频道数据，跳过")
+
+        unique_channels = collect_unique_channels(category_lists)
+        print(f"\n📌 跨分类去重后共 {len(unique_channels)} 个频道，{thread_mum} 线程并发解析播放链接")
+        streams = list(pool.map(lambda channel_data: resolve_channel_stream(channel_data['pID']), unique_channels))
+
+    for channel_data, stream in zip(unique_channels, streams):
+        if stream:
+            register_channel(channel_data, *stream)
+
+
+# -------------------------- 主函数（单线程逐分类抓取 / 多线程并发抓取） --------------------------
+def main():
+    print("=" * 60)
+    print("🚀 咪咕直播源抓取（Win7 32位终极修复版）")
+    print(f"⚠️  {thread_mum}线程+自适应限速（初始3秒间隔，接口正常时自动提速），避免咪咕风控拦截")
+    print("=" * 60)
+
+    # 初始化输出文件
+    with open(m3u_path, 'w', encoding='utf-8') as f:
+        f.write(M3U_HEADER)
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write("")
+
+    # 启用DNS缓存并预解析咪咕接口域名
+    http_client.install_dns_cache()
+    http_client.prefetch_hosts([urlparse(MIGU_LIST_API).hostname, urlparse(MIGU_PLAY_API).hostname])
+
+    # 加载签名未过期的播放链接缓存
+    play_url_cache.update(load_play_url_cache())
+    if play_url_cache:
+        print(f"♻️  播放链接缓存可复用 {len(play_url_cache)} 个（签名有效期内跳过接口请求）")
+
+    if thread_mum > 1:
+        crawl_concurrently()
+    else:
+        crawl_serially()
+    save_play_url_cache()
+
     # 按分类排序写入文件
     category_channels = defaultdict(list)
-    for ch_name, (m3u_item, txt_item, category, sort_key) in channels_dict.items():
+    for ch_name, (m3u_item, txt_item, category, sort_key, variant, speed) in channels_dict.items():
         category_channels[category].append((sort_key, ch_name, m3u_item, txt_item))
 
-    # 分类顺序
-    category_order = ['📺央视频道', '📡卫视频道', '🐼熊猫频道', '🎬影音娱乐', '📰生活资讯']
-
     # 写入M3U
     with open(m3u_path, 'a', encoding='utf-8') as f:
-        for category in category_order:
+        for category in CATEGORY_ORDER:
             if category in category_channels:
                 category_channels[category].sort(key=lambda x: x[0])
                 for _, _, m3u_item, _ in category_channels[category]:
@@ -295,7 +591,7 @@ def main():
 
     # 写入TXT
     with open(txt_path, 'a', encoding='utf-8') as f:
-        for category in category_order:
+        for category in CATEGORY_ORDER:
             if category in category_channels and category_channels[category]:
                 f.write(f"{category},#genre#\n")
                 for _, _, _, txt_item in category_channels[category]:
@@ -308,14 +604,30 @@ def main():
     print(f"📊 有效频道数: {total_channels} 个")
     print(f"📁 M3U文件路径: {os.path.abspath(m3u_path)}")
     print(f"📁 TXT文件路径: {os.path.abspath(txt_path)}")
+    print(f"⏱️  结束时请求速率: {rate_limiter.rate:.2f} 次/秒")
+
+    # 生成精简节目单（只保留本次抓取到的频道）
+    if EPG_SOURCES and channels_dict:
+        channel_keys = {classify.epg_channel_id(ch_name) for ch_name in channels_dict}
+        if epg.write_filtered_epg(EPG_SOURCES, channel_keys, classify.epg_channel_id, epg_path, redirect_session) is not None:
+            print(f"📁 节目单文件路径: {os.path.abspath(epg_path)}")
 
     # 分类统计
     print("\n📋 分类统计详情：")
-    for category in category_order:
+    for category in CATEGORY_ORDER:
         count = len(category_channels.get(category, []))
         percentage = (count / total_channels * 100) if total_channels > 0 else 0
         print(f"  {category}: {count} 个 ({percentage:.1f}%)")
 
+    # 码率阶梯测速统计（各清晰度被选为主用地址的频道数）
+    if LADDER_ENABLED and total_channels:
+        print("\n📶 清晰度选用统计：")
+        variant_counts = defaultdict(int)
+        for _, _, _, _, variant, speed in channels_dict.values():
+            variant_counts[variant if speed is not None else f"{variant}（未测速）"] += 1
+        for variant, count in variant_counts.items():
+            print(f"  {variant}: {count} 个")
+
     # 温馨提示
     if total_channels == 0:
         print("\n⚠️  未抓取到任何频道，可能原因：")